@@ -0,0 +1,196 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+# Per-segment audio cache lives next to outputs/ (not inside it, so it is never served statically)
+SEGMENT_CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", "segment_cache")
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes text so trivially different copies of a line share one cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def segment_cache_key(provider: str, voice: str, rate, pitch, style, text: str) -> str:
+    """
+    Content address of one synthesized segment.
+    Every parameter that changes the produced audio must be part of the key.
+    """
+    parts = [provider, voice, str(rate), str(pitch), str(style or ""), normalize_text(text)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, data: bytes):
+    """Writes to a temporary name and renames it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.partial"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _scan(directory: str) -> List[Tuple[float, str, int]]:
+    """(mtime, key, size) of the cached files in `directory`; removes leftovers of interrupted writes."""
+    os.makedirs(directory, exist_ok=True)
+    found = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".partial"):
+                _remove_files([path])
+                continue
+            if not name.endswith(".mp3"):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_mtime, name[:-4], st.st_size))
+    return found
+
+
+class SegmentAudioCache:
+    """
+    Content-addressed on-disk cache of per-segment MP3 bytes.
+
+    Entries are kept in least-recently-used order and the oldest ones are
+    evicted once the directory grows past `max_bytes`. Files are written to a
+    temporary name and renamed into place, so a half-written segment is never
+    served. All file access runs in worker threads, off the event loop.
+    """
+
+    def __init__(self, directory: str = SEGMENT_CACHE_DIR, max_bytes: int = SEGMENT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    async def _load(self):
+        """Indexes what earlier processes left on disk, oldest first."""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            found = await asyncio.to_thread(_scan, self.directory)
+            for _, key, size in sorted(found):
+                self._entries[key] = size
+                self._total_bytes += size
+            self._loaded = True
+        await self._evict()
+
+    async def _add(self, key: str, size: int):
+        if key in self._entries:
+            self._total_bytes -= self._entries.pop(key)
+        self._entries[key] = size
+        self._total_bytes += size
+        await self._evict()
+
+    def _drop(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    async def _evict(self):
+        evicted = []
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            evicted.append(self._path(key))
+        if evicted:
+            await asyncio.to_thread(_remove_files, evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached audio for `key`, or None on a miss."""
+        await self._load()
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            data = await asyncio.to_thread(_read_file, path)
+        except OSError:
+            # Removed behind our back (another process evicted it)
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        await asyncio.to_thread(_touch, path)
+        self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes):
+        """Stores a fully synthesized segment."""
+        if not data:
+            return
+        await self._load()
+        await asyncio.to_thread(_write_file, self._path(key), data)
+        await self._add(key, len(data))
+
+    async def stream(self, key: str, produce: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """
+        Yields the audio for `key`: straight from disk on a hit, otherwise from
+        `produce()` while keeping a copy of the chunks (one segment's audio),
+        which is stored once the producer finishes. Nothing is stored if the
+        producer fails or the consumer stops early.
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        async for data in produce():
+            chunks.append(data)
+            yield data
+        await self.put(key, b"".join(chunks))
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Shared by the edge-tts and Bhashini paths
+segment_cache = SegmentAudioCache()
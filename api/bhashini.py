@@ -1,89 +1,188 @@
 import os
-import requests
+import re
+import time
+import random
+import asyncio
 import json
+import httpx
 from fastapi import HTTPException
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional
+from api.audio_cache import segment_cache, segment_cache_key
+from metrics import bhashini_request_seconds, bhashini_retries, bhashini_failures
+from logs import get_logger
+
+log = get_logger(__name__)
 
 # Bhashini API configuration
 BHASHINI_API_KEY = os.getenv("BHASHINI_API_KEY", "")
 BHASHINI_ENDPOINT = os.getenv("BHASHINI_ENDPOINT", "https://tts.bhashini.ai/v1")
 BHASHINI_VOICES_URL = "https://app.bhashini.ai/voices.json"
 
-# Cache for voice configuration
+# HTTP client tuning
+BHASHINI_TIMEOUT = float(os.getenv("BHASHINI_TIMEOUT", "30"))
+BHASHINI_MAX_CONCURRENCY = int(os.getenv("BHASHINI_MAX_CONCURRENCY", "8"))
+BHASHINI_MAX_RETRIES = int(os.getenv("BHASHINI_MAX_RETRIES", "3"))
+BHASHINI_BACKOFF_BASE = float(os.getenv("BHASHINI_BACKOFF_BASE", "0.5"))
+BHASHINI_MAX_BACKOFF = float(os.getenv("BHASHINI_MAX_BACKOFF", "8"))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Longer texts are split into several requests that run in parallel
+BHASHINI_MAX_CHARS = int(os.getenv("BHASHINI_MAX_CHARS", "500"))
+
+# Sentence ends: Latin punctuation followed by a space, or the Indic danda/double danda
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|(?<=[।॥])\s*')
+
+_http_client: Optional[httpx.AsyncClient] = None
+_request_slots = asyncio.Semaphore(BHASHINI_MAX_CONCURRENCY)
+
+# Voice catalog cache (stale-while-revalidate)
+VOICE_CATALOG_TTL = int(os.getenv("BHASHINI_VOICES_TTL_SECONDS", str(6 * 60 * 60)))
+VOICE_CATALOG_RETRY_SECONDS = int(os.getenv("BHASHINI_VOICES_RETRY_SECONDS", "300"))
+VOICE_CATALOG_FILE = os.getenv("BHASHINI_VOICES_FILE", "voices.json")
+
 _voice_config_cache: Optional[Dict] = None
+_voice_config_loaded_at: Optional[float] = None  # monotonic time of the last successful fetch; None = disk copy or nothing
+_voice_fetch_failed_at: Optional[float] = None
+_voice_refresh_task: Optional[asyncio.Task] = None
 
-async def fetch_voice_configuration():
+def parse_voice_configuration(voices_data: Dict) -> Optional[Dict]:
     """
-    Fetches the voice configuration from Bhashini voices.json.
-    Returns a mapping of languages to available voices and their supported styles.
+    Turns a voices.json document into our voice configuration.
+    Returns None if the document has no usable voices.
     """
-    global _voice_config_cache
-    
-    # Return cached config if available
-    if _voice_config_cache is not None:
-        return _voice_config_cache
+    # Parse the voices array
+    # Structure: {"voices": [{"id": "kn-f1", "name": "Kannada Female 1", "nativeLanguage": "Kannada", "supportedStyles": [...]}]}
+    config = {
+        "languages": [],
+        "voices": {},
+        "styles": {},
+        "voice_map": {}  # Maps voice name to voice ID
+    }
     
-    try:
-        response = requests.get(BHASHINI_VOICES_URL, timeout=10)
-        response.raise_for_status()
-        voices_data = response.json()
+    if not isinstance(voices_data, dict) or not isinstance(voices_data.get("voices"), list):
+        log.warning("Invalid voices.json structure")
+        return None
+
+    lang_set = set()
+    for voice in voices_data["voices"]:
+        voice_id = voice.get("id", "")
+        voice_name = voice.get("name", "")
+        native_lang = voice.get("nativeLanguage", "")
+        supported_styles = voice.get("supportedStyles", ["Neutral"])
         
-        # Parse the voices array
-        # Structure: {"voices": [{"id": "kn-f1", "name": "Kannada Female 1", "nativeLanguage": "Kannada", "supportedStyles": [...]}]}
-        config = {
-            "languages": [],
-            "voices": {},
-            "styles": {},
-            "voice_map": {}  # Maps voice name to voice ID
-        }
+        if not native_lang:
+            continue
         
-        if "voices" in voices_data and isinstance(voices_data["voices"], list):
-            voices_list = voices_data["voices"]
-            lang_set = set()
-            
-            for voice in voices_list:
-                voice_id = voice.get("id", "")
-                voice_name = voice.get("name", "")
-                native_lang = voice.get("nativeLanguage", "")
-                supported_styles = voice.get("supportedStyles", ["Neutral"])
-                
-                if not native_lang:
-                    continue
-                
-                lang_set.add(native_lang)
-                
-                # Initialize language in voices dict
-                if native_lang not in config["voices"]:
-                    config["voices"][native_lang] = []
-                
-                # Add voice name to the language's voice list
-                config["voices"][native_lang].append(voice_name)
-                
-                # Map voice name to voice ID
-                config["voice_map"][voice_name] = voice_id
-                
-                # Store supported styles for this voice
-                config["styles"][voice_name] = supported_styles
-            
-            # Create languages list
-            config["languages"] = [{"code": lang.lower()[:2], "name": lang} for lang in sorted(lang_set)]
-            
-            # If no voices found, use fallback
-            if not config["voices"]:
-                print("WARNING: No voices found in voices.json, using fallback")
-                return get_default_bhashini_config()
-        else:
-            print("WARNING: Invalid voices.json structure, using fallback")
-            return get_default_bhashini_config()
+        lang_set.add(native_lang)
         
-        _voice_config_cache = config
-        print(f"✅ Loaded {len(voices_list)} voices from Bhashini for {len(lang_set)} languages")
-        return config
+        # Initialize language in voices dict
+        if native_lang not in config["voices"]:
+            config["voices"][native_lang] = []
+        
+        # Add voice name to the language's voice list
+        config["voices"][native_lang].append(voice_name)
+        
+        # Map voice name to voice ID
+        config["voice_map"][voice_name] = voice_id
         
+        # Store supported styles for this voice
+        config["styles"][voice_name] = supported_styles
+    
+    # Create languages list
+    config["languages"] = [{"code": lang.lower()[:2], "name": lang} for lang in sorted(lang_set)]
+    
+    if not config["voices"]:
+        log.warning("No voices found in voices.json")
+        return None
+    return config
+
+def _read_voice_file() -> Optional[Dict]:
+    try:
+        with open(VOICE_CATALOG_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_voice_file(voices_data: Dict):
+    tmp_path = f"{VOICE_CATALOG_FILE}.partial"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(voices_data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, VOICE_CATALOG_FILE)
+
+def _load_voice_file():
+    """Seeds the cache from the last good copy on disk (served as stale until refreshed)."""
+    global _voice_config_cache
+    if _voice_config_cache is not None:
+        return
+    voices_data = _read_voice_file()
+    config = parse_voice_configuration(voices_data) if voices_data else None
+    if config:
+        _voice_config_cache = config
+        log.info("Loaded Bhashini voices from file", voices=len(voices_data["voices"]), path=VOICE_CATALOG_FILE)
+
+async def _refresh_voice_configuration():
+    global _voice_config_cache, _voice_config_loaded_at, _voice_fetch_failed_at
+    try:
+        response = await get_http_client().get(BHASHINI_VOICES_URL, timeout=10)
+        response.raise_for_status()
+        voices_data = response.json()
+        config = parse_voice_configuration(voices_data)
+        if config is None:
+            raise ValueError("voices.json has no usable voices")
     except Exception as e:
-        print(f"Failed to fetch Bhashini voice configuration: {str(e)}")
-        # Return default configuration as fallback
-        return get_default_bhashini_config()
+        # Negative cache: don't retry until the backoff window has passed
+        _voice_fetch_failed_at = time.monotonic()
+        log.warning("Failed to fetch Bhashini voice configuration", error=str(e))
+        return
+
+    _voice_config_cache = config
+    _voice_config_loaded_at = time.monotonic()
+    _voice_fetch_failed_at = None
+    log.info("Loaded Bhashini voices", voices=len(voices_data["voices"]), languages=len(config["languages"]))
+    try:
+        await asyncio.to_thread(_write_voice_file, voices_data)
+    except OSError as e:
+        log.warning("Could not persist Bhashini voices", path=VOICE_CATALOG_FILE, error=str(e))
+
+def _refresh_in_background() -> asyncio.Task:
+    """Single-flight: concurrent callers share one in-progress fetch."""
+    global _voice_refresh_task
+    if _voice_refresh_task is None or _voice_refresh_task.done():
+        _voice_refresh_task = asyncio.create_task(_refresh_voice_configuration())
+    return _voice_refresh_task
+
+def _in_fetch_backoff(now: float) -> bool:
+    return _voice_fetch_failed_at is not None and now - _voice_fetch_failed_at < VOICE_CATALOG_RETRY_SECONDS
+
+def start_voice_catalog_prefetch():
+    """Called at startup: loads the on-disk copy and refreshes it in the background."""
+    _load_voice_file()
+    _refresh_in_background()
+
+async def fetch_voice_configuration():
+    """
+    Returns the voice configuration from Bhashini voices.json: a mapping of
+    languages to available voices and their supported styles.
+
+    Never waits on the network when any copy is available: a stale catalog is
+    returned immediately while one shared background fetch refreshes it. Only a
+    cold start with no on-disk copy waits for the fetch. Failed fetches are not
+    retried for VOICE_CATALOG_RETRY_SECONDS, during which the built-in default
+    configuration is used if nothing else is available.
+    """
+    now = time.monotonic()
+    _load_voice_file()
+
+    if _voice_config_cache is None:
+        if not _in_fetch_backoff(now):
+            await asyncio.shield(_refresh_in_background())
+        # Fallback when the catalog is unavailable
+        return _voice_config_cache or get_default_bhashini_config()
+
+    is_stale = _voice_config_loaded_at is None or now - _voice_config_loaded_at > VOICE_CATALOG_TTL
+    if is_stale and not _in_fetch_backoff(now):
+        _refresh_in_background()
+    return _voice_config_cache
 
 def get_default_bhashini_config():
     """
@@ -194,32 +293,71 @@ def map_persona_to_voice_id(persona_name: str, language_code: str) -> str:
     voice_id = f"{language_code}-{gender}{number}"
     return voice_id
 
-async def generate_bhashini_audio(
-    text: str, 
-    language: str, 
-    voice_id: str,
-    voice_style: str = "Neutral",
-    speech_rate: float = 1.0
-) -> bytes:
+def split_text_for_synthesis(text: str, max_chars: int = BHASHINI_MAX_CHARS) -> List[str]:
     """
-    Generates audio using the Bhashini TTS API.
-    
-    Args:
-        text: The text to synthesize
-        language: Language name (e.g., "Hindi", "Kannada")
-        voice_id: The persona/voice name (e.g., "Hindi Female 3", "Kannada Female 1")
-        voice_style: The speaking style (e.g., "Neutral", "Book", "Conversational")
-        speech_rate: Speech rate multiplier (default 1.0 for normal speed)
-    
-    Returns:
-        Audio data as bytes
+    Splits text into chunks of at most `max_chars`, breaking at sentence boundaries
+    (including the danda `।`). A single sentence that is still too long is broken
+    at the last space before the limit.
     """
-    if not BHASHINI_API_KEY:
-        raise HTTPException(
-            status_code=500, 
-            detail="Bhashini API Key not configured. Please set BHASHINI_API_KEY in environment variables."
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Shared async client for Bhashini calls. Connections are kept alive and
+    pooled across requests instead of a new TCP/TLS handshake per synthesis.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(BHASHINI_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=BHASHINI_MAX_CONCURRENCY,
+                max_keepalive_connections=BHASHINI_MAX_CONCURRENCY
+            )
         )
-    
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Honors Retry-After when Bhashini sends one, otherwise exponential backoff with full jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BHASHINI_MAX_BACKOFF)
+    return random.uniform(0, min(BHASHINI_MAX_BACKOFF, BHASHINI_BACKOFF_BASE * (2 ** attempt)))
+
+async def _resolve_voice_id(voice_id: str) -> str:
    # Get voice configuration to map voice name to ID
     config = await fetch_voice_configuration()
     voice_map = config.get("voice_map", {})
@@ -230,15 +368,112 @@ async def generate_bhashini_audio(
     if not bhashini_voice_id:
         # Fallback: Try to use voice_id directly in case it's already an ID
         bhashini_voice_id = voice_id
-        print(f"WARNING: Voice '{voice_id}' not found in voice_map, using directly as ID")
-    
-    print(f"DEBUG Bhashini: Language='{language}', VoiceName='{voice_id}' -> VoiceID='{bhashini_voice_id}', Style='{voice_style}'")
-    
-    # Prepare request headers
+        log.warning("Voice not found in voice_map, using it directly as ID", voice=voice_id)
+    return bhashini_voice_id
+
+async def _request_bhashini_audio(payload: Dict) -> AsyncIterator[bytes]:
+    """
+    POSTs one synthesis request and yields the audio body as it downloads.
+    Retries 429/5xx and connection failures until the first byte has been received.
+    """
     headers = {
         "Content-Type": "application/json",
         "X-API-KEY": BHASHINI_API_KEY
     }
+    client = get_http_client()
+
+    # Set once audio went to the caller: from then on a retry would repeat it
+    received = False
+
+    # Backpressure: at most BHASHINI_MAX_CONCURRENCY calls in flight per process
+    async with _request_slots:
+        for attempt in range(BHASHINI_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            try:
+                async with client.stream("POST", f"{BHASHINI_ENDPOINT}/synthesize", headers=headers, json=payload) as response:
+                    bhashini_request_seconds.observe(time.perf_counter() - started, status=response.status_code)
+                    log.debug("Bhashini response", status=response.status_code, attempt=attempt)
+
+                    if response.status_code in RETRYABLE_STATUS and attempt < BHASHINI_MAX_RETRIES:
+                        bhashini_retries.inc(reason=f"http_{response.status_code}")
+                        delay = _retry_delay(attempt, response)
+                        log.info("Bhashini call retried", status=response.status_code, delay_s=round(delay, 2))
+                        await asyncio.sleep(delay)
+                        continue
+
+                    # Check for errors
+                    if response.status_code != 200:
+                        bhashini_failures.inc(reason=f"http_{response.status_code}")
+                        body = await response.aread()
+                        error_detail = f"Bhashini API returned status {response.status_code}"
+                        try:
+                            error_json = json.loads(body)
+                            error_detail = error_json.get("detail", error_json.get("message", error_json.get("error", error_detail)))
+                            log.warning("Bhashini error response", status=response.status_code, body=error_json)
+                        except Exception:
+                            text = body.decode("utf-8", errors="replace")
+                            error_detail = text or error_detail
+                            log.warning("Bhashini error response", status=response.status_code, body=text)
+                        
+                        raise HTTPException(
+                            status_code=response.status_code,
+                            detail=f"Bhashini TTS Error: {error_detail}"
+                        )
+
+                    async for chunk in response.aiter_bytes():
+                        if chunk:
+                            received = True
+                            yield chunk
+                    return
+
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                if received:
+                    # The connection dropped mid-body: the caller already has part of the audio
+                    bhashini_failures.inc(reason="connection")
+                    log.warning("Bhashini connection dropped mid-stream", error=type(e).__name__)
+                    raise HTTPException(
+                        status_code=502,
+                        detail="Bhashini API connection dropped while sending audio. Please try again."
+                    )
+                # Nothing was received yet, safe to retry
+                if attempt < BHASHINI_MAX_RETRIES:
+                    bhashini_retries.inc(reason="connection")
+                    delay = _retry_delay(attempt)
+                    log.info("Bhashini call retried", error=type(e).__name__, delay_s=round(delay, 2))
+                    await asyncio.sleep(delay)
+                    continue
+                bhashini_failures.inc(reason="connection")
+                raise HTTPException(
+                    status_code=503,
+                    detail="Could not connect to Bhashini API. Please check your internet connection."
+                )
+            except httpx.TimeoutException:
+                bhashini_failures.inc(reason="timeout")
+                raise HTTPException(
+                    status_code=504,
+                    detail="Bhashini API request timed out. Please try again."
+                )
+
+async def stream_bhashini_audio(
+    text: str, 
+    language: str, 
+    voice_id: str,
+    voice_style: str = "Neutral",
+    speech_rate: float = 1.0
+) -> AsyncIterator[bytes]:
+    """
+    Streams audio from the Bhashini TTS API as it downloads, so callers can
+    write it straight to the output file instead of holding it in memory.
+    Arguments are the same as generate_bhashini_audio.
+    """
+    if not BHASHINI_API_KEY:
+        raise HTTPException(
+            status_code=500, 
+            detail="Bhashini API Key not configured. Please set BHASHINI_API_KEY in environment variables."
+        )
+    
+    bhashini_voice_id = await _resolve_voice_id(voice_id)
+    log.debug("Bhashini voice resolved", language=language, voice=voice_id, voice_id=bhashini_voice_id, style=voice_style)
     
     # Prepare request payload
     payload = {
@@ -249,64 +484,53 @@ async def generate_bhashini_audio(
         "speechRate": speech_rate
     }
     
-    print(f"DEBUG Bhashini Request Payload: {payload}")
-    
+    # The story text is redacted (length and hash) by the log formatter
+    log.debug("Bhashini request", payload=payload)
+
+    # Identical lines (same voice, style and rate) are served from the segment cache
+    cache_key = segment_cache_key("bhashini", bhashini_voice_id, speech_rate, None, voice_style, text)
+    total_bytes = 0
     try:
-        # Make API request to synthesize endpoint
-        response = requests.post(
-            f"{BHASHINI_ENDPOINT}/synthesize",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        print(f"DEBUG Bhashini Response Status: {response.status_code}")
-        
-        # Check for errors
-        if response.status_code != 200:
-            error_detail = f"Bhashini API returned status {response.status_code}"
-            try:
-                error_json = response.json()
-                error_detail = error_json.get("detail", error_json.get("message", error_json.get("error", error_detail)))
-                print(f"DEBUG Bhashini Error Response: {error_json}")
-            except:
-                error_detail = response.text or error_detail
-                print(f"DEBUG Bhashini Error Text: {response.text[:500]}")
-            
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Bhashini TTS Error: {error_detail}"
-            )
-        
-        # Return the audio bytes
-        audio_data = response.content
-        
-        if not audio_data:
-            raise HTTPException(
-                status_code=500,
-                detail="Bhashini API returned empty audio data"
-            )
-        
-        print(f"✅ Bhashini TTS Success: Generated {len(audio_data)} bytes for '{text[:50]}...'")
-        return audio_data
-        
-    except requests.exceptions.Timeout:
-        raise HTTPException(
-            status_code=504,
-            detail="Bhashini API request timed out. Please try again."
-        )
-    except requests.exceptions.ConnectionError:
-        raise HTTPException(
-            status_code=503,
-            detail="Could not connect to Bhashini API. Please check your internet connection."
-        )
+        async for chunk in segment_cache.stream(cache_key, lambda: _request_bhashini_audio(payload)):
+            total_bytes += len(chunk)
+            yield chunk
     except HTTPException:
         raise  # Re-raise HTTPExceptions as-is
     except Exception as e:
-        print(f"❌ Bhashini Generation Failed: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Bhashini generation failed", voice_id=bhashini_voice_id)
         raise HTTPException(
             status_code=500,
             detail=f"Bhashini TTS Error: {str(e)}"
         )
+
+    if not total_bytes:
+        raise HTTPException(
+            status_code=500,
+            detail="Bhashini API returned empty audio data"
+        )
+    log.debug("Bhashini synthesis done", bytes=total_bytes, text=text)
+
+async def generate_bhashini_audio(
+    text: str, 
+    language: str, 
+    voice_id: str,
+    voice_style: str = "Neutral",
+    speech_rate: float = 1.0
+) -> bytes:
+    """
+    Generates audio using the Bhashini TTS API.
+    
+    Args:
+        text: The text to synthesize
+        language: Language name (e.g., "Hindi", "Kannada")
+        voice_id: The persona/voice name (e.g., "Hindi Female 3", "Kannada Female 1")
+        voice_style: The speaking style (e.g., "Neutral", "Book", "Conversational")
+        speech_rate: Speech rate multiplier (default 1.0 for normal speed)
+    
+    Returns:
+        Audio data as bytes
+    """
+    chunks = []
+    async for chunk in stream_bhashini_audio(text, language, voice_id, voice_style, speech_rate):
+        chunks.append(chunk)
+    return b"".join(chunks)
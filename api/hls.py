@@ -0,0 +1,203 @@
+import os
+import re
+import math
+import struct
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, RedirectResponse, Response
+from api.mp3 import FrameScanner
+from api.storage import storage, content_type_for
+
+# HLS rendition of long stories.
+#
+# The story's MP3 frames are cut into ~HLS_SEGMENT_SECONDS packed-audio segments
+# on frame boundaries (no re-encoding) and listed in a VOD playlist, stored under
+# hls/<story>/ next to the full MP3. Players start after the first segment and
+# seek by fetching only the segment they need.
+
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "10"))
+# Stories are packaged automatically once they are at least this long (the request can force it on or off)
+HLS_MIN_STORY_SECONDS = float(os.getenv("HLS_MIN_STORY_SECONDS", "300"))
+
+HLS_PREFIX = "hls"
+PLAYLIST_NAME = "index.m3u8"
+
+# Segment names are unique per render, so their bytes never change
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PLAYLIST_CACHE_CONTROL = "public, max-age=300"
+
+# 90 kHz MPEG-TS clock used by the packed-audio timestamp tag
+_TIMESTAMP_CLOCK = 90000
+_TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp\x00"
+
+
+def hls_folder(stem: str) -> str:
+    return f"{HLS_PREFIX}/{stem}/"
+
+
+def playlist_key(stem: str) -> str:
+    return f"{HLS_PREFIX}/{stem}/{PLAYLIST_NAME}"
+
+
+def segment_name(index: int) -> str:
+    return f"seg_{index:05d}.mp3"
+
+
+def _syncsafe(value: int) -> bytes:
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def timestamp_tag(start_seconds: float) -> bytes:
+    """
+    ID3 PRIV tag carrying the segment's start time, which HLS requires at the
+    start of every packed-audio segment.
+    """
+    timestamp = round(start_seconds * _TIMESTAMP_CLOCK) & 0x1FFFFFFFF
+    payload = _TIMESTAMP_OWNER + struct.pack(">Q", timestamp)
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+
+def build_playlist(durations: List[float]) -> str:
+    target = max(1, math.ceil(max(durations, default=HLS_SEGMENT_SECONDS)))
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{target}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    for index, duration in enumerate(durations):
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(segment_name(index))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class HlsPackager:
+    """
+    Builds the HLS rendition while the story is being written.
+
+    feed() takes the story's MP3 bytes in any chunking and cuts them into
+    segments of about `segment_seconds` of whole frames. finish() writes the
+    last segment and the playlist.
+
+    With `requested=None` the rendition is only kept for long stories: segments
+    are held in memory until the story passes HLS_MIN_STORY_SECONDS, and
+    dropped if it never does. With True they are written as soon as they are cut.
+    """
+
+    def __init__(self, stem: str, requested: Optional[bool] = None, segment_seconds: float = HLS_SEGMENT_SECONDS):
+        self.stem = stem
+        self.segment_seconds = segment_seconds
+        self.requested = requested
+        self.enabled = requested is True
+        self.durations: List[float] = []
+        self._pending: List[Tuple[bytes, float]] = []
+        self._written = 0
+        self._scanner = FrameScanner()
+        self._frames = bytearray()
+        self._frames_seconds = 0.0
+        self._elapsed = 0.0
+        # Bytes written to storage (segments and playlist)
+        self.size = 0
+
+    @property
+    def duration(self) -> float:
+        return self._elapsed + self._frames_seconds
+
+    async def _write(self, key: str, data: bytes, cache_control: str):
+        writer = storage.open_writer(key, cache_control=cache_control)
+        try:
+            await writer.write(data)
+            self.size += await writer.commit()
+        except BaseException:
+            await writer.abort()
+            raise
+
+    async def _write_pending(self):
+        for data, _ in self._pending:
+            key = hls_folder(self.stem) + segment_name(self._written)
+            await self._write(key, data, SEGMENT_CACHE_CONTROL)
+            self._written += 1
+        self._pending.clear()
+
+    async def _cut_segment(self):
+        if not self._frames:
+            return
+        self._pending.append((timestamp_tag(self._elapsed) + bytes(self._frames), self._frames_seconds))
+        self.durations.append(self._frames_seconds)
+        self._elapsed += self._frames_seconds
+        self._frames.clear()
+        self._frames_seconds = 0.0
+        if self.requested is None and not self.enabled and self._elapsed >= HLS_MIN_STORY_SECONDS:
+            self.enabled = True
+        if self.enabled:
+            await self._write_pending()
+
+    async def feed(self, data: bytes):
+        if self.requested is False:
+            return
+        for frame, header in self._scanner.feed(data):
+            self._frames += frame
+            self._frames_seconds += header.samples / header.sample_rate
+            if self._frames_seconds >= self.segment_seconds:
+                await self._cut_segment()
+
+    async def finish(self) -> Optional[str]:
+        """
+        Writes the remaining audio and the playlist. Returns the playlist key,
+        or None when no rendition was wanted (or there was no audio).
+        """
+        if self.requested is False:
+            return None
+        self._scanner.finish()
+        await self._cut_segment()
+        if not self.enabled or not self.durations:
+            self._pending.clear()
+            return None
+        key = playlist_key(self.stem)
+        await self._write(key, build_playlist(self.durations).encode("utf-8"), PLAYLIST_CACHE_CONTROL)
+        return key
+
+    async def abort(self):
+        self._pending.clear()
+        if self._written:
+            await storage.delete_prefix(hls_folder(self.stem))
+
+
+def stem_for(filename: str) -> str:
+    """Folder name of a story's rendition: its MP3 filename without the extension."""
+    return os.path.splitext(filename)[0]
+
+
+async def delete_rendition(playlist_path: str):
+    await storage.delete_prefix(os.path.dirname(playlist_path) + "/")
+
+
+router = APIRouter(prefix=f"/{HLS_PREFIX}", tags=["hls"])
+
+_SEGMENT_NAME = re.compile(r"^seg_\d{5}\.mp3$")
+
+
+@router.get("/{stem}/{name}")
+async def serve_hls(stem: str, name: str):
+    """Playlist and segments of a story's HLS rendition."""
+    if stem.startswith(".") or not (name == PLAYLIST_NAME or _SEGMENT_NAME.match(name)):
+        raise HTTPException(status_code=404, detail="Not found")
+    key = f"{HLS_PREFIX}/{stem}/{name}"
+
+    if name == PLAYLIST_NAME:
+        # Served (not redirected) so relative segment URIs resolve against this route
+        playlist = await storage.read(key)
+        if playlist is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        return Response(playlist, media_type=content_type_for(name), headers={"Cache-Control": PLAYLIST_CACHE_CONTROL})
+
+    path = storage.local_path(key)
+    if path is None:
+        return RedirectResponse(await storage.read_url(key), status_code=307)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(path, media_type="audio/mpeg", headers={"Cache-Control": SEGMENT_CACHE_CONTROL})
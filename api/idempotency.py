@@ -0,0 +1,141 @@
+import os
+import json
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+from database import get_database
+from models import TTSRequest
+from api.audio_cache import normalize_text
+from metrics import coalesced_requests, idempotent_replays
+
+# Duplicate /tts/generate requests.
+#
+# Single-flight: identical requests (same user, same payload up to whitespace)
+# that arrive while one is rendering in this process wait for that render
+# instead of starting their own, so a double click makes one story.
+#
+# Idempotency-Key: a client may send a key with the request. The response is
+# remembered in the `idempotency_keys` collection for IDEMPOTENCY_TTL_SECONDS
+# and replayed for retries with the same key, on any instance. While the first
+# request is still running elsewhere, retries get 409 and should try again.
+# Failed requests are forgotten, so a retry runs them again.
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+# A key whose request never finished (crashed process) is released after this long
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv("IDEMPOTENCY_PENDING_SECONDS", "900"))
+MAX_KEY_LENGTH = 255
+
+PENDING = "pending"
+DONE = "done"
+
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def _normalized(value):
+    if isinstance(value, str):
+        return normalize_text(value)
+    if isinstance(value, dict):
+        return {key: _normalized(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalized(item) for item in value]
+    return value
+
+
+def fingerprint(user_id: str, request: TTSRequest) -> str:
+    """Identifies a user's request by its normalized payload."""
+    payload = json.dumps(_normalized(request.model_dump()), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{user_id}\x1f{payload}".encode("utf-8")).hexdigest()
+
+
+def in_flight(key: str) -> bool:
+    return key in _inflight
+
+
+async def single_flight(key: str, run: Callable[[], Awaitable[Dict]]) -> Dict:
+    """Runs `run()` unless a call with the same key is in flight, in which case its result is shared."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(run())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        coalesced_requests.inc()
+    # A caller that goes away doesn't cancel the render the others are waiting for
+    return await asyncio.shield(task)
+
+
+def _doc_id(user_id: str, key: str) -> str:
+    return f"{user_id}:{key}"
+
+
+async def begin(user_id: str, key: str, request_fingerprint: str) -> Optional[Dict]:
+    """
+    Claims an idempotency key for a request. Returns the remembered response
+    ({"status_code", "body"}) when the key was already used for this request,
+    None when the caller should run it (which joins the render when it is
+    still in flight in this process).
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    db = await get_database()
+    doc_id = _doc_id(user_id, key)
+    now = datetime.utcnow()
+    claim = {
+        "_id": doc_id,
+        "fingerprint": request_fingerprint,
+        "status": PENDING,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS)
+    }
+    for _ in range(2):
+        try:
+            await db.idempotency_keys.insert_one(claim)
+            return None
+        except DuplicateKeyError:
+            existing = await db.idempotency_keys.find_one({"_id": doc_id})
+        if existing is None:
+            continue
+        if existing["expires_at"] <= now:
+            # Past its window (the TTL monitor runs about once a minute)
+            await db.idempotency_keys.delete_one({"_id": doc_id, "expires_at": existing["expires_at"]})
+            continue
+        if existing["fingerprint"] != request_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if existing["status"] == DONE:
+            idempotent_replays.inc()
+            return {"status_code": existing["status_code"], "body": existing["body"]}
+        if request_fingerprint in _inflight:
+            # Still rendering here: the caller's single_flight() joins that render,
+            # and its failures are handled (and the key released) like any other
+            return None
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "5"}
+        )
+    raise HTTPException(status_code=409, detail="Idempotency-Key is being claimed concurrently", headers={"Retry-After": "1"})
+
+
+async def complete(user_id: str, key: str, status_code: int, body: Dict):
+    """Remembers the response for retries with this key."""
+    db = await get_database()
+    now = datetime.utcnow()
+    await db.idempotency_keys.update_one(
+        {"_id": _doc_id(user_id, key)},
+        {"$set": {
+            "status": DONE,
+            "status_code": status_code,
+            "body": body,
+            "completed_at": now,
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+        }}
+    )
+
+
+async def release(user_id: str, key: str):
+    """Forgets a key whose request failed, so a retry runs it again."""
+    db = await get_database()
+    await db.idempotency_keys.delete_one({"_id": _doc_id(user_id, key), "status": PENDING})
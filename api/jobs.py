@@ -0,0 +1,302 @@
+import os
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from database import get_database
+from models import TTSRequest
+from api.storage import path_for_key
+from logs import get_logger, request_id_var
+
+log = get_logger(__name__)
+
+# Background rendering of long stories.
+#
+# Jobs are documents in the `tts_jobs` collection, so every uvicorn process (and
+# every instance) polls the same queue. A worker leases a job by stamping it with
+# its id and a lease expiry, and keeps extending the lease while it renders. If
+# the process dies the lease runs out and another worker picks the job up again.
+
+JOB_WORKERS = int(os.getenv("TTS_JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("TTS_JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_SECONDS = max(1, JOB_LEASE_SECONDS // 3)
+JOB_POLL_SECONDS = float(os.getenv("TTS_JOB_POLL_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("TTS_JOB_MAX_ATTEMPTS", "3"))
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+Renderer = Callable[..., Awaitable[Dict]]
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _job_query(job_id: str, user_id: str) -> Optional[Dict]:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return {"_id": ObjectId(job_id), "user_id": user_id}
+
+
+def serialize_job(job: Dict) -> Dict:
+    """Client-facing view of a job document (no request payload, no lease internals)."""
+    def iso(value):
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    return {
+        "job_id": str(job["_id"]),
+        "status": job["status"],
+        "title": job.get("title"),
+        "progress": job.get("progress", {}),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "cancel_requested": job.get("cancel_requested", False),
+        "created_at": iso(job.get("created_at")),
+        "started_at": iso(job.get("started_at")),
+        "finished_at": iso(job.get("finished_at"))
+    }
+
+
+async def enqueue_job(user_id: str, request: TTSRequest) -> str:
+    """Stores a render job and returns its id."""
+    db = await get_database()
+    now = datetime.utcnow()
+    job = {
+        "user_id": user_id,
+        "title": request.title,
+        "request": request.model_dump(exclude={"background"}),
+        "status": QUEUED,
+        "progress": {"total": 0, "done": 0, "failed": 0},
+        "result": None,
+        "result_path": None,
+        "error": None,
+        "attempts": 0,
+        "cancel_requested": False,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        # Logs of the render carry the id of the request that queued it
+        "request_id": request_id_var.get(),
+        "created_at": now,
+        "updated_at": now
+    }
+    result = await db.tts_jobs.insert_one(job)
+    if _wakeup:
+        _wakeup.set()
+    return str(result.inserted_id)
+
+
+async def get_job(job_id: str, user_id: str) -> Optional[Dict]:
+    query = _job_query(job_id, user_id)
+    if not query:
+        return None
+    db = await get_database()
+    job = await db.tts_jobs.find_one(query)
+    return serialize_job(job) if job else None
+
+
+async def cancel_job(job_id: str, user_id: str) -> Optional[Dict]:
+    """
+    Cancels a job. Queued jobs are cancelled right away; running jobs are flagged
+    and the worker holding the lease stops at its next heartbeat.
+    """
+    query = _job_query(job_id, user_id)
+    if not query:
+        return None
+    db = await get_database()
+    now = datetime.utcnow()
+
+    job = await db.tts_jobs.find_one_and_update(
+        {**query, "status": QUEUED},
+        {"$set": {"status": CANCELLED, "cancel_requested": True, "finished_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        # Running, but its worker is gone: nobody will see the flag, cancel it here
+        job = await db.tts_jobs.find_one_and_update(
+            {**query, "status": RUNNING, "lease_expires_at": {"$lt": now}},
+            {"$set": {"status": CANCELLED, "cancel_requested": True, "lease_owner": None, "finished_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+    if not job:
+        job = await db.tts_jobs.find_one_and_update(
+            {**query, "status": RUNNING},
+            {"$set": {"cancel_requested": True, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+    if not job:
+        # Already finished (or never existed)
+        job = await db.tts_jobs.find_one(query)
+    return serialize_job(job) if job else None
+
+
+class JobProgress:
+    """Progress sink handed to the renderer; mirrors segment completion into the job document."""
+
+    def __init__(self, db, job_id):
+        self.db = db
+        self.job_id = job_id
+
+    async def started(self, total: int):
+        await self.db.tts_jobs.update_one(
+            {"_id": self.job_id, "lease_owner": WORKER_ID},
+            {"$set": {"progress": {"total": total, "done": 0, "failed": 0}, "updated_at": datetime.utcnow()}}
+        )
+
+    async def segment_done(self, index: int, ok: bool):
+        field = "progress.done" if ok else "progress.failed"
+        await self.db.tts_jobs.update_one(
+            {"_id": self.job_id, "lease_owner": WORKER_ID},
+            {"$inc": {field: 1}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+
+
+async def _lease_next_job(db) -> Optional[Dict]:
+    now = datetime.utcnow()
+    return await db.tts_jobs.find_one_and_update(
+        {
+            "cancel_requested": {"$ne": True},
+            "$or": [
+                {"status": QUEUED},
+                # Lease ran out: the worker that had it is gone
+                {"status": RUNNING, "lease_expires_at": {"$lt": now}}
+            ]
+        },
+        {
+            "$set": {
+                "status": RUNNING,
+                "lease_owner": WORKER_ID,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "started_at": now,
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _finish_job(db, job_id, status: str, **fields):
+    now = datetime.utcnow()
+    await db.tts_jobs.update_one(
+        {"_id": job_id, "lease_owner": WORKER_ID},
+        {"$set": {
+            "status": status,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "finished_at": now,
+            "updated_at": now,
+            **fields
+        }}
+    )
+
+
+async def _heartbeat(db, job_id, render_task: asyncio.Task):
+    """Extends the lease while the job renders; stops the render if cancelled or the lease was lost."""
+    while not render_task.done():
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        now = datetime.utcnow()
+        job = await db.tts_jobs.find_one_and_update(
+            {"_id": job_id, "lease_owner": WORKER_ID},
+            {"$set": {"lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS), "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None or job.get("cancel_requested"):
+            render_task.cancel()
+            return
+
+
+async def _run_job(db, job: Dict, render: Renderer):
+    job_id = job["_id"]
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        await _finish_job(db, job_id, FAILED, error=f"Gave up after {JOB_MAX_ATTEMPTS} attempts")
+        return
+
+    request_id_var.set(job.get("request_id") or f"job-{job_id}")
+    log.info("Job leased", job_id=str(job_id), worker=WORKER_ID, attempt=job["attempts"])
+    request = TTSRequest(**job["request"])
+    render_task = asyncio.create_task(render(request, job["user_id"], progress=JobProgress(db, job_id)))
+    heartbeat = asyncio.create_task(_heartbeat(db, job_id, render_task))
+    try:
+        result = await render_task
+    except asyncio.CancelledError:
+        if not heartbeat.done():
+            # The worker itself is shutting down: put the job back so the next worker resumes it.
+            # A deploy isn't a failed attempt, so the lease's attempt is handed back too.
+            await db.tts_jobs.update_one(
+                {"_id": job_id, "lease_owner": WORKER_ID},
+                {"$set": {"status": QUEUED, "lease_owner": None, "lease_expires_at": None},
+                 "$inc": {"attempts": -1}}
+            )
+            raise
+        latest = await db.tts_jobs.find_one({"_id": job_id})
+        if latest and latest.get("cancel_requested"):
+            await _finish_job(db, job_id, CANCELLED)
+            log.info("Job cancelled", job_id=str(job_id))
+        else:
+            log.warning("Job lost its lease, leaving it to the new owner", job_id=str(job_id))
+        return
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        await _finish_job(db, job_id, FAILED, error=detail)
+        log.warning("Job failed", job_id=str(job_id), error=detail)
+        return
+    finally:
+        heartbeat.cancel()
+
+    await _finish_job(
+        db, job_id, COMPLETED,
+        result=result,
+        result_path=path_for_key(result["filename"])
+    )
+    log.info("Job completed", job_id=str(job_id), filename=result["filename"])
+
+
+async def _worker_loop(number: int, render: Renderer):
+    while True:
+        request_id_var.set(None)
+        try:
+            db = await get_database()
+            job = await _lease_next_job(db)
+            if job:
+                await _run_job(db, job, render)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("Job worker failed", worker=number)
+
+        # Nothing to do: sleep until the poll interval passes or a local enqueue wakes us
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers(render: Renderer, count: int = JOB_WORKERS):
+    """Starts the job workers for this process. `render` is the story renderer (tts.render_story)."""
+    global _wakeup
+    if _workers:
+        return
+    _wakeup = asyncio.Event()
+    for number in range(count):
+        _workers.append(asyncio.create_task(_worker_loop(number, render)))
+    log.info("Job workers started", workers=count, worker_id=WORKER_ID)
+
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
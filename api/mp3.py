@@ -0,0 +1,303 @@
+from array import array
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# MPEG audio frame parsing, just enough to cut and join the MP3 streams the
+# providers return (edge-tts sends MPEG-2 Layer III, 24 kHz mono) on frame
+# boundaries without decoding anything.
+
+FrameHeader = namedtuple("FrameHeader", "version layer bitrate sample_rate samples size channels")
+
+MPEG1, MPEG2, MPEG25 = 1, 2, 25
+
+_VERSIONS = {3: MPEG1, 2: MPEG2, 0: MPEG25}
+_LAYERS = {3: 1, 2: 2, 1: 3}
+
+# kbit/s by bitrate index (0 = free format, 15 = invalid)
+_BITRATES = {
+    (MPEG1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (MPEG1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (MPEG1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (MPEG2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (MPEG2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (MPEG2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {
+    MPEG1: [44100, 48000, 32000],
+    MPEG2: [22050, 24000, 16000],
+    MPEG25: [11025, 12000, 8000],
+}
+
+HEADER_SIZE = 4
+ID3V2_HEADER_SIZE = 10
+ID3V1_SIZE = 128
+
+# Xing/Info tag flags: frame count, byte count, seek table (TOC)
+XING_FRAMES = 0x01
+XING_BYTES = 0x02
+XING_TOC = 0x04
+XING_TOC_SIZE = 100
+
+
+def parse_header(data, offset: int = 0) -> Optional[FrameHeader]:
+    """Decodes the 4-byte frame header at `offset`, or returns None if there isn't a valid one."""
+    if len(data) - offset < HEADER_SIZE:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = _VERSIONS.get((b1 >> 3) & 0x03)
+    layer = _LAYERS.get((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = _BITRATES[(MPEG1 if version == MPEG1 else MPEG2, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if b3 >> 6 == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        size = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == MPEG1:
+        samples = 1152
+        size = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        size = 72 * bitrate // sample_rate + padding
+    return FrameHeader(version, layer, bitrate, sample_rate, samples, size, channels)
+
+
+def side_info_size(header: FrameHeader) -> int:
+    """Layer III side information length, i.e. where a Xing/Info tag starts after the header."""
+    if header.version == MPEG1:
+        return 17 if header.channels == 1 else 32
+    return 9 if header.channels == 1 else 17
+
+
+def is_info_frame(data, offset: int, header: FrameHeader) -> bool:
+    """True for a Xing/Info/VBRI frame: metadata dressed as a silent frame, not audio."""
+    if header.layer != 3:
+        return False
+    tag_at = offset + HEADER_SIZE + side_info_size(header)
+    if bytes(data[tag_at:tag_at + 4]) in (b"Xing", b"Info"):
+        return True
+    vbri_at = offset + HEADER_SIZE + 32
+    return bytes(data[vbri_at:vbri_at + 4]) == b"VBRI"
+
+
+def id3v2_size(data, offset: int = 0) -> Optional[int]:
+    """Total size of the ID3v2 tag at `offset` (0 if there is none, None if the header is cut off)."""
+    available = len(data) - offset
+    if available < 3:
+        return None if bytes(data[offset:offset + available]) == b"ID3"[:available] else 0
+    if bytes(data[offset:offset + 3]) != b"ID3":
+        return 0
+    if available < ID3V2_HEADER_SIZE:
+        return None
+    flags = data[offset + 5]
+    size = 0
+    for b in data[offset + 6:offset + 10]:
+        size = (size << 7) | (b & 0x7F)
+    footer = ID3V2_HEADER_SIZE if flags & 0x10 else 0
+    return ID3V2_HEADER_SIZE + size + footer
+
+
+class FrameScanner:
+    """
+    Incremental MPEG audio frame splitter.
+
+    Feed it the bytes of one or more concatenated MP3 streams in chunks of any
+    size; it yields (frame bytes, header) for every complete audio frame and
+    drops ID3v1/ID3v2 tags, Xing/Info/VBRI frames and garbage between frames.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.dropped_bytes = 0
+        self.dropped_tags = 0
+
+    def feed(self, data: bytes) -> Iterator[Tuple[bytes, FrameHeader]]:
+        self._buffer += data
+        buf = self._buffer
+        pos = 0
+        try:
+            while True:
+                remaining = len(buf) - pos
+                if remaining < HEADER_SIZE:
+                    break
+
+                tag_size = id3v2_size(buf, pos)
+                if tag_size is None:
+                    break
+                if tag_size:
+                    if remaining < tag_size:
+                        break
+                    pos += tag_size
+                    self.dropped_tags += 1
+                    continue
+
+                if buf[pos:pos + 3] == b"TAG":
+                    if remaining < ID3V1_SIZE:
+                        break
+                    pos += ID3V1_SIZE
+                    self.dropped_tags += 1
+                    continue
+
+                header = parse_header(buf, pos)
+                if header is None or header.size < HEADER_SIZE:
+                    # Not a frame: resync on the next byte
+                    pos += 1
+                    self.dropped_bytes += 1
+                    continue
+                if remaining < header.size:
+                    break
+
+                frame = bytes(buf[pos:pos + header.size])
+                pos += header.size
+                if is_info_frame(frame, 0, header):
+                    self.dropped_tags += 1
+                    continue
+                yield frame, header
+        finally:
+            del buf[:pos]
+
+    def finish(self) -> int:
+        """Ends the stream; returns how many trailing bytes were an incomplete frame (dropped)."""
+        leftover = len(self._buffer)
+        self.dropped_bytes += leftover
+        self._buffer.clear()
+        return leftover
+
+
+def iter_frames(data: bytes) -> Iterator[Tuple[bytes, FrameHeader]]:
+    """Audio frames of a complete MP3 byte string."""
+    scanner = FrameScanner()
+    yield from scanner.feed(data)
+    scanner.finish()
+
+
+def duration_seconds(frames: List[FrameHeader]) -> float:
+    return sum(header.samples / header.sample_rate for header in frames)
+
+
+def _xing_header(first: bytes, tag_size: int) -> bytes:
+    """
+    4-byte header for a Xing frame matching the stream's first frame: same
+    version, sample rate and channel mode, no CRC, no padding, and the lowest
+    bitrate at or above the stream's whose frame has room for the tag.
+    """
+    b1 = first[1] | 0x01
+    rate_bits = first[2] & 0x0C
+    for bitrate_index in range(first[2] >> 4, 15):
+        candidate = bytes([0xFF, b1, (bitrate_index << 4) | rate_bits, first[3]])
+        header = parse_header(candidate)
+        if header is not None and header.size >= HEADER_SIZE + side_info_size(header) + tag_size:
+            return candidate
+    raise ValueError("No frame size fits a Xing tag")
+
+
+def xing_frame(first: bytes, frames: int, total_bytes: int, toc: Optional[bytes] = None, vbr: bool = True) -> bytes:
+    """
+    Xing ("Info" for constant bitrate) frame describing `frames` audio frames
+    and `total_bytes` of file, for a stream whose first audio frame header is
+    `first`. Players read duration and seek positions from it instead of
+    scanning or guessing from the first frame's bitrate.
+    """
+    flags = XING_FRAMES | XING_BYTES | (XING_TOC if toc is not None else 0)
+    tag_size = 16 + (XING_TOC_SIZE if toc is not None else 0)
+    raw_header = _xing_header(first, tag_size)
+    header = parse_header(raw_header)
+
+    frame = bytearray(header.size)
+    frame[:HEADER_SIZE] = raw_header
+    tag_at = HEADER_SIZE + side_info_size(header)
+    tag = (b"Xing" if vbr else b"Info") + flags.to_bytes(4, "big") + frames.to_bytes(4, "big") + total_bytes.to_bytes(4, "big")
+    if toc is not None:
+        tag += toc
+    frame[tag_at:tag_at + len(tag)] = tag
+    return bytes(frame)
+
+
+class Mp3Assembler:
+    """
+    Joins the MP3 streams of a story's segments into one well-formed file.
+
+    feed() takes the segments' bytes in order (any chunking) and writes only
+    their audio frames to `writer`, dropping each segment's own ID3 and
+    Xing/Info/VBRI headers. A placeholder Xing frame goes first; finish()
+    patches it with the real frame count, byte count and seek table once the
+    story is complete.
+
+    Call end_segment() after each segment's audio; it records where the
+    segment lives in the file (byte offset/length and start/duration in
+    seconds), so a single segment can later be served as a byte range.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.segments: List[Dict] = []
+        self.frames = 0
+        self.size = 0
+        self.duration = 0.0
+        self._scanner = FrameScanner()
+        self._first: Optional[bytes] = None
+        self._bitrates = set()
+        # File offset of every audio frame, for the seek table
+        self._offsets = array("Q")
+        self._segment: Optional[Dict] = None
+
+    async def feed(self, data: bytes):
+        out = bytearray()
+        for frame, header in self._scanner.feed(data):
+            if self._first is None:
+                self._first = frame[:HEADER_SIZE]
+                placeholder = xing_frame(self._first, 0, 0, bytes(XING_TOC_SIZE))
+                out += placeholder
+                self.size += len(placeholder)
+            if self._segment is None:
+                self._segment = {"offset": self.size, "start": self.duration, "frames": 0}
+            self._offsets.append(self.size)
+            self._bitrates.add(header.bitrate)
+            self._segment["frames"] += 1
+            self.frames += 1
+            self.size += len(frame)
+            self.duration += header.samples / header.sample_rate
+            out += frame
+        if out:
+            await self.writer.write(bytes(out))
+
+    async def end_segment(self, index: int, ok: bool = True):
+        """Closes the current segment (same signature as OrderedSynthesis's on_segment)."""
+        # A segment's cut-off last frame must not be glued to the next segment's first bytes
+        self._scanner.finish()
+        segment = self._segment
+        if segment is None:
+            return
+        self.segments.append({
+            "index": index,
+            "start": round(segment["start"], 3),
+            "duration": round(self.duration - segment["start"], 3),
+            "offset": segment["offset"],
+            "length": self.size - segment["offset"],
+            "frames": segment["frames"]
+        })
+        self._segment = None
+
+    def _toc(self) -> bytes:
+        toc = bytearray(XING_TOC_SIZE)
+        for i in range(XING_TOC_SIZE):
+            offset = self._offsets[min(self.frames - 1, i * self.frames // XING_TOC_SIZE)]
+            toc[i] = min(255, offset * 256 // self.size)
+        return bytes(toc)
+
+    async def finish(self):
+        """Writes the final Xing header over the placeholder. Call before committing the writer."""
+        if self._segment is not None:
+            await self.end_segment(self.segments[-1]["index"] + 1 if self.segments else 0)
+        if self._first is None:
+            return
+        vbr = len(self._bitrates) > 1
+        await self.writer.patch(0, xing_frame(self._first, self.frames, self.size, self._toc(), vbr))
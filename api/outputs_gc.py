@@ -0,0 +1,308 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from pymongo import UpdateMany
+from pymongo.errors import DuplicateKeyError
+from database import get_database
+from api import hls
+from api.jobs import WORKER_ID
+from api.storage import storage, key_for_path, path_for_key
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Housekeeping of stored audio.
+#
+# A background sweeper reconciles storage with tts_history. It deletes files
+# that no story points to, such as stray script output or audio whose record
+# is gone. It also deletes stale .partial temp files, marks stories whose audio
+# has disappeared, and keeps usage under the per-user and global quotas by
+# evicting the least recently played audio that isn't public. Evicted stories
+# keep their history record (text and settings) with `evicted_at` set, so they
+# can be rendered again.
+#
+# Renders and uploads write to temporary names and rename them when done, and
+# nothing younger than OUTPUTS_GC_GRACE_SECONDS is touched, so a sweep never
+# removes a file that is still being written or whose history record is about
+# to be inserted.
+
+OUTPUTS_QUOTA_BYTES = int(os.getenv("OUTPUTS_QUOTA_MB", "900")) * 1024 * 1024
+USER_QUOTA_BYTES = int(os.getenv("USER_QUOTA_MB", "200")) * 1024 * 1024
+GC_INTERVAL_SECONDS = int(os.getenv("OUTPUTS_GC_INTERVAL_SECONDS", "900"))
+GC_GRACE_SECONDS = int(os.getenv("OUTPUTS_GC_GRACE_SECONDS", "3600"))
+
+# Stories looked at per eviction round, least recently played first
+EVICTION_BATCH = 200
+# Plays remembered between sweeps (further new keys wait for the next round)
+MAX_TRACKED_ACCESSES = 10000
+
+_accessed: Dict[str, float] = {}
+_sweeper: Optional[asyncio.Task] = None
+_quota_checks: Set[asyncio.Task] = set()
+_stats = {
+    "last_sweep_at": None,
+    "last_sweep_ms": None,
+    "objects": None,
+    "used_bytes": None,
+    "quota_bytes": OUTPUTS_QUOTA_BYTES,
+    "user_quota_bytes": USER_QUOTA_BYTES,
+    "removed_orphans": 0,
+    "removed_partials": 0,
+    "missing_audio": 0,
+    "evicted": 0,
+    "freed_bytes": 0
+}
+
+
+def record_access(key: str):
+    """Notes that a story's audio was played; written to last_accessed_at on the next sweep."""
+    if key in _accessed or len(_accessed) < MAX_TRACKED_ACCESSES:
+        _accessed[key] = time.time()
+
+
+def note_request(path: str):
+    """Records plays of /outputs/<key> and /hls/<stem>/... requests."""
+    if path.startswith("/outputs/"):
+        record_access(path[len("/outputs/"):])
+    elif path.startswith(f"/{hls.HLS_PREFIX}/"):
+        stem = path[len(hls.HLS_PREFIX) + 2:].split("/", 1)[0]
+        record_access(f"{stem}.mp3")
+
+
+async def _flush_accesses(db):
+    if not _accessed:
+        return
+    pending = list(_accessed.items())
+    _accessed.clear()
+    await db.tts_history.bulk_write([
+        UpdateMany({"audio_path": path_for_key(key)}, {"$max": {"last_accessed_at": datetime.utcfromtimestamp(played)}})
+        for key, played in pending
+    ], ordered=False)
+
+
+def _unit_of(key: str) -> str:
+    """Objects are reconciled per story: one file, or a whole HLS folder."""
+    parts = key.split("/")
+    if parts[0] == hls.HLS_PREFIX and len(parts) > 2:
+        return hls.hls_folder(parts[1])
+    return key
+
+
+async def _delete_unit(unit: str):
+    if unit.endswith("/"):
+        await storage.delete_prefix(unit)
+    else:
+        await storage.delete(unit)
+
+
+async def evict_story(db, story: Dict) -> int:
+    """
+    Deletes a story's audio and HLS rendition and marks the record evicted.
+    The MP3 is kept while another live story shares it (deduplicated uploads).
+    Returns the story's audio_bytes.
+    """
+    audio_path = story["audio_path"]
+    shared = await db.tts_history.find_one(
+        {"audio_path": audio_path, "evicted_at": None, "_id": {"$ne": story["_id"]}}, {"_id": 1}
+    )
+    if not shared:
+        await storage.delete(key_for_path(audio_path))
+    if story.get("hls_playlist_path"):
+        await hls.delete_rendition(story["hls_playlist_path"])
+    await db.tts_history.update_one(
+        {"_id": story["_id"]},
+        {"$set": {"evicted_at": datetime.utcnow(), "hls_playlist_path": None}}
+    )
+    log.info("Evicted story audio", story_id=str(story["_id"]), bytes=story.get("audio_bytes") or 0)
+    return story.get("audio_bytes") or 0
+
+
+async def _evict_lru(db, excess: int, user_id: Optional[str] = None) -> int:
+    """Evicts non-public stories, least recently played first, until `excess` bytes are freed."""
+    query = {
+        "evicted_at": None,
+        "is_public": {"$ne": True},
+        # Never the story that was just rendered
+        "created_at": {"$lt": datetime.utcnow() - timedelta(seconds=GC_GRACE_SECONDS)}
+    }
+    if user_id:
+        query["user_id"] = user_id
+    candidates = await db.tts_history.find(
+        query, {"audio_path": 1, "hls_playlist_path": 1, "audio_bytes": 1}
+    ).sort([("last_accessed_at", 1), ("created_at", 1)]).limit(EVICTION_BATCH).to_list(EVICTION_BATCH)
+
+    freed = 0
+    for story in candidates:
+        if freed >= excess:
+            break
+        freed += await evict_story(db, story)
+        _stats["evicted"] += 1
+    _stats["freed_bytes"] += freed
+    return freed
+
+
+def _usage_pipeline(match: Dict) -> List[Dict]:
+    return [
+        {"$match": {"evicted_at": None, **match}},
+        {"$group": {"_id": "$user_id", "used_bytes": {"$sum": "$audio_bytes"}, "stories": {"$sum": 1}}}
+    ]
+
+
+async def user_usage(user_id: str) -> Dict:
+    """Audio storage used by one user's live stories, and their quota."""
+    db = await get_database()
+    rows = await db.tts_history.aggregate(_usage_pipeline({"user_id": user_id})).to_list(1)
+    evicted = await db.tts_history.count_documents({"user_id": user_id, "evicted_at": {"$ne": None}})
+    row = rows[0] if rows else {}
+    return {
+        "used_bytes": row.get("used_bytes", 0),
+        "quota_bytes": USER_QUOTA_BYTES,
+        "stories": row.get("stories", 0),
+        "evicted_stories": evicted
+    }
+
+
+async def enforce_user_quota(user_id: str) -> int:
+    db = await get_database()
+    usage = await user_usage(user_id)
+    if usage["used_bytes"] <= USER_QUOTA_BYTES:
+        return 0
+    return await _evict_lru(db, usage["used_bytes"] - USER_QUOTA_BYTES, user_id)
+
+
+async def _checked_user_quota(user_id: str):
+    try:
+        await enforce_user_quota(user_id)
+    except Exception:
+        log.exception("Quota check failed", user_id=user_id)
+
+
+def schedule_quota_check(user_id: str):
+    """Enforces the user's quota in the background after they stored new audio."""
+    task = asyncio.create_task(_checked_user_quota(user_id))
+    _quota_checks.add(task)
+    task.add_done_callback(_quota_checks.discard)
+
+
+async def _claim_sweep(db) -> bool:
+    """At most one sweep per interval across all processes."""
+    now = datetime.utcnow()
+    try:
+        await db.maintenance.update_one(
+            {"_id": "outputs_gc", "swept_at": {"$lt": now - timedelta(seconds=GC_INTERVAL_SECONDS * 0.9)}},
+            {"$set": {"swept_at": now, "worker": WORKER_ID}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def sweep() -> Dict:
+    """One reconciliation pass over storage and tts_history. Returns the stats."""
+    started = time.perf_counter()
+    db = await get_database()
+    cutoff = time.time() - GC_GRACE_SECONDS
+    cutoff_at = datetime.utcfromtimestamp(cutoff)
+
+    # Group stored objects per story; drop temp files left by crashed writes
+    units: Dict[str, List] = {}
+    objects = await storage.list_objects()
+    for obj in objects:
+        if obj.key.endswith(".partial"):
+            if obj.mtime < cutoff:
+                await storage.delete(obj.key)
+                _stats["removed_partials"] += 1
+            continue
+        unit = units.setdefault(_unit_of(obj.key), [0, 0.0])
+        unit[0] += obj.size
+        unit[1] = max(unit[1], obj.mtime)
+
+    referenced = set()
+    missing = []
+    sizes = []
+    async for story in db.tts_history.find(
+        {"evicted_at": None}, {"audio_path": 1, "hls_playlist_path": 1, "audio_bytes": 1, "created_at": 1}
+    ):
+        key = key_for_path(story["audio_path"])
+        folder = hls.hls_folder(hls.stem_for(key)) if story.get("hls_playlist_path") else None
+        referenced.add(key)
+        if folder:
+            referenced.add(folder)
+        if key not in units:
+            if story.get("created_at") and story["created_at"] < cutoff_at:
+                missing.append(story["_id"])
+        elif story.get("audio_bytes") is None:
+            # Stored before sizes were recorded
+            size = units[key][0] + (units[folder][0] if folder in units else 0)
+            sizes.append((story["_id"], size))
+    async for story in db.public_stories.find({}, {"audio_path": 1}):
+        referenced.add(key_for_path(story["audio_path"]))
+
+    for unit, (size, mtime) in list(units.items()):
+        if unit not in referenced and mtime < cutoff:
+            await _delete_unit(unit)
+            del units[unit]
+            _stats["removed_orphans"] += 1
+            log.info("Removed orphaned audio", key=unit, bytes=size)
+
+    if missing:
+        await db.tts_history.update_many(
+            {"_id": {"$in": missing}},
+            {"$set": {"evicted_at": datetime.utcnow(), "hls_playlist_path": None}}
+        )
+        _stats["missing_audio"] += len(missing)
+    for story_id, size in sizes:
+        await db.tts_history.update_one({"_id": story_id}, {"$set": {"audio_bytes": size}})
+
+    # Per-user quotas, then the global one
+    used = sum(size for size, _ in units.values())
+    over_quota = await db.tts_history.aggregate(
+        _usage_pipeline({}) + [{"$match": {"used_bytes": {"$gt": USER_QUOTA_BYTES}}}]
+    ).to_list(None)
+    for row in over_quota:
+        used -= await _evict_lru(db, row["used_bytes"] - USER_QUOTA_BYTES, row["_id"])
+    if used > OUTPUTS_QUOTA_BYTES:
+        used -= await _evict_lru(db, used - OUTPUTS_QUOTA_BYTES)
+
+    _stats.update({
+        "last_sweep_at": datetime.utcnow().isoformat(),
+        "last_sweep_ms": round((time.perf_counter() - started) * 1000),
+        "objects": len(objects),
+        "used_bytes": used
+    })
+    return stats()
+
+
+async def _sweeper_loop():
+    while True:
+        try:
+            db = await get_database()
+            await _flush_accesses(db)
+            if await _claim_sweep(db):
+                await sweep()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Outputs sweep failed")
+        await asyncio.sleep(GC_INTERVAL_SECONDS)
+
+
+def start_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = asyncio.create_task(_sweeper_loop())
+
+
+async def stop_sweeper():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        await asyncio.gather(_sweeper, return_exceptions=True)
+        _sweeper = None
+
+
+def stats() -> Dict:
+    return dict(_stats)
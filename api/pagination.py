@@ -0,0 +1,56 @@
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from fastapi import HTTPException
+
+# Feeds are listed newest first; _id breaks ties between stories created in the same instant
+FEED_SORT = [("created_at", -1), ("_id", -1)]
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(doc: Dict) -> str:
+    """Opaque cursor pointing just past `doc` in FEED_SORT order."""
+    doc_id = doc["_id"]
+    kind = "o" if isinstance(doc_id, ObjectId) else "s"
+    raw = f"{doc['created_at'].isoformat()}|{kind}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, object]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, kind, doc_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 2)
+        return datetime.fromisoformat(created_at), ObjectId(doc_id) if kind == "o" else doc_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_filter(base: Dict, cursor: Optional[str]) -> Dict:
+    """Adds the keyset condition "strictly after the cursor" to a query."""
+    if not cursor:
+        return base
+    created_at, doc_id = decode_cursor(cursor)
+    return {
+        **base,
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": doc_id}}
+        ]
+    }
+
+
+async def fetch_page(collection, base: Dict, cursor: Optional[str], limit: int,
+                     projection: Optional[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    One page of `collection` matching `base`, newest first.
+    Returns the documents and the cursor of the next page (None on the last page).
+    """
+    # Ask for one extra document to know whether another page exists
+    docs = await collection.find(page_filter(base, cursor), projection).sort(FEED_SORT).limit(limit + 1).to_list(length=limit + 1)
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1])
@@ -0,0 +1,353 @@
+import os
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import edge_tts
+from edge_tts.exceptions import NoAudioReceived
+from fastapi import HTTPException
+from api import bhashini
+from api.audio_cache import segment_cache, segment_cache_key
+from api.voices import equivalent_edge_voice
+from logs import get_logger
+from metrics import provider_breaker_state, provider_first_audio_p95, provider_failovers, provider_hedges, failure_reason
+
+# Synthesis providers.
+#
+# Every segment is synthesized by the provider it names ("edge-tts" or
+# "bhashini") through synthesize_segment(), which tracks each provider's health:
+#
+#   - Circuit breaker: after PROVIDER_BREAKER_FAILURES consecutive failures
+#     the provider is skipped (fails fast) for PROVIDER_BREAKER_RESET_SECONDS,
+#     then a single trial call decides whether it is back.
+#   - Failover: a premium segment whose provider is open, or fails before
+#     sending any audio, is read by the equivalent edge-tts voice of the same
+#     language instead (TTS_FAILOVER, or the request's `failover` flag).
+#   - Hedging: for short segments, when the first audio hasn't arrived within
+#     the provider's recent p95 time-to-first-audio, an identical second call
+#     is started and whichever answers first is used.
+
+TTS_FAILOVER = os.getenv("TTS_FAILOVER", "true").lower() in ("1", "true", "yes")
+BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("PROVIDER_BREAKER_RESET_SECONDS", "30"))
+# Segments up to this many characters may be hedged
+HEDGE_MAX_CHARS = int(os.getenv("TTS_HEDGE_MAX_CHARS", "200"))
+# Hedged calls in flight at once across the process (0 disables hedging)
+HEDGE_MAX_INFLIGHT = int(os.getenv("TTS_HEDGE_MAX_INFLIGHT", "4"))
+# Latency samples kept per provider, and how many are needed before hedging starts
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_BREAKER_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+log = get_logger(__name__)
+
+_hedges_inflight = 0
+
+
+class ProviderUnavailable(HTTPException):
+    """Raised without calling the provider while its circuit is open."""
+
+    def __init__(self, provider: str):
+        super().__init__(status_code=503, detail=f"{provider} is temporarily unavailable. Please try again shortly.")
+
+
+class ProviderHealth:
+    """Recent time-to-first-audio and the circuit breaker of one provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._p95: Optional[float] = None
+        self.calls = 0
+        self.failures = 0
+        provider_breaker_state.set(0, provider=name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            log.warning("Provider circuit changed", provider=self.name, state=state, failures=self.consecutive_failures)
+        self.state = state
+        provider_breaker_state.set(_BREAKER_VALUES[state], provider=self.name)
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (one trial call at a time once the reset time has passed)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self, first_audio_seconds: Optional[float] = None):
+        self.calls += 1
+        self.consecutive_failures = 0
+        self._probing = False
+        if self.state != CLOSED:
+            self._set_state(CLOSED)
+        if first_audio_seconds is not None:
+            self.record_latency(first_audio_seconds)
+
+    def record_latency(self, first_audio_seconds: float):
+        self._latencies.append(first_audio_seconds)
+        self._p95 = None
+
+    def record_failure(self):
+        self.calls += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= BREAKER_FAILURES:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def release_probe(self):
+        """A trial call ended without telling us anything (cancelled)."""
+        self._probing = False
+
+    def p95(self) -> Optional[float]:
+        """Recent p95 time-to-first-audio, or None until enough calls were seen."""
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        if self._p95 is None:
+            ordered = sorted(self._latencies)
+            self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            provider_first_audio_p95.set(self._p95, provider=self.name)
+        return self._p95
+
+    def report(self) -> Dict:
+        p95 = self.p95()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "first_audio_p95_ms": round(p95 * 1000) if p95 is not None else None
+        }
+
+
+class Provider(ABC):
+    """A synthesis backend. stream() yields the MP3 chunks of one segment."""
+
+    name = ""
+
+    def __init__(self):
+        self.health = ProviderHealth(self.name)
+
+    @abstractmethod
+    def stream(self, segment: Dict) -> AsyncIterator[bytes]:
+        """Starts synthesizing `segment`; the chunks arrive as they are produced."""
+
+
+async def edge_tts_stream(segment: Dict) -> AsyncIterator[bytes]:
+    """
+    Streams the audio chunks edge-tts produces for one script segment.
+    A segment is a dict with "text", "voice", "speed" and "pitch" keys.
+    """
+    communicate = edge_tts.Communicate(
+        segment["text"],
+        segment["voice"],
+        rate=segment["speed"],
+        pitch=segment["pitch"]
+    )
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+
+
+class EdgeTTSProvider(Provider):
+    name = "edge-tts"
+
+    def stream(self, segment: Dict) -> AsyncIterator[bytes]:
+        # Served from the segment cache when the line was synthesized before
+        key = segment_cache_key("edge-tts", segment["voice"], segment["speed"], segment["pitch"], None, segment["text"])
+        return segment_cache.stream(key, lambda: edge_tts_stream(segment))
+
+
+class BhashiniProvider(Provider):
+    name = "bhashini"
+
+    def stream(self, segment: Dict) -> AsyncIterator[bytes]:
+        return bhashini.stream_bhashini_audio(
+            text=segment["text"],
+            language=segment["language"],
+            voice_id=segment["voice"],
+            voice_style=segment["style"],
+            speech_rate=segment["speed"]
+        )
+
+
+PROVIDERS: Dict[str, Provider] = {provider.name: provider for provider in (EdgeTTSProvider(), BhashiniProvider())}
+
+
+# Errors caused by the segment itself: edge-tts finds nothing to read in a line
+# like "..." or "* * *", and rejects a malformed voice, rate or pitch
+REQUEST_ERRORS = (NoAudioReceived, ValueError, TypeError)
+
+
+def is_provider_fault(error: BaseException) -> bool:
+    """Errors that say the provider is unwell, as opposed to a bad request (e.g. an unknown voice)."""
+    if isinstance(error, HTTPException):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, REQUEST_ERRORS):
+        return False
+    return isinstance(error, Exception)
+
+
+def failover_segment(segment: Dict) -> Optional[Dict]:
+    """The same line for the equivalent edge-tts voice, or None when there is none (or failover is off)."""
+    if segment.get("provider") in (None, EdgeTTSProvider.name):
+        return None
+    allowed = segment.get("failover")
+    if not (TTS_FAILOVER if allowed is None else allowed):
+        return None
+    voice = equivalent_edge_voice(segment.get("language", ""), segment.get("voice", ""))
+    if voice is None:
+        return None
+    speed = segment.get("speed") or 1.0
+    return {
+        "provider": EdgeTTSProvider.name,
+        "text": segment["text"],
+        "voice": voice,
+        "speed": f"{int((speed - 1.0) * 100):+d}%",
+        "pitch": "+0Hz"
+    }
+
+
+async def _open_stream(provider: Provider, segment: Dict) -> Tuple[Optional[bytes], AsyncIterator[bytes]]:
+    """Starts a call and waits for its first chunk (None if it produced no audio). Feeds the provider's health."""
+    started = time.perf_counter()
+    chunks = provider.stream(segment).__aiter__()
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        provider.health.record_success()
+        return None, chunks
+    except asyncio.CancelledError:
+        # Typically a slow call that lost a hedge race: it took at least this long
+        provider.health.release_probe()
+        provider.health.record_latency(time.perf_counter() - started)
+        raise
+    except Exception as e:
+        if is_provider_fault(e):
+            provider.health.record_failure()
+        else:
+            provider.health.release_probe()
+        raise
+    provider.health.record_success(time.perf_counter() - started)
+    return first, chunks
+
+
+async def _discard(task: asyncio.Task):
+    """Stops a call that lost a hedge race."""
+    if not task.done():
+        task.cancel()
+    try:
+        _, chunks = await task
+    except BaseException:
+        return
+    await chunks.aclose()
+
+
+async def _open_hedged(provider: Provider, segment: Dict) -> Tuple[Optional[bytes], AsyncIterator[bytes]]:
+    """
+    _open_stream, plus a second identical call when a short segment's first audio is later than the
+    provider's recent p95. The first call to answer wins; the other is cancelled.
+    """
+    global _hedges_inflight
+    primary = asyncio.create_task(_open_stream(provider, segment))
+    delay = provider.health.p95()
+    if delay is None or len(segment["text"]) > HEDGE_MAX_CHARS:
+        return await primary
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except asyncio.CancelledError:
+        await _discard(primary)
+        raise
+    if done or _hedges_inflight >= HEDGE_MAX_INFLIGHT or provider.health.state != CLOSED:
+        return await primary
+
+    _hedges_inflight += 1
+    hedge = asyncio.create_task(_open_stream(provider, segment))
+    try:
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # A failed call loses unless the other one fails too
+            winner = next((task for task in done if task.exception() is None), None)
+            if winner is None and not pending:
+                winner = primary
+            if winner is not None:
+                loser = hedge if winner is primary else primary
+                provider_hedges.inc(provider=provider.name, winner="hedge" if winner is hedge else "primary")
+                await _discard(loser)
+                return winner.result()
+    except asyncio.CancelledError:
+        await _discard(primary)
+        await _discard(hedge)
+        raise
+    finally:
+        _hedges_inflight -= 1
+
+
+async def _stream_from(provider: Provider, segment: Dict, hedge: bool = True) -> AsyncIterator[bytes]:
+    first, chunks = await (_open_hedged(provider, segment) if hedge else _open_stream(provider, segment))
+    if first is None:
+        return
+    yield first
+    try:
+        async for data in chunks:
+            yield data
+    except Exception as e:
+        # Audio was already sent, so there is no switching provider now
+        if is_provider_fault(e):
+            provider.health.record_failure()
+        raise
+
+
+async def synthesize_segment(segment: Dict) -> AsyncIterator[bytes]:
+    """Streams one segment's audio from its provider, with fail-fast, failover and hedging (see above)."""
+    provider = PROVIDERS[segment.get("provider") or EdgeTTSProvider.name]
+    fallback = failover_segment(segment)
+
+    if not provider.health.allow():
+        if fallback is None:
+            raise ProviderUnavailable(provider.name)
+        provider_failovers.inc(provider=provider.name, reason="circuit_open")
+        log.info("Failing over to edge-tts", provider=provider.name, reason="circuit_open", voice=fallback["voice"])
+        async for data in _stream_from(PROVIDERS[EdgeTTSProvider.name], fallback):
+            yield data
+        return
+
+    stream = _stream_from(provider, segment)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        return
+    except Exception as e:
+        if fallback is None or not is_provider_fault(e):
+            raise
+        provider_failovers.inc(provider=provider.name, reason=failure_reason(e))
+        log.info("Failing over to edge-tts", provider=provider.name, reason=failure_reason(e), voice=fallback["voice"])
+        async for data in _stream_from(PROVIDERS[EdgeTTSProvider.name], fallback):
+            yield data
+        return
+
+    yield first
+    async for data in stream:
+        yield data
+
+
+def health_report() -> Dict:
+    return {name: provider.health.report() for name, provider in PROVIDERS.items()}
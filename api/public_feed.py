@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from pydantic import TypeAdapter
+from database import get_database
+from models import PublicStorySummary
+from api.pagination import fetch_page, DEFAULT_PAGE_SIZE
+
+# Materialized public library pages.
+#
+# The feed is the same for every visitor, so each page is built once (query +
+# validation + JSON) and served as ready bytes with a strong ETag until a story
+# is published, unpublished or deleted in this process. Other processes pick the
+# change up when their copy's TTL runs out.
+
+PUBLIC_FEED_TTL_SECONDS = float(os.getenv("PUBLIC_FEED_TTL_SECONDS", "60"))
+PUBLIC_FEED_MAX_PAGES = int(os.getenv("PUBLIC_FEED_MAX_PAGES", "64"))
+
+_feed_adapter = TypeAdapter(List[PublicStorySummary])
+
+PageKey = Tuple[int, Optional[str], bool]
+
+
+class FeedPage:
+    def __init__(self, body: bytes, next_cursor: Optional[str]):
+        self.body = body
+        self.next_cursor = next_cursor
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.built_at = time.monotonic()
+
+    def fresh(self) -> bool:
+        return time.monotonic() - self.built_at < PUBLIC_FEED_TTL_SECONDS
+
+
+_pages: "OrderedDict[PageKey, FeedPage]" = OrderedDict()
+_builds: Dict[PageKey, asyncio.Task] = {}
+_generation = 0
+_stats = {"hits": 0, "builds": 0, "invalidations": 0}
+
+
+async def _build(key: PageKey, generation: int) -> FeedPage:
+    limit, cursor, include_text = key
+    db = await get_database()
+    projection = {"segment_index": 0} if include_text else {"text": 0, "segment_index": 0}
+    stories, next_cursor = await fetch_page(db.public_stories, {}, cursor, limit, projection)
+    body = _feed_adapter.dump_json(_feed_adapter.validate_python(stories), by_alias=True)
+    page = FeedPage(body, next_cursor)
+    _stats["builds"] += 1
+    # A story changed while we were querying: serve this result once, don't keep it
+    if generation == _generation:
+        _pages[key] = page
+        _pages.move_to_end(key)
+        while len(_pages) > PUBLIC_FEED_MAX_PAGES:
+            _pages.popitem(last=False)
+    return page
+
+
+async def get_page(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, include_text: bool = False) -> FeedPage:
+    """Returns a feed page, building it (once, however many callers wait) when missing or expired."""
+    key = (limit, cursor, include_text)
+    page = _pages.get(key)
+    if page is not None and page.fresh():
+        _pages.move_to_end(key)
+        _stats["hits"] += 1
+        return page
+
+    task = _builds.get(key)
+    if task is None:
+        task = asyncio.create_task(_build(key, _generation))
+        _builds[key] = task
+        task.add_done_callback(lambda _: _builds.pop(key, None) if _builds.get(key) is task else None)
+    return await asyncio.shield(task)
+
+
+def _rebuild_front_page():
+    try:
+        task = asyncio.create_task(get_page())
+    except RuntimeError:
+        # No running loop (called from a script)
+        return
+    # Failures are retried by the next request; don't leave them unretrieved
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def invalidate():
+    """Call after any change to public_stories. Drops every page and rebuilds the front page."""
+    global _generation
+    _generation += 1
+    _pages.clear()
+    _builds.clear()
+    _stats["invalidations"] += 1
+    _rebuild_front_page()
+
+
+def stats() -> Dict:
+    lookups = _stats["hits"] + _stats["builds"]
+    return {
+        "pages": len(_pages),
+        **_stats,
+        "hit_ratio": round(_stats["hits"] / lookups, 4) if lookups else 0.0
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 requires for this header)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,246 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from fastapi import HTTPException, status
+from models import TTSRequest
+from metrics import (
+    loop_lag, scheduler_active, scheduler_queued, scheduler_queued_users, scheduler_wait_seconds, scheduler_rejections
+)
+from logs import get_logger
+
+# Synthesis capacity.
+#
+# Every segment's provider call runs in one of TTS_MAX_SESSIONS slots shared by
+# the whole process. When they are all busy, waiting segments are served by
+# weighted fair queuing across users (start-time fair queuing): each user's
+# segments are tagged with a virtual start time that grows by 1/weight per
+# segment, and the smallest tag goes next. A user with a 300-line story
+# therefore can't hold everyone else back, and premium (Bhashini) segments
+# weigh SCHEDULER_PREMIUM_WEIGHT times as much as standard ones.
+#
+# Before a request starts, admit() charges the user's token bucket one token
+# per segment (SCHEDULER_USER_SEGMENTS_PER_MINUTE, bursts up to
+# SCHEDULER_USER_BURST) and sheds load when the queue is deeper than
+# SCHEDULER_MAX_QUEUE segments or the event loop lags more than
+# SCHEDULER_SHED_LOOP_LAG_SECONDS. Rejections are 429 with Retry-After.
+# Limits are per process.
+
+MAX_SYNTHESIS_SESSIONS = int(os.getenv("TTS_MAX_SESSIONS", "16"))
+PREMIUM_WEIGHT = float(os.getenv("SCHEDULER_PREMIUM_WEIGHT", "2"))
+# Per-user rate: segments a minute, and how many may be requested at once (0 = no limit)
+USER_SEGMENTS_PER_MINUTE = float(os.getenv("SCHEDULER_USER_SEGMENTS_PER_MINUTE", "300"))
+USER_BURST = float(os.getenv("SCHEDULER_USER_BURST", "500"))
+# Segments waiting for a slot before new requests are turned away (0 = no limit)
+MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "2000"))
+# Event loop lag (see metrics.loop_lag) above which new requests are turned away (0 = off)
+SHED_LOOP_LAG_SECONDS = float(os.getenv("SCHEDULER_SHED_LOOP_LAG_SECONDS", "0.5"))
+MAX_TRACKED_USERS = int(os.getenv("SCHEDULER_MAX_TRACKED_USERS", "100000"))
+# Cap on the Retry-After given when shedding load
+MAX_RETRY_AFTER = 60
+
+log = get_logger(__name__)
+
+
+class _Waiter:
+    __slots__ = ("start", "seq", "user", "future", "cancelled", "queued_at")
+
+    def __init__(self, start: float, seq: int, user: str, future: asyncio.Future):
+        self.start = start
+        self.seq = seq
+        self.user = user
+        self.future = future
+        self.cancelled = False
+        self.queued_at = time.perf_counter()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.start, self.seq) < (other.start, other.seq)
+
+
+class FairScheduler:
+    """`concurrency` synthesis slots handed out by weighted fair queuing across users."""
+
+    def __init__(self, concurrency: int = MAX_SYNTHESIS_SESSIONS):
+        self.concurrency = max(1, concurrency)
+        self.active = 0
+        self.queued = 0
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        # Virtual finish tag of each user's latest segment
+        self._finish: Dict[str, float] = {}
+        self._queued_per_user: Dict[str, int] = {}
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._service_seconds = 1.0
+        self.granted = 0
+
+    def _tag(self, user: str, weight: float) -> float:
+        start = max(self._virtual_time, self._finish.get(user, 0.0))
+        self._finish[user] = start + 1.0 / max(weight, 0.01)
+        if len(self._finish) > MAX_TRACKED_USERS:
+            # Tags at or behind the virtual clock say nothing: start from the clock anyway
+            self._finish = {name: tag for name, tag in self._finish.items() if tag > self._virtual_time}
+        return start
+
+    def _update_gauges(self):
+        scheduler_active.set(self.active)
+        scheduler_queued.set(self.queued)
+        scheduler_queued_users.set(len(self._queued_per_user))
+
+    def _dequeued(self, waiter: _Waiter):
+        self.queued -= 1
+        remaining = self._queued_per_user[waiter.user] - 1
+        if remaining:
+            self._queued_per_user[waiter.user] = remaining
+        else:
+            del self._queued_per_user[waiter.user]
+
+    def _dispatch(self):
+        while self.active < self.concurrency and self._heap:
+            waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            self._dequeued(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.start)
+            self.active += 1
+            scheduler_wait_seconds.observe(time.perf_counter() - waiter.queued_at)
+            waiter.future.set_result(None)
+        self._update_gauges()
+
+    async def acquire(self, user: str, weight: float = 1.0):
+        """Waits for a slot. Pair with release()."""
+        start = self._tag(user, weight)
+        if self.active < self.concurrency and not self.queued:
+            # Whatever is left in the heap was cancelled
+            self._heap.clear()
+            self._virtual_time = max(self._virtual_time, start)
+            self.active += 1
+            self.granted += 1
+            scheduler_wait_seconds.observe(0.0)
+            self._update_gauges()
+            return
+
+        waiter = _Waiter(start, next(self._seq), user, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, waiter)
+        self.queued += 1
+        self._queued_per_user[user] = self._queued_per_user.get(user, 0) + 1
+        self._update_gauges()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller went away: hand the slot on
+                self.release()
+            elif not waiter.cancelled:
+                waiter.cancelled = True
+                self._dequeued(waiter)
+                self._update_gauges()
+            raise
+        self.granted += 1
+
+    def release(self, held_seconds: Optional[float] = None):
+        self.active -= 1
+        if held_seconds is not None:
+            self._service_seconds += 0.1 * (held_seconds - self._service_seconds)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str, weight: float = 1.0):
+        await self.acquire(user, weight)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def estimated_wait(self) -> float:
+        """Roughly how long a segment queued now would wait for a slot."""
+        return self.queued * self._service_seconds / self.concurrency
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_users": len(self._queued_per_user),
+            "granted": self.granted,
+            "avg_slot_ms": round(self._service_seconds * 1000)
+        }
+
+
+class TokenBuckets:
+    """Per-user token buckets refilling at `rate` tokens a second up to `burst`. Only the most recently used users are kept."""
+
+    def __init__(self, rate: float = USER_SEGMENTS_PER_MINUTE / 60, burst: float = USER_BURST,
+                 max_keys: int = MAX_TRACKED_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def take(self, user: str, cost: float) -> float:
+        """Takes `cost` tokens and returns 0, or returns the seconds until they'd be available (taking nothing)."""
+        if self.rate <= 0:
+            return 0.0
+        # A story longer than the burst only needs a full bucket
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[0], bucket[1] = tokens, now
+        self._buckets.move_to_end(user)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        if tokens < cost:
+            return (cost - tokens) / self.rate
+        bucket[0] = tokens - cost
+        return 0.0
+
+
+scheduler = FairScheduler()
+user_buckets = TokenBuckets()
+
+
+def segment_weight(segment: Dict) -> float:
+    return PREMIUM_WEIGHT if segment.get("provider") not in (None, "edge-tts") else 1.0
+
+
+def request_cost(request: TTSRequest) -> int:
+    """Segments a request will need, estimated without parsing the script."""
+    if request.segments:
+        return len(request.segments)
+    return max(1, sum(1 for line in (request.text or "").splitlines() if line.strip()))
+
+
+def _reject(reason: str, detail: str, wait: float):
+    scheduler_rejections.inc(reason=reason)
+    log.info("Request rejected", reason=reason, retry_after=round(wait, 1))
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(wait)))},
+    )
+
+
+def admit(user_id: str, cost: int, shed: bool = True):
+    """
+    Lets a request of `cost` segments in, or raises 429 with Retry-After. With
+    `shed`, requests are also turned away while the server is overloaded
+    (background jobs wait in their own queue instead).
+    """
+    if shed:
+        if MAX_QUEUE and scheduler.queued >= MAX_QUEUE:
+            _reject("queue_full", "The server is busy, please try again shortly", min(MAX_RETRY_AFTER, scheduler.estimated_wait()))
+        lag = loop_lag()
+        if SHED_LOOP_LAG_SECONDS and lag >= SHED_LOOP_LAG_SECONDS:
+            _reject("loop_lag", "The server is busy, please try again shortly", min(MAX_RETRY_AFTER, lag * 10))
+    wait = user_buckets.take(user_id, cost)
+    if wait > 0:
+        _reject("rate_limit", "Too many stories requested, please try again later", wait)
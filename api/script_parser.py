@@ -0,0 +1,274 @@
+import re
+from typing import Dict, List, Optional, Tuple
+from api.voices import VOICE_MAPPING
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Unicode blocks of the scripts we can narrate, as (first, last, script).
+# Built once into a codepoint -> script lookup table and per-script regex classes.
+SCRIPT_RANGES = [
+    (0x0041, 0x005A, "Latin"),
+    (0x0061, 0x007A, "Latin"),
+    (0x00C0, 0x024F, "Latin"),
+    (0x0900, 0x097F, "Devanagari"),
+    (0x0980, 0x09FF, "Bengali"),
+    (0x0A00, 0x0A7F, "Gurmukhi"),
+    (0x0A80, 0x0AFF, "Gujarati"),
+    (0x0B00, 0x0B7F, "Odia"),
+    (0x0B80, 0x0BFF, "Tamil"),
+    (0x0C00, 0x0C7F, "Telugu"),
+    (0x0C80, 0x0CFF, "Kannada"),
+    (0x0D00, 0x0D7F, "Malayalam"),
+]
+
+# Characters inside those blocks that every script shares (danda, double danda,
+# multiplication/division signs) and so say nothing about the language
+NEUTRAL_CODEPOINTS = {0x00D7, 0x00F7, 0x0964, 0x0965}
+
+# Edge-tts persona used for each script when the assigned voice can't read it
+SCRIPT_PERSONAS = {
+    "Kannada": "Sapna (Kannada - Female)",
+    "Devanagari": "Swara (Female)",
+    "Bengali": "Tanishaa (Bengali - Female)",
+    "Malayalam": "Sobhana (Malayalam - Female)",
+    "Tamil": "Pallavi (Tamil - Female)",
+    "Telugu": "Shruti (Telugu - Female)",
+    "Gujarati": "Dhwani (Gujarati - Female)",
+    "Gurmukhi": "Punjabi (Female)",
+    "Odia": "Odia (Female)",
+}
+SCRIPT_VOICES = {script: VOICE_MAPPING[persona] for script, persona in SCRIPT_PERSONAS.items()}
+
+# A run of another script shorter than this many letters (a name, "WhatsApp")
+# stays with the surrounding text instead of becoming its own segment
+MIN_SWITCH_LETTERS = 12
+
+_TABLE_SIZE = max(last for _, last, _ in SCRIPT_RANGES) + 1
+_SCRIPT_NAMES = [None] + sorted({script for _, _, script in SCRIPT_RANGES})
+_SCRIPT_IDS = {name: i for i, name in enumerate(_SCRIPT_NAMES)}
+
+
+def _build_table() -> bytes:
+    table = bytearray(_TABLE_SIZE)
+    for first, last, script in SCRIPT_RANGES:
+        for cp in range(first, last + 1):
+            table[cp] = _SCRIPT_IDS[script]
+    for cp in NEUTRAL_CODEPOINTS:
+        table[cp] = 0
+    return bytes(table)
+
+
+def _letter_class(scripts) -> str:
+    """A regex character class matching the letters (not the neutral characters) of `scripts`."""
+    ranges = []
+    for first, last, script in SCRIPT_RANGES:
+        if script not in scripts:
+            continue
+        start = first
+        for cp in sorted(cp for cp in NEUTRAL_CODEPOINTS if first <= cp <= last):
+            if start < cp:
+                ranges.append((start, cp - 1))
+            start = cp + 1
+        if start <= last:
+            ranges.append((start, last))
+    return "[" + "".join(f"\\u{first:04x}-\\u{last:04x}" for first, last in ranges) + "]"
+
+
+_SCRIPT_TABLE = _build_table()
+_LATIN_ID = _SCRIPT_IDS["Latin"]
+_INDIC_SCRIPTS = [name for name in _SCRIPT_NAMES[1:] if name != "Latin"]
+_ASCII_LETTER = re.compile(r'[A-Za-z]')
+_LATIN_LETTER = re.compile(_letter_class({"Latin"}))
+_INDIC_LETTER = re.compile(_letter_class(set(_INDIC_SCRIPTS)))
+# Per script: letters of every other Indic script
+_OTHER_INDIC_LETTER = {
+    script: re.compile(_letter_class(set(_INDIC_SCRIPTS) - {script})) for script in _INDIC_SCRIPTS
+}
+# Same table for str.translate: every character becomes chr(script id), so runs
+# of one script can be found by a regex over the marked text. Characters past
+# the table are left as they are (they are all above any id).
+_SCRIPT_TRANSLATION = _SCRIPT_TABLE.decode("latin-1")
+_LAST_MARK = chr(len(_SCRIPT_NAMES) - 1)
+# A run: letters of one script, with neutral characters (marked \x00) in between
+_SCRIPT_RUN = re.compile(r'([\x01-%s])(?:\x00*\1)*' % re.escape(_LAST_MARK))
+
+# Regex to detect "Name: Dialogue" or "Name – Dialogue"
+# Matches "Anna:", "Old Man:", "Character Name –"
+SCRIPT_LINE_PATTERN = re.compile(r'^([A-Z][a-zA-Z\s]+)[:–]\s*(.*)$')
+
+METADATA_PREFIXES = ("title:", "characters:", "story:")
+METADATA_NAMES = {"title", "characters", "story"}
+
+# Smart quotes -> plain quotes, in one pass
+SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})
+
+CHARACTER_VOICE_HINTS = {
+    "Anna": "en-IN-NeerjaNeural",
+    "Ben": "en-IN-ArjunNeural",
+    "Owner": "en-IN-PrabhatNeural",
+    "Doctor": "en-IN-PrabhatNeural",
+    "Friend": "en-IN-PrabhatNeural",
+    "Girl": "en-IN-AashiNeural",
+    "Boy": "en-IN-ArjunNeural"
+}
+
+
+def _run_letters(match) -> int:
+    return match.end() - match.start() - match.group().count("\x00")
+
+
+def script_counts(text: str) -> List[int]:
+    """Letters per script id (index into _SCRIPT_NAMES); index 0 is unused."""
+    counts = [0] * len(_SCRIPT_NAMES)
+    for match in _SCRIPT_RUN.finditer(text.translate(_SCRIPT_TRANSLATION)):
+        counts[ord(match.group(1))] += _run_letters(match)
+    return counts
+
+
+def classify_script(text: str) -> Optional[str]:
+    """
+    Returns the Indic script the text is written in (the one with the most letters),
+    "Latin" for text with only Latin letters, or None when there are no letters at all.
+
+    A line in one Indic script (the common case) is settled by scanning it once:
+    up to its first Indic letter, then the rest for a letter of any other Indic
+    script. Only lines that mix Indic scripts are counted per script.
+    """
+    if text.isascii():
+        return "Latin" if _ASCII_LETTER.search(text) else None
+    first = _INDIC_LETTER.search(text)
+    if first is None:
+        return "Latin" if _LATIN_LETTER.search(text) else None
+    script = _SCRIPT_NAMES[_SCRIPT_TABLE[ord(first.group())]]
+    if _OTHER_INDIC_LETTER[script].search(text, first.end()) is None:
+        return script
+    counts = script_counts(text)
+    best_id = max(
+        (script_id for script_id in range(1, len(counts)) if script_id != _LATIN_ID),
+        key=lambda script_id: counts[script_id]
+    )
+    return _SCRIPT_NAMES[best_id]
+
+
+def _merged_script(kept_id: int, absorbed_id: int) -> int:
+    # Indic voices cope with the odd English word; English voices can't read Indic script
+    return absorbed_id if kept_id == _LATIN_ID else kept_id
+
+
+def split_script_runs(text: str, min_letters: int = MIN_SWITCH_LETTERS) -> List[Tuple[Optional[str], str]]:
+    """
+    Splits code-switched text into (script, text) runs in one pass.
+    Spaces, digits and punctuation stay with the run they follow; runs with fewer
+    than `min_letters` letters are merged into the run before (or after) them.
+    """
+    if text.isascii():
+        return [("Latin" if _ASCII_LETTER.search(text) else None, text)] if text else []
+    marked = text.translate(_SCRIPT_TRANSLATION)
+    # [script_id, start, letters]
+    runs = [[ord(match.group(1)), match.start(), _run_letters(match)] for match in _SCRIPT_RUN.finditer(marked)]
+    if len({run[0] for run in runs}) < 2:
+        # Single-script line (the common case): nothing to split
+        return [(_SCRIPT_NAMES[runs[0][0]] if runs else None, text)] if text else []
+
+    runs[0][1] = 0
+
+    # Absorb short runs into a neighbour
+    merged = []
+    for run in runs:
+        if merged and (run[2] < min_letters or run[0] == merged[-1][0]):
+            last = merged[-1]
+            last[0] = _merged_script(last[0], run[0])
+            last[2] += run[2]
+            if len(merged) > 1 and merged[-2][0] == last[0]:
+                merged[-2][2] += last[2]
+                merged.pop()
+            continue
+        if merged and merged[-1][2] < min_letters:
+            # The previous run was too short on its own: it joins this one
+            previous = merged.pop()
+            run = [_merged_script(run[0], previous[0]), previous[1], run[2] + previous[2]]
+            if merged and merged[-1][0] == run[0]:
+                merged[-1][2] += run[2]
+                continue
+        merged.append(run)
+
+    result = []
+    for i, (script_id, start, _) in enumerate(merged):
+        end = merged[i + 1][1] if i + 1 < len(merged) else len(text)
+        result.append((_SCRIPT_NAMES[script_id], text[start:end]))
+    return result
+
+
+def voice_for_script(script: Optional[str], primary_voice: str) -> str:
+    return SCRIPT_VOICES.get(script, primary_voice)
+
+
+def get_best_voice(text: str, primary_voice: str) -> str:
+    """Picks a voice that can read the text when the assigned one is English."""
+    return voice_for_script(classify_script(text), primary_voice)
+
+
+def _voice_segments(text: str, voice: str, speed_str: str, pitch_str: str) -> List[Dict]:
+    """Segments for one line: English voices are swapped (per run) for one that reads the line's script."""
+    if "en-" not in voice.lower():
+        return [{"provider": "edge-tts", "text": text, "voice": voice, "speed": speed_str, "pitch": pitch_str}]
+    segments = []
+    for script, run_text in split_script_runs(text):
+        if not run_text.strip():
+            continue
+        segments.append({
+            "provider": "edge-tts",
+            "text": run_text.strip(),
+            "voice": voice_for_script(script, voice),
+            "speed": speed_str,
+            "pitch": pitch_str
+        })
+    return segments
+
+
+def parse_narration(text: str, narrator_voice: str, speed_str: str, pitch_str: str) -> List[Dict]:
+    """
+    Heuristic parser for single-narration scripts.
+
+    "Name: Dialogue" lines get the character's hinted voice, everything else the
+    narrator's; metadata lines (Title:, Characters:, Story:) are skipped. When
+    the voice is English but the line is in an Indic script (or mixes several),
+    each script run is read by a voice for that script.
+    """
+    script_segments = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        # Skip metadata lines FIRST
+        if line.lower().startswith(METADATA_PREFIXES):
+            log.debug("Skipping metadata line", line=line)
+            continue
+
+        match = SCRIPT_LINE_PATTERN.match(line)
+        if match:
+            char_name = match.group(1).strip()
+            dialogue = match.group(2).strip()
+
+            # Check if this name is actually a metadata tag we missed
+            if char_name.lower() in METADATA_NAMES:
+                continue
+
+            # Remove smart quotes from dialogue
+            dialogue = dialogue.translate(SMART_QUOTES).strip('" ')
+            if not dialogue:
+                continue
+
+            voice = narrator_voice if char_name == "Narrator" else CHARACTER_VOICE_HINTS.get(char_name, narrator_voice)
+            script_segments.extend(_voice_segments(dialogue, voice, speed_str, pitch_str))
+        else:
+            script_segments.extend(_voice_segments(line.translate(SMART_QUOTES), narrator_voice, speed_str, pitch_str))
+
+    # If no segments detected, treat as one block
+    if not script_segments:
+        sanitized_text = text.translate(SMART_QUOTES)
+        voice = get_best_voice(sanitized_text, narrator_voice) if "en-" in narrator_voice.lower() else narrator_voice
+        script_segments = [{"provider": "edge-tts", "text": sanitized_text, "voice": voice, "speed": speed_str, "pitch": pitch_str}]
+    return script_segments
@@ -0,0 +1,417 @@
+import os
+import uuid
+import shutil
+import asyncio
+import tempfile
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import List, Optional
+from logs import get_logger
+
+# Where finished audio lives.
+#
+# "local" keeps files in OUTPUT_DIR, served by the StaticFiles mount at /outputs.
+# "s3" puts them in an S3-compatible bucket (AWS, MinIO, R2, ...) and /outputs/{key}
+# redirects to a presigned (or public) URL, so any instance can serve any story.
+# Either way history records keep "outputs/<filename>" as their audio_path and
+# clients keep using /outputs/<filename>.
+
+log = get_logger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+OUTPUT_DIR = "outputs"
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "outputs/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION") or None
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY") or None
+S3_PRESIGN_SECONDS = int(os.getenv("S3_PRESIGN_SECONDS", "3600"))
+S3_PUBLIC_BASE_URL = os.getenv("S3_PUBLIC_BASE_URL", "").rstrip("/")  # CDN / public bucket, skips presigning
+# Multipart part size; S3 requires at least 5 MB for every part but the last
+S3_PART_SIZE = max(5, int(os.getenv("S3_PART_SIZE_MB", "8"))) * 1024 * 1024
+
+# One stored object as listed by list_objects(); mtime is a Unix timestamp
+StoredObject = namedtuple("StoredObject", "key size mtime")
+
+CONTENT_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".m3u8": "application/vnd.apple.mpegurl"
+}
+
+
+def content_type_for(key: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(key)[1].lower(), "application/octet-stream")
+
+
+def key_for_path(audio_path: str) -> str:
+    """Storage key of a history record's audio_path ("outputs/<key>")."""
+    return os.path.basename(audio_path)
+
+
+def path_for_key(key: str) -> str:
+    """audio_path recorded in history for a stored key."""
+    return os.path.join(OUTPUT_DIR, key)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _read_file_range(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _walk_objects(directory: str) -> List[StoredObject]:
+    objects = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Removed while we were walking
+            key = os.path.relpath(path, directory).replace(os.sep, "/")
+            objects.append(StoredObject(key, st.st_size, st.st_mtime))
+    return objects
+
+
+class AudioWriter(ABC):
+    """
+    Incremental write of one audio object. Nothing is visible under the key
+    until commit(); abort() throws the partial data away.
+    """
+
+    @abstractmethod
+    async def write(self, data: bytes):
+        """Appends `data` to the object."""
+
+    @abstractmethod
+    async def patch(self, offset: int, data: bytes):
+        """
+        Overwrites bytes already written at `offset` (e.g. a header that is only
+        known at the end). S3 writers only allow it within the first part.
+        """
+
+    @abstractmethod
+    async def commit(self) -> int:
+        """Publishes the object and returns its size."""
+
+    @abstractmethod
+    async def abort(self):
+        """Discards everything written so far."""
+
+
+def _open_for_write(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, "wb")
+
+
+def _patch_file(f, offset: int, data: bytes):
+    end = f.tell()
+    f.seek(offset)
+    f.write(data)
+    f.seek(end)
+
+
+class LocalAudioWriter(AudioWriter):
+    def __init__(self, directory: str, key: str):
+        self.path = os.path.join(directory, key)
+        # Hidden temp name in the same directory, so the final rename is atomic
+        folder, name = os.path.split(self.path)
+        self.tmp_path = os.path.join(folder, f".{name}.{uuid.uuid4().hex[:8]}.partial")
+        self._file = None
+        self.size = 0
+
+    async def write(self, data: bytes):
+        if self._file is None:
+            self._file = await asyncio.to_thread(_open_for_write, self.tmp_path)
+        await asyncio.to_thread(self._file.write, data)
+        self.size += len(data)
+
+    async def patch(self, offset: int, data: bytes):
+        if offset + len(data) > self.size:
+            raise ValueError("patch() can only overwrite bytes already written")
+        await asyncio.to_thread(_patch_file, self._file, offset, data)
+
+    async def commit(self) -> int:
+        if self._file is None:
+            self._file = await asyncio.to_thread(_open_for_write, self.tmp_path)
+        await asyncio.to_thread(self._file.close)
+        await asyncio.to_thread(os.replace, self.tmp_path, self.path)
+        return self.size
+
+    async def abort(self):
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+        await asyncio.to_thread(_remove_quietly, self.tmp_path)
+
+
+class LocalStorage:
+    name = "local"
+
+    def __init__(self, directory: str = OUTPUT_DIR):
+        self.directory = directory
+        # Uploads are spooled next to their destination so put_file is a rename
+        self.spool_dir = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def open_writer(self, key: str, cache_control: Optional[str] = None) -> AudioWriter:
+        # Cache headers for local files are set by the route serving them
+        return LocalAudioWriter(self.directory, key)
+
+    async def put_file(self, local_path: str, key: str):
+        """Moves a finished local file into storage."""
+        await asyncio.to_thread(os.replace, local_path, os.path.join(self.directory, key))
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, os.path.join(self.directory, key))
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(_remove_quietly, os.path.join(self.directory, key))
+
+    async def delete_prefix(self, prefix: str):
+        """Deletes every object under a "folder/" prefix."""
+        await asyncio.to_thread(shutil.rmtree, os.path.join(self.directory, prefix), True)
+
+    async def read(self, key: str) -> Optional[bytes]:
+        path = os.path.join(self.directory, key)
+        try:
+            return await asyncio.to_thread(_read_file, path)
+        except FileNotFoundError:
+            return None
+
+    async def list_objects(self) -> List[StoredObject]:
+        """Every stored object, including in-progress (.partial) writes."""
+        return await asyncio.to_thread(_walk_objects, self.directory)
+
+    async def read_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        path = os.path.join(self.directory, key)
+        try:
+            return await asyncio.to_thread(_read_file_range, path, start, length)
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of a stored object (local backend only)."""
+        return os.path.join(self.directory, key)
+
+    async def read_url(self, key: str) -> str:
+        return f"/{OUTPUT_DIR}/{key}"
+
+
+class S3AudioWriter(AudioWriter):
+    """
+    Streams an object to S3 with a multipart upload, one part per S3_PART_SIZE
+    bytes. Objects smaller than one part are sent with a single PutObject.
+
+    The first part is held back until commit() so patch() can still rewrite it.
+    """
+
+    def __init__(self, storage: "S3Storage", key: str, cache_control: Optional[str] = None):
+        self.storage = storage
+        self.key = storage.object_key(key)
+        self.object_args = {"ContentType": content_type_for(key)}
+        if cache_control:
+            self.object_args["CacheControl"] = cache_control
+        self._buffer = bytearray()
+        self._head: Optional[bytearray] = None
+        self._upload_id: Optional[str] = None
+        self._parts = []
+        self.size = 0
+
+    async def _upload_part(self, data: bytes, number: Optional[int] = None):
+        client = self.storage.client
+        if self._upload_id is None:
+            response = await asyncio.to_thread(
+                client.create_multipart_upload,
+                Bucket=self.storage.bucket, Key=self.key, **self.object_args
+            )
+            self._upload_id = response["UploadId"]
+        if number is None:
+            # Part 1 is the held-back head
+            number = len(self._parts) + 2
+        response = await asyncio.to_thread(
+            client.upload_part,
+            Bucket=self.storage.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=number, Body=data
+        )
+        self._parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= S3_PART_SIZE:
+            part = bytes(self._buffer)
+            self._buffer.clear()
+            if self._head is None:
+                self._head = bytearray(part)
+            else:
+                await self._upload_part(part)
+
+    async def patch(self, offset: int, data: bytes):
+        region = self._head if self._head is not None else self._buffer
+        if offset + len(data) > len(region):
+            raise ValueError("S3 writers can only patch bytes within the first part")
+        region[offset:offset + len(data)] = data
+
+    async def commit(self) -> int:
+        client = self.storage.client
+        if self._head is None or (not self._parts and not self._buffer):
+            body = bytes(self._head if self._head is not None else self._buffer)
+            await asyncio.to_thread(
+                client.put_object,
+                Bucket=self.storage.bucket, Key=self.key, Body=body, **self.object_args
+            )
+        else:
+            if self._buffer:
+                await self._upload_part(bytes(self._buffer))
+            await self._upload_part(bytes(self._head), number=1)
+            self._parts.sort(key=lambda part: part["PartNumber"])
+            await asyncio.to_thread(
+                client.complete_multipart_upload,
+                Bucket=self.storage.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts}
+            )
+        self._buffer.clear()
+        self._head = None
+        return self.size
+
+    async def abort(self):
+        self._buffer.clear()
+        self._head = None
+        if self._upload_id is not None:
+            try:
+                await asyncio.to_thread(
+                    self.storage.client.abort_multipart_upload,
+                    Bucket=self.storage.bucket, Key=self.key, UploadId=self._upload_id
+                )
+            except Exception as e:
+                log.warning("Failed to abort multipart upload", key=self.key, error=str(e))
+
+
+class S3Storage:
+    name = "s3"
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX):
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.spool_dir = tempfile.gettempdir()
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY
+        )
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def open_writer(self, key: str, cache_control: Optional[str] = None) -> AudioWriter:
+        return S3AudioWriter(self, key, cache_control)
+
+    async def put_file(self, local_path: str, key: str):
+        # upload_file switches to multipart for large files by itself
+        await asyncio.to_thread(
+            self.client.upload_file, local_path, self.bucket, self.object_key(key),
+            ExtraArgs={"ContentType": content_type_for(key)}
+        )
+        await asyncio.to_thread(_remove_quietly, local_path)
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+
+    def _delete_prefix(self, prefix: str):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix)):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+    async def delete_prefix(self, prefix: str):
+        """Deletes every object under a "folder/" prefix."""
+        await asyncio.to_thread(self._delete_prefix, prefix)
+
+    async def read(self, key: str) -> Optional[bytes]:
+        try:
+            response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=self.object_key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return await asyncio.to_thread(response["Body"].read)
+
+    def _list_objects(self) -> List[StoredObject]:
+        objects = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                key = item["Key"][len(self.prefix):]
+                objects.append(StoredObject(key, item["Size"], item["LastModified"].timestamp()))
+        return objects
+
+    async def list_objects(self) -> List[StoredObject]:
+        """Every stored object (in-progress multipart uploads are not listed)."""
+        return await asyncio.to_thread(self._list_objects)
+
+    async def read_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        try:
+            response = await asyncio.to_thread(
+                self.client.get_object, Bucket=self.bucket, Key=self.object_key(key),
+                Range=f"bytes={start}-{start + length - 1}"
+            )
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return await asyncio.to_thread(response["Body"].read)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+    async def read_url(self, key: str) -> str:
+        if S3_PUBLIC_BASE_URL:
+            return f"{S3_PUBLIC_BASE_URL}/{self.object_key(key)}"
+        return await asyncio.to_thread(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=S3_PRESIGN_SECONDS
+        )
+
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (use 'local' or 's3')")
+    return LocalStorage()
+
+
+storage = create_storage()
@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from api.providers import synthesize_segment
+from api.scheduler import scheduler, segment_weight
+from metrics import segment_synthesis_seconds, segment_failures, failure_reason
+from logs import get_logger
+
+# Per-segment events, sampled per request (LOG_SAMPLE_RATES)
+segment_log = get_logger(f"{__name__}.segments")
+
+# How many segments of a single request are synthesized at the same time
+SEGMENT_CONCURRENCY = int(os.getenv("TTS_SEGMENT_CONCURRENCY", "4"))
+
+# Marks the end of a segment's audio in its chunk queue
+_SEGMENT_DONE = object()
+
+Synthesizer = Callable[[Dict], AsyncIterator[bytes]]
+
+
+class OrderedSynthesis:
+    """
+    Synthesizes script segments concurrently and emits their audio in script order.
+
+    Up to `concurrency` segments are in flight at once, each in a slot of the
+    process-wide scheduler (queued fairly with other users' segments under `user`),
+    whichever provider they use. Audio of the segment at the head
+    of the script is forwarded as soon as it arrives; segments further ahead are
+    buffered until it is their turn. A segment that fails or produces no audio is
+    skipped and the rest of the story continues.
+    """
+
+    def __init__(
+        self,
+        segments: List[Dict],
+        synthesize: Synthesizer = synthesize_segment,
+        concurrency: Optional[int] = None,
+        on_segment: Optional[Callable[[int, bool], Awaitable[None]]] = None,
+        user: Optional[str] = None
+    ):
+        # Keep the original script index so log lines match the request
+        self._segments = [(i, seg) for i, seg in enumerate(segments) if seg["text"].strip()]
+        self._synthesize = synthesize
+        self._concurrency = max(1, concurrency or SEGMENT_CONCURRENCY)
+        self._on_segment = on_segment
+        self._user = user or ""
+        self.total = len(self._segments)
+        self.generated_count = 0
+        self.failed_count = 0
+        self.last_error: Optional[Exception] = None
+
+    async def _produce(self, index: int, segment: Dict, queue: asyncio.Queue) -> bool:
+        has_audio = False
+        provider = segment.get("provider") or "edge-tts"
+        try:
+            async with scheduler.slot(self._user, segment_weight(segment)):
+                segment_log.debug("Segment started", index=index, voice=segment["voice"], provider=provider, text=segment["text"])
+                started = time.perf_counter()
+                async for data in self._synthesize(segment):
+                    if data:
+                        queue.put_nowait(data)
+                        has_audio = True
+                elapsed = time.perf_counter() - started
+                segment_synthesis_seconds.observe(elapsed, provider=provider, voice=segment["voice"])
+            if has_audio:
+                segment_log.debug("Segment done", index=index, seconds=round(elapsed, 3))
+            else:
+                segment_failures.inc(provider=provider, reason="no_audio")
+                segment_log.warning("Segment produced no audio", index=index, voice=segment["voice"], text=segment["text"])
+            return has_audio
+        except Exception as seg_err:
+            self.last_error = seg_err
+            segment_failures.inc(provider=provider, reason=failure_reason(seg_err))
+            segment_log.warning("Segment failed", index=index, voice=segment["voice"], error=str(seg_err))
+            # Skip this segment instead of failing the entire story
+            return False
+        finally:
+            queue.put_nowait(_SEGMENT_DONE)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yields the story's audio chunks in script order."""
+        window = deque()
+        upcoming = iter(self._segments)
+
+        def fill_window():
+            while len(window) < self._concurrency:
+                next_segment = next(upcoming, None)
+                if next_segment is None:
+                    return
+                index, segment = next_segment
+                queue = asyncio.Queue()
+                task = asyncio.create_task(self._produce(index, segment, queue))
+                window.append((index, queue, task))
+
+        try:
+            fill_window()
+            while window:
+                index, queue, task = window[0]
+                while True:
+                    data = await queue.get()
+                    if data is _SEGMENT_DONE:
+                        break
+                    yield data
+
+                window.popleft()
+                fill_window()
+
+                ok = await task
+                if ok:
+                    self.generated_count += 1
+                else:
+                    self.failed_count += 1
+                if self._on_segment:
+                    await self._on_segment(index, ok)
+        finally:
+            # Consumer went away (or failed): stop everything still in flight
+            for _, _, task in window:
+                task.cancel()
+
+    async def write_to(self, fileobj) -> int:
+        """Writes the whole story into an open binary file. Returns the number of segments with audio."""
+        async for data in self.chunks():
+            fileobj.write(data)
+        return self.generated_count
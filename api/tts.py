@@ -1,343 +1,366 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-import edge_tts
+from fastapi import APIRouter, Depends, Header, HTTPException, UploadFile, File, Form, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
 import uuid
-import re
 import asyncio
-from typing import List
+import time
+from typing import Dict, List, Optional, Tuple
 from database import get_database
-from models import TTSRequest, TTSHistory, UserInDB, TTSSettings, PublicStory
+from models import TTSRequest, TTSHistory, TTSHistorySummary, UserInDB, TTSSettings, PublicStory, PublicStorySummary
 from auth import get_current_user
 from bson import ObjectId
 from api import bhashini # Import Bhashini service
+from api import jobs
+from api import public_feed
+from api import uploads
+from api import hls
+from api import outputs_gc
+from api import idempotency
+from api import scheduler
+from api.storage import storage, OUTPUT_DIR, key_for_path, path_for_key
+from api.synthesis import OrderedSynthesis
+from api.mp3 import Mp3Assembler, xing_frame
+from api.script_parser import parse_narration
+from api.voices import VOICE_MAPPING
+from api.pagination import fetch_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from metrics import segments_per_request, audio_bytes as audio_bytes_metric, generation_failures, failure_reason
+from logs import get_logger
+
+log = get_logger(__name__)
 
 router = APIRouter(prefix="/tts", tags=["tts"])
 
-OUTPUT_DIR = "outputs"
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
 
-# Comprehensive Mapping of personas to edge-tts voices
-VOICE_MAPPING = {
-    # Original Narrators
-    "The Narrator": "en-US-GuyNeural",
-    "Dr. Kathe": "en-US-EmmaNeural",
-    "Deep Mystery": "en-GB-RyanNeural",
-    "Soft Whisper": "en-US-JennyNeural",
-    
-    # Hindi Voices
-    "Swara (Female)": "hi-IN-SwaraNeural",
-    "Neerja (Female)": "hi-IN-NeerjaNeural",
-    "Madhur (Male)": "hi-IN-MadhurNeural",
-    "Arjun (Male - Expressive)": "hi-IN-ArjunNeural",
-    "Aarti (Female - Expressive)": "hi-IN-AartiNeural",
-    
-    # English (India)
-    "Neerja (IN - Female)": "en-IN-NeerjaNeural",
-    "Prabhat (IN - Male)": "en-IN-PrabhatNeural",
-    "Aashi (IN - Female)": "en-IN-AashiNeural",
-    "Arjun (IN - Male Expressive)": "en-IN-ArjunNeural",
-    "Aarti (IN - Female Expressive)": "en-IN-AartiNeural",
-    
-    # Regional Indian Languages
-    "Bashkar (Bengali - Male)": "bn-IN-BashkarNeural",
-    "Tanishaa (Bengali - Female)": "bn-IN-TanishaaNeural",
-    "Sapna (Kannada - Female)": "kn-IN-SapnaNeural",
-    "Gagan (Kannada - Male)": "kn-IN-GaganNeural",
-    "Sobhana (Malayalam - Female)": "ml-IN-SobhanaNeural",
-    "Midhun (Malayalam - Male)": "ml-IN-MidhunNeural",
-    "Aarohi (Marathi - Female)": "mr-IN-AarohiNeural",
-    "Manohar (Marathi - Male)": "mr-IN-ManoharNeural",
-    "Yashica (Assamese - Female)": "as-IN-YashicaNeural",
-    "Punjabi (Female)": "pa-IN-OjasNeural",
-    "Punjabi (Male)": "pa-IN-GaganNeural",
-    "Odia (Female)": "or-IN-SubhasiniNeural"
-}
-
 @router.get("/bhashini/config")
 async def get_bhashini_configuration():
     return await bhashini.get_bhashini_config()
 
-@router.post("/generate")
-async def generate_audio(request: TTSRequest, current_user: UserInDB = Depends(get_current_user)):
-    try:
-        # PREMIUM MODE HANDLER
-        if request.is_premium:
-            if request.segments:
-                # TODO: Implement multi-segment support for Bhashini if needed
-                # For now, we'll join text or handle first segment
-                text_to_process = " ".join([seg.text for seg in request.segments])
-                # Use settings from first segment
-                target_lang = request.segments[0].language
-                target_voice = request.segments[0].persona
-                voice_style = getattr(request.segments[0], 'voice_style', 'Neutral')
-                speech_rate = request.segments[0].speed
-                base_settings = TTSSettings(
-                    language=target_lang,
-                    persona=target_voice,
-                    speed=request.segments[0].speed,
-                    pitch=request.segments[0].pitch,
-                    voice_style=voice_style,
-                    is_premium=True
-                )
-            else:
-                text_to_process = request.text
-                target_lang = request.settings.language
-                target_voice = request.settings.persona
-                voice_style = getattr(request.settings, 'voice_style', 'Neutral')
-                speech_rate = request.settings.speed
-                base_settings = request.settings
-
-            # Generate with Bhashini
-            print(f"DEBUG: Premium Bhashini Request: {text_to_process[:50]}... Lang: {target_lang}, Style: {voice_style}")
-            
-            # Call Bhashini with voice style and speech rate
-            audio_data = await bhashini.generate_bhashini_audio(
-                text=text_to_process, 
-                language=target_lang, 
-                voice_id=target_voice,
-                voice_style=voice_style,
-                speech_rate=speech_rate
-            )
-            
-            # Save to file
-            if request.title:
-                safe_title = "".join([c for c in request.title if c.isalnum() or c in (' ', '-', '_')]).strip()
-                safe_title = safe_title.replace(' ', '_')
-                filename = f"{safe_title}_{uuid.uuid4().hex[:8]}.mp3" if safe_title else f"{uuid.uuid4()}.mp3"
-            else:
-                filename = f"{uuid.uuid4()}.mp3"
-                
-            filepath = os.path.join(OUTPUT_DIR, filename)
-            with open(filepath, "wb") as f:
-                f.write(audio_data)
-                
-            # History Saving (Common logic)
-            db = await get_database()
-            history = TTSHistory(
-                user_id=str(current_user.id),
-                title=request.title,
-                text=text_to_process.strip(),
-                settings=base_settings,
-                audio_path=filepath
-            )
-            
-            history_dict = history.dict(by_alias=True)
-            if "_id" in history_dict and not isinstance(history_dict["_id"], ObjectId):
-                    history_dict["_id"] = ObjectId(str(history_dict["_id"]))
-                    
-            await db.tts_history.insert_one(history_dict)
-            
-            return {
-                "audio_url": f"/outputs/{filename}",
-                "filename": filename
-            }
-
-        # STANDARD EDGE-TTS FLOW
-        script_segments = []
-        combined_text = ""
-        base_settings = None # This will hold the settings for history
-
-        # If explicit segments are provided (Structured Multi-Narration)
-        if request.segments:
-            if not request.segments:
-                raise HTTPException(status_code=400, detail="Segments array cannot be empty if provided.")
-            
-            for seg in request.segments:
-                speed_percent = int((seg.speed - 1.0) * 100)
-                speed_str = f"{speed_percent:+d}%"
-                pitch_str = f"{seg.pitch:+d}Hz"
-                voice = VOICE_MAPPING.get(seg.persona, "en-US-GuyNeural")
-                script_segments.append({
-                    "text": seg.text,
-                    "voice": voice,
-                    "speed": speed_str,
-                    "pitch": pitch_str
-                })
-                combined_text += seg.text + " "
-            
-            # Use the settings from the first segment as a placeholder for history
-            # Assuming all segments share the same language for history purposes, or it's not critical
-            base_settings = TTSSettings(
-                language=request.segments[0].language,
-                persona=request.segments[0].persona,
-                speed=request.segments[0].speed,
-                pitch=request.segments[0].pitch,
-                style_instruction=request.segments[0].style_instruction
-            )
-        else:
-            # Traditional Single Narration with heuristic parsing
-            if not request.text or not request.settings:
-                raise HTTPException(status_code=400, detail="Text and settings are required for single narration mode.")
-            
-            combined_text = request.text
-            base_settings = request.settings
-            
-            narrator_voice = VOICE_MAPPING.get(request.settings.persona, "en-US-GuyNeural")
-            speed_percent = int((request.settings.speed - 1.0) * 100)
-            speed_str = f"{speed_percent:+d}%"
-            pitch_str = f"{request.settings.pitch:+d}Hz"
-            
-            lines = request.text.split('\n')
-            
-            char_voice_hints = {
-                "Anna": "en-IN-NeerjaNeural",
-                "Ben": "en-IN-ArjunNeural",
-                "Owner": "en-IN-PrabhatNeural",
-                "Narrator": narrator_voice,
-                "Doctor": "en-IN-PrabhatNeural",
-                "Friend": "en-IN-PrabhatNeural",
-                "Girl": "en-IN-AashiNeural",
-                "Boy": "en-IN-ArjunNeural"
-            }
-
-            # Regex to detect "Name: Dialogue" or "Name – Dialogue"
-            # Matches "Anna:", "Old Man:", "Character Name –"
-            script_pattern = re.compile(r'^([A-Z][a-zA-Z\s]+)[:–]\s*(.*)$')
-
-            def get_best_voice(text, primary_voice):
-                # Check for Kannada characters
-                if re.search(r'[\u0C80-\u0CFF]', text):
-                    return "kn-IN-SapnaNeural"
-                # Check for Devanagari (Hindi/Marathi)
-                if re.search(r'[\u0900-\u097F]', text):
-                    return "hi-IN-SwaraNeural"
-                # Check for Bengali
-                if re.search(r'[\u0980-\u09FF]', text):
-                    return "bn-IN-TanishaaNeural"
-                # Check for Malayalam
-                if re.search(r'[\u0D00-\u0D7F]', text):
-                    return "ml-IN-SobhanaNeural"
-                return primary_voice
-
-            for line in lines:
-                line = line.strip()
-                if not line: continue
-                
-                # Skip metadata lines FIRST
-                if line.lower().startswith(("title:", "characters:", "story:")):
-                    print(f"DEBUG: Skipping metadata line: {line}")
-                    continue
-
-                match = script_pattern.match(line)
-                if match:
-                    char_name = match.group(1).strip()
-                    dialogue = match.group(2).strip()
-                    
-                    # Check if this name is actually a metadata tag we missed
-                    if char_name.lower() in ["title", "characters", "story"]:
-                        continue
-
-                    # Remove smart quotes from dialogue
-                    dialogue = dialogue.replace('“', '"').replace('”', '"').replace('‘', "'").replace('’', "'").strip('" ')
-                    
-                    if not dialogue: continue
-                    
-                    voice = char_voice_hints.get(char_name, narrator_voice)
-                    # Auto-detect language if the assigned voice is English but text is not
-                    if "en-" in voice.lower():
-                        voice = get_best_voice(dialogue, voice)
-                        
-                    script_segments.append({"text": dialogue, "voice": voice, "speed": speed_str, "pitch": pitch_str})
-                else:
-                    sanitized_line = line.replace('“', '"').replace('”', '"').replace('‘', "'").replace('’', "'")
-                    voice = narrator_voice
-                    # Auto-detect language for narrator text if narrator is English
-                    if "en-" in voice.lower():
-                        voice = get_best_voice(sanitized_line, voice)
-                        
-                    script_segments.append({"text": sanitized_line, "voice": voice, "speed": speed_str, "pitch": pitch_str})
-
-            # If no segments detected, treat as one block
-            if not script_segments:
-                sanitized_text = request.text.replace('“', '"').replace('”', '"').replace('‘', "'").replace('’', "'")
-                voice = get_best_voice(sanitized_text, narrator_voice) if "en-" in narrator_voice.lower() else narrator_voice
-                script_segments = [{"text": sanitized_text, "voice": voice, "speed": speed_str, "pitch": pitch_str}]
-
-        # Create filename - use title if available
-        if request.title:
-            safe_title = "".join([c for c in request.title if c.isalnum() or c in (' ', '-', '_')]).strip()
-            safe_title = safe_title.replace(' ', '_')
-            if not safe_title:
-                filename = f"{uuid.uuid4()}.mp3"
-            else:
-                filename = f"{safe_title}_{uuid.uuid4().hex[:8]}.mp3"
-        else:
-            filename = f"{uuid.uuid4()}.mp3"
-            
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        
-        generated_count = 0
-        print(f"DEBUG: Starting generation for {len(script_segments)} segments")
+def build_output_filename(title: Optional[str]) -> str:
+    """Creates a unique mp3 filename, based on the story title when there is one."""
+    if title:
+        safe_title = "".join([c for c in title if c.isalnum() or c in (' ', '-', '_')]).strip()
+        safe_title = safe_title.replace(' ', '_')
+        if safe_title:
+            return f"{safe_title}_{uuid.uuid4().hex[:8]}.mp3"
+    return f"{uuid.uuid4()}.mp3"
+
+def build_bhashini_segments(text: str, language: str, persona: str, voice_style: Optional[str], speed: float,
+                            failover: Optional[bool] = None) -> List[Dict]:
+    """Premium segments for one voice; long texts are split at sentence boundaries into parallel requests."""
+    return [
+        {
+            "provider": "bhashini",
+            "text": chunk,
+            "language": language,
+            "voice": persona,
+            "style": voice_style or "Neutral",
+            "speed": speed,
+            "failover": failover
+        }
+        for chunk in bhashini.split_text_for_synthesis(text)
+    ]
+
+def build_script_segments(request: TTSRequest) -> Tuple[List[Dict], str, TTSSettings]:
+    """
+    Turns a request into the list of segments to synthesize. Each segment is routed to
+    edge-tts or Bhashini on its own, so premium and standard voices can share one story.
+    Returns (script_segments, combined_text, base_settings) where the last two are used for history.
+    """
+    script_segments = []
+    combined_text = ""
+    base_settings = None # This will hold the settings for history
+
+    # If explicit segments are provided (Structured Multi-Narration)
+    if request.segments:
+        if not request.segments:
+            raise HTTPException(status_code=400, detail="Segments array cannot be empty if provided.")
         
-        with open(filepath, "wb") as final_file:
-            for i, seg in enumerate(script_segments):
-                text_chunk = seg["text"]
-                voice_id = seg["voice"]
-                rate = seg["speed"]
-                pitch = seg["pitch"]
-                
-                if not text_chunk.strip(): continue
-                
-                print(f"DEBUG: Processing Segment {i} | Voice: {voice_id} | Text: {text_chunk[:30]}...")
-                
-                try:
-                    communicate = edge_tts.Communicate(
-                        text_chunk, 
-                        voice_id, 
-                        rate=rate, 
-                        pitch=pitch
-                    )
-                    
-                    has_audio = False
-                    async for chunk in communicate.stream():
-                        if chunk["type"] == "audio":
-                            final_file.write(chunk["data"])
-                            has_audio = True
-                    
-                    if has_audio:
-                        generated_count += 1
-                        print(f"DEBUG: Segment {i} SUCCESS")
-                    else:
-                        print(f"DEBUG: Segment {i} WARNING: No audio produced for text: '{text_chunk}'")
-                
-                except Exception as seg_err:
-                    print(f"DEBUG: Segment {i} FAILED: {str(seg_err)}")
-                    # Continue to next segment instead of failing entire story
-                    continue
+        for seg in request.segments:
+            combined_text += seg.text + " "
+            # A segment may override the request-level premium flag
+            is_premium = request.is_premium if seg.is_premium is None else seg.is_premium
+            if is_premium:
+                script_segments.extend(build_bhashini_segments(
+                    seg.text, seg.language, seg.persona, seg.voice_style, seg.speed, request.failover
+                ))
+                continue
+
+            speed_percent = int((seg.speed - 1.0) * 100)
+            speed_str = f"{speed_percent:+d}%"
+            pitch_str = f"{seg.pitch:+d}Hz"
+            voice = VOICE_MAPPING.get(seg.persona, "en-US-GuyNeural")
+            script_segments.append({
+                "provider": "edge-tts",
+                "text": seg.text,
+                "voice": voice,
+                "speed": speed_str,
+                "pitch": pitch_str
+            })
         
-        if generated_count == 0:
-            raise Exception("Failed to generate any audio segments. Check if your script contains valid text.")
+        # Use the settings from the first segment as a placeholder for history
+        # Assuming all segments share the same language for history purposes, or it's not critical
+        base_settings = TTSSettings(
+            language=request.segments[0].language,
+            persona=request.segments[0].persona,
+            speed=request.segments[0].speed,
+            pitch=request.segments[0].pitch,
+            style_instruction=request.segments[0].style_instruction,
+            voice_style=request.segments[0].voice_style,
+            is_premium=request.is_premium
+        )
+    elif request.is_premium:
+        # Premium single narration: one Bhashini voice for the whole text
+        if not request.text or not request.settings:
+            raise HTTPException(status_code=400, detail="Text and settings are required for single narration mode.")
 
-        # Save to history
-        db = await get_database()
-        history = TTSHistory(
-            user_id=str(current_user.id),
-            title=request.title,
-            text=combined_text.strip(), # Use combined_text for history
-            settings=base_settings, # Use base_settings for history
-            audio_path=filepath
+        combined_text = request.text
+        base_settings = request.settings
+        script_segments = build_bhashini_segments(
+            request.text,
+            request.settings.language,
+            request.settings.persona,
+            request.settings.voice_style,
+            request.settings.speed,
+            request.failover
         )
+    else:
+        # Traditional Single Narration with heuristic parsing
+        if not request.text or not request.settings:
+            raise HTTPException(status_code=400, detail="Text and settings are required for single narration mode.")
+        
+        combined_text = request.text
+        base_settings = request.settings
         
-        history_dict = history.dict(by_alias=True)
-        if "_id" in history_dict and not isinstance(history_dict["_id"], ObjectId):
-             history_dict["_id"] = ObjectId(str(history_dict["_id"]))
-             
-        await db.tts_history.insert_one(history_dict)
+        narrator_voice = VOICE_MAPPING.get(request.settings.persona, "en-US-GuyNeural")
+        speed_percent = int((request.settings.speed - 1.0) * 100)
+        speed_str = f"{speed_percent:+d}%"
+        pitch_str = f"{request.settings.pitch:+d}Hz"
         
-        return {
-            "audio_url": f"/outputs/{filename}",
-            "filename": filename
+        script_segments = parse_narration(request.text, narrator_voice, speed_str, pitch_str)
+
+    return script_segments, combined_text, base_settings
+
+async def save_history(user_id: str, title: Optional[str], text: str, settings: TTSSettings, filepath: str,
+                       hls_playlist_path: Optional[str] = None, assembler: Optional[Mp3Assembler] = None,
+                       audio_bytes: Optional[int] = None):
+    db = await get_database()
+    history = TTSHistory(
+        user_id=user_id,
+        title=title,
+        text=text.strip(),
+        settings=settings,
+        audio_path=filepath,
+        hls_playlist_path=hls_playlist_path,
+        duration_seconds=round(assembler.duration, 3) if assembler else None,
+        segment_index=assembler.segments if assembler else None,
+        audio_bytes=audio_bytes
+    )
+    
+    history_dict = history.dict(by_alias=True)
+    if "_id" in history_dict and not isinstance(history_dict["_id"], ObjectId):
+         history_dict["_id"] = ObjectId(str(history_dict["_id"]))
+         
+    await db.tts_history.insert_one(history_dict)
+    outputs_gc.schedule_quota_check(user_id)
+    return history_dict
+
+async def render_story(request: TTSRequest, user_id: str, progress=None) -> Dict:
+    """
+    Synthesizes a story to outputs/ and records it in the user's history.
+
+    Shared by the synchronous /generate endpoint and the background job workers.
+    `progress` (optional) is notified with started(total) and segment_done(index, ok).
+    Returns the same payload /generate responds with.
+    """
+    # Standard (edge-tts) and premium (Bhashini) segments go through the same pipeline
+    script_segments, combined_text, base_settings = build_script_segments(request)
+
+    filename = build_output_filename(request.title)
+    filepath = path_for_key(filename)
+    
+    log.info("Starting generation", segments=len(script_segments), filename=filename, mode="job" if progress else "sync")
+
+    writer = storage.open_writer(filename)
+    # Segments' frames are joined under one Xing header, with a byte/time index per segment
+    assembler = Mp3Assembler(writer)
+
+    async def segment_done(index: int, ok: bool):
+        await assembler.end_segment(index, ok)
+        if progress:
+            await progress.segment_done(index, ok)
+
+    # Segments are synthesized concurrently but written in script order
+    synthesis = OrderedSynthesis(script_segments, on_segment=segment_done, user=user_id)
+    mode = "job" if progress else "sync"
+    segments_per_request.observe(synthesis.total, mode=mode)
+    if progress:
+        await progress.started(synthesis.total)
+    # HLS rendition is cut from the same bytes as they are written
+    packager = hls.HlsPackager(hls.stem_for(filename), request.hls)
+    try:
+        async for data in synthesis.chunks():
+            await assembler.feed(data)
+            await packager.feed(data)
+        
+        if synthesis.generated_count == 0:
+            if synthesis.last_error is not None:
+                # Surface the provider's own error (e.g. a Bhashini 400 for an invalid voice)
+                raise synthesis.last_error
+            raise Exception("Failed to generate any audio segments. Check if your script contains valid text.")
+        if assembler.frames == 0:
+            raise Exception("The TTS providers returned no playable MP3 audio.")
+        await assembler.finish()
+        hls_playlist_path = await packager.finish()
+        audio_bytes = await writer.commit() + packager.size
+    except BaseException as e:
+        # Failed or cancelled: nothing partial becomes visible in storage
+        await writer.abort()
+        await packager.abort()
+        if isinstance(e, Exception):
+            generation_failures.inc(mode=mode, reason=failure_reason(e))
+        raise
+    audio_bytes_metric.inc(assembler.size, mode=mode)
+
+    # Save to history
+    await save_history(user_id, request.title, combined_text, base_settings, filepath, hls_playlist_path, assembler, audio_bytes)
+    
+    result = {
+        "audio_url": f"/outputs/{filename}",
+        "filename": filename,
+        "duration_seconds": round(assembler.duration, 3)
+    }
+    if hls_playlist_path:
+        result["hls_url"] = f"/{hls_playlist_path}"
+    return result
+
+async def _generate(request: TTSRequest, user_id: str, fingerprint: str) -> Tuple[int, Dict]:
+    if request.background:
+        # Long stories: hand the work to the job queue and let the client poll.
+        # They count against the user's rate but wait out overload in the queue.
+        scheduler.admit(user_id, scheduler.request_cost(request), shed=False)
+        job_id = await jobs.enqueue_job(user_id, request)
+        return 202, {
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/tts/jobs/{job_id}"
         }
 
+    if not idempotency.in_flight(fingerprint):
+        scheduler.admit(user_id, scheduler.request_cost(request))
+    try:
+        # Identical requests already rendering (double clicks, retries) share that render
+        return 200, await idempotency.single_flight(fingerprint, lambda: render_story(request, user_id))
     except Exception as e:
-        import traceback
-        error_msg = f"CRITICAL ERROR in generate_audio: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
-        with open("error.log", "a", encoding="utf-8") as f:
-            f.write(error_msg + "\n")
+        # Written to stdout and LOG_ERROR_FILE by the logging thread
+        log.exception("Generation failed", title=request.title)
         raise HTTPException(status_code=500, detail=f"TTS Generation failed: {str(e)}")
 
+@router.post("/generate")
+async def generate_audio(
+    request: TTSRequest,
+    current_user: UserInDB = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Renders a story (or queues it with `background`). Retries sent with the same
+    Idempotency-Key get the first response back instead of a second story.
+    """
+    user_id = str(current_user.id)
+    fingerprint = idempotency.fingerprint(user_id, request)
+    if idempotency_key is not None:
+        replay = await idempotency.begin(user_id, idempotency_key, fingerprint)
+        if replay is not None:
+            return JSONResponse(status_code=replay["status_code"], content=replay["body"], headers={"Idempotent-Replayed": "true"})
+
+    try:
+        status_code, body = await _generate(request, user_id, fingerprint)
+    except BaseException:
+        if idempotency_key is not None:
+            await idempotency.release(user_id, idempotency_key)
+        raise
+    if idempotency_key is not None:
+        await idempotency.complete(user_id, idempotency_key, status_code, body)
+    return JSONResponse(status_code=status_code, content=body)
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    job = await jobs.get_job(job_id, str(current_user.id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or unauthorized")
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    job = await jobs.cancel_job(job_id, str(current_user.id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or unauthorized")
+    return job
+
+@router.post("/stream")
+async def stream_audio(request: TTSRequest, current_user: UserInDB = Depends(get_current_user)):
+    """
+    Streaming variant of /generate: the MP3 is sent to the client while it is being synthesized.
+    The same bytes are written to outputs/ and the history record is inserted once the story completes.
+    """
+    script_segments, combined_text, base_settings = build_script_segments(request)
+    user_id = str(current_user.id)
+    scheduler.admit(user_id, len(script_segments))
+    filename = build_output_filename(request.title)
+    filepath = path_for_key(filename)
+
+    log.info("Starting generation", segments=len(script_segments), filename=filename, mode="stream")
+    writer = storage.open_writer(filename)
+    # The client gets the providers' bytes as they come; the stored copy is re-muxed and indexed
+    assembler = Mp3Assembler(writer)
+    synthesis = OrderedSynthesis(script_segments, on_segment=assembler.end_segment, user=user_id)
+    segments_per_request.observe(synthesis.total, mode="stream")
+
+    async def audio_stream():
+        started = time.perf_counter()
+        first_audio_at = None
+        completed = False
+        try:
+            async for data in synthesis.chunks():
+                if first_audio_at is None:
+                    first_audio_at = time.perf_counter() - started
+                    log.info("Stream first audio", filename=filename, ms=round(first_audio_at * 1000))
+                await assembler.feed(data)
+                yield data
+            completed = True
+        finally:
+            if not completed:
+                # Client disconnected mid-story: don't leave a partial file behind
+                await writer.abort()
+                generation_failures.inc(mode="stream", reason="client_disconnected")
+                log.info("Stream aborted", filename=filename, segments_done=synthesis.generated_count)
+
+        if synthesis.generated_count == 0 or assembler.frames == 0:
+            await writer.abort()
+            generation_failures.inc(mode="stream", reason="no_audio")
+            log.warning("Stream produced no audio", filename=filename, failed=synthesis.failed_count)
+            return
+
+        await assembler.finish()
+        audio_bytes = await writer.commit()
+        audio_bytes_metric.inc(assembler.size, mode="stream")
+        await save_history(user_id, request.title, combined_text, base_settings, filepath,
+                           assembler=assembler, audio_bytes=audio_bytes)
+        log.info("Stream finished", filename=filename, seconds=round(time.perf_counter() - started, 2),
+                 segments_done=synthesis.generated_count, segments=synthesis.total)
+
+    return StreamingResponse(
+        audio_stream(),
+        media_type="audio/mpeg",
+        headers={
+            # The finished file will be available here once the stream completes
+            "X-Audio-Url": f"/outputs/{filename}",
+            "X-Audio-Filename": filename,
+            "Cache-Control": "no-store"
+        }
+    )
+
 @router.delete("/history/{history_id}")
 async def delete_history(history_id: str, current_user: UserInDB = Depends(get_current_user)):
     db = await get_database()
@@ -354,28 +377,105 @@ async def delete_history(history_id: str, current_user: UserInDB = Depends(get_c
     if not history_item:
         raise HTTPException(status_code=404, detail="Story not found or unauthorized")
         
-    # Delete file from disk
+    # Delete file from disk, unless another story still plays it (deduplicated uploads)
     audio_path = history_item.get("audio_path")
-    if audio_path and os.path.exists(audio_path):
+    shared = audio_path and await db.tts_history.find_one(
+        {"audio_path": audio_path, "evicted_at": None, "_id": {"$ne": history_item["_id"]}}, {"_id": 1}
+    )
+    if audio_path and not shared:
+        try:
+            await storage.delete(key_for_path(audio_path))
+        except Exception as e:
+            log.warning("Failed to delete audio", path=audio_path, error=str(e))
+    if history_item.get("hls_playlist_path"):
         try:
-            os.remove(audio_path)
+            await hls.delete_rendition(history_item["hls_playlist_path"])
         except Exception as e:
-            print(f"DEBUG: Failed to delete file {audio_path}: {e}")
+            log.warning("Failed to delete HLS rendition", path=history_item["hls_playlist_path"], error=str(e))
             
     # Delete from database using the actual ID found
     await db.tts_history.delete_one({"_id": history_item["_id"]})
     
     # Also remove from public stories if present
-    await db.public_stories.delete_one({"original_history_id": history_id})
+    removed = await db.public_stories.delete_one({"original_history_id": history_id})
+    if removed.deleted_count:
+        public_feed.invalidate()
     return {"message": "Story deleted successfully"}
 
-@router.get("/history", response_model=List[TTSHistory])
-async def get_history(current_user: UserInDB = Depends(get_current_user)):
+def story_id_query(story_id: str):
+    # Handle both ObjectId and string ID storage
+    try:
+        return {"$in": [ObjectId(story_id), story_id]}
+    except Exception:
+        return story_id
+
+@router.get("/history", response_model=List[TTSHistorySummary])
+async def get_history(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_text: bool = False,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    The user's stories, newest first. Pass the X-Next-Cursor response header
+    back as `cursor` for the next page; story text is left out unless
+    `include_text` is set (GET /history/{id} returns one story in full).
+    """
     db = await get_database()
-    cursor = db.tts_history.find({"user_id": str(current_user.id)}).sort("created_at", -1)
-    history = await cursor.to_list(length=100)
+    # Segment indexes are only needed to serve single segments
+    projection = {"segment_index": 0} if include_text else {"text": 0, "segment_index": 0}
+    history, next_cursor = await fetch_page(db.tts_history, {"user_id": str(current_user.id)}, cursor, limit, projection)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return history
 
+async def segment_response(story: Dict, index: int) -> Response:
+    """
+    One segment of a story as a standalone MP3: its frames are read as a byte
+    range of the story file (no re-encoding) behind their own Xing header.
+    """
+    segment = next((seg for seg in story.get("segment_index") or [] if seg["index"] == index), None)
+    if segment is None:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    key = key_for_path(story["audio_path"])
+    data = await storage.read_range(key, segment["offset"], segment["length"])
+    if not data or len(data) < segment["length"]:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    outputs_gc.record_access(key)
+    # The tag's byte count includes the Xing frame itself, whose size doesn't depend on the count
+    xing_size = len(xing_frame(data[:4], 0, 0))
+    header = xing_frame(data[:4], segment["frames"], xing_size + len(data))
+    return Response(
+        content=header + data,
+        media_type="audio/mpeg",
+        headers={"X-Segment-Start": f"{segment['start']:.3f}", "X-Segment-Duration": f"{segment['duration']:.3f}"}
+    )
+
+@router.get("/history/{history_id}/segments/{index}")
+async def get_history_segment(history_id: str, index: int, current_user: UserInDB = Depends(get_current_user)):
+    db = await get_database()
+    history_item = await db.tts_history.find_one(
+        {"_id": story_id_query(history_id), "user_id": str(current_user.id), "evicted_at": None},
+        {"audio_path": 1, "segment_index": 1}
+    )
+    if not history_item:
+        raise HTTPException(status_code=404, detail="Story not found or unauthorized")
+    return await segment_response(history_item, index)
+
+@router.get("/usage")
+async def get_usage(current_user: UserInDB = Depends(get_current_user)):
+    """Audio storage used by the user's stories and their quota."""
+    return await outputs_gc.user_usage(str(current_user.id))
+
+@router.get("/history/{history_id}", response_model=TTSHistory)
+async def get_history_item(history_id: str, current_user: UserInDB = Depends(get_current_user)):
+    db = await get_database()
+    history_item = await db.tts_history.find_one({"_id": story_id_query(history_id), "user_id": str(current_user.id)})
+    if not history_item:
+        raise HTTPException(status_code=404, detail="Story not found or unauthorized")
+    return history_item
+
 @router.post("/public/{history_id}")
 async def toggle_public_story(history_id: str, current_user: UserInDB = Depends(get_current_user)):
     db = await get_database()
@@ -397,12 +497,15 @@ async def toggle_public_story(history_id: str, current_user: UserInDB = Depends(
 
     # Check if already public
     existing_public = await db.public_stories.find_one({"original_history_id": history_id})
+    if not existing_public and history_item.get("evicted_at"):
+        raise HTTPException(status_code=400, detail="This story's audio was removed to free space. Generate it again to publish it.")
 
     try:
         if existing_public:
             # Toggle OFF: Delete from public AND update history
             await db.public_stories.delete_one({"_id": existing_public["_id"]})
             await db.tts_history.update_one({"_id": real_id}, {"$set": {"is_public": False}})
+            public_feed.invalidate()
             return {"status": "removed", "message": "Story removed from public library"}
         else:
             # Ensure settings is valid TTSSettings object
@@ -420,21 +523,54 @@ async def toggle_public_story(history_id: str, current_user: UserInDB = Depends(
                 title=history_item.get("title"),
                 text=history_item["text"],
                 settings=settings_obj,
-                audio_path=history_item["audio_path"]
+                audio_path=history_item["audio_path"],
+                hls_playlist_path=history_item.get("hls_playlist_path"),
+                duration_seconds=history_item.get("duration_seconds"),
+                segment_index=history_item.get("segment_index")
             )
             await db.public_stories.insert_one(public_story.model_dump(by_alias=True))
             await db.tts_history.update_one({"_id": real_id}, {"$set": {"is_public": True}})
+            public_feed.invalidate()
             return {"status": "added", "message": "Story published to public library"}
     except Exception as e:
-        print(f"ERROR in toggle_public: {str(e)}")
+        log.exception("Public toggle failed", story_id=history_id)
         raise HTTPException(status_code=500, detail=f"Public toggle failed: {str(e)}")
 
-@router.get("/public", response_model=List[PublicStory])
-async def get_public_stories():
+@router.get("/public", response_model=List[PublicStorySummary])
+async def get_public_stories(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_text: bool = False,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Public library, newest first; paginated like GET /history.
+    Pages are served from the materialized feed with an ETag; a matching
+    If-None-Match gets 304 Not Modified.
+    """
+    page = await public_feed.get_page(limit, cursor, include_text)
+    headers = {"ETag": page.etag, "Cache-Control": "public, max-age=0, must-revalidate"}
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+    if public_feed.etag_matches(if_none_match, page.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
+
+@router.get("/public/{story_id}", response_model=PublicStory)
+async def get_public_story(story_id: str):
     db = await get_database()
-    cursor = db.public_stories.find().sort("created_at", -1)
-    stories = await cursor.to_list(length=100)
-    return stories
+    story = await db.public_stories.find_one({"_id": story_id_query(story_id)})
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    return story
+
+@router.get("/public/{story_id}/segments/{index}")
+async def get_public_segment(story_id: str, index: int):
+    db = await get_database()
+    story = await db.public_stories.find_one({"_id": story_id_query(story_id)}, {"audio_path": 1, "segment_index": 1})
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    return await segment_response(story, index)
 
 @router.post("/upload")
 async def upload_audio(
@@ -442,20 +578,15 @@ async def upload_audio(
     name: str = Form(...),
     current_user: UserInDB = Depends(get_current_user)
 ):
-    if not file.filename.endswith(('.mp3', '.wav', '.ogg')):
+    if not file.filename.lower().endswith(uploads.ALLOWED_EXTENSIONS):
         raise HTTPException(status_code=400, detail="Invalid file format. Only audio files allowed.")
 
-    # Generate unique filename
-    file_id = str(uuid.uuid4())
-    extension = os.path.splitext(file.filename)[1]
-    filename = f"upload_{file_id}{extension}"
-    file_path = os.path.join(OUTPUT_DIR, filename)
-
-    # Save file
+    # Save file (stored once per distinct content)
     try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        filename, size = await uploads.store_upload(file)
+        file_path = path_for_key(filename)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
@@ -472,12 +603,14 @@ async def upload_audio(
             pitch=0,
             style_instruction=""
         ),
-        audio_path=file_path
+        audio_path=file_path,
+        audio_bytes=size
     )
     
     new_story_dict = history_item.model_dump(by_alias=True, exclude={"id"})
     new_story = await db.tts_history.insert_one(new_story_dict)
     created_story = await db.tts_history.find_one({"_id": new_story.inserted_id})
+    outputs_gc.schedule_quota_check(str(current_user.id))
     
     # Return the same format as generate_audio for consistency
     return {
@@ -0,0 +1,145 @@
+import os
+import uuid
+import asyncio
+import hashlib
+from typing import Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from api.storage import storage
+from logs import get_logger
+
+log = get_logger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+# Whole request body: the file plus room for the form fields and multipart boundaries
+MAX_UPLOAD_BODY_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+ALLOWED_EXTENSIONS = ('.mp3', '.wav', '.ogg')
+
+# Bytes needed to recognise every format we accept
+SNIFF_BYTES = 12
+
+
+def sniff_audio_format(header: bytes) -> Optional[str]:
+    """Returns the extension matching the container in the first bytes of a file, or None."""
+    if header.startswith(b"ID3"):
+        return ".mp3"
+    # Bare MPEG audio frame: 11 sync bits, and a layer (bits 1-2 of byte 1) that isn't "reserved"
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and header[1] & 0x06:
+        return ".mp3"
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return ".wav"
+    if header.startswith(b"OggS"):
+        return ".ogg"
+    return None
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+    )
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware capping the request body of the upload route.
+
+    FastAPI parses (and spools) the whole multipart body before the handler
+    runs, so the limit has to be enforced here: a Content-Length over the
+    limit is answered with 413 before anything is read, and a body without
+    one is cut off with 413 as soon as it grows past the limit.
+    """
+
+    def __init__(self, app, path: str, limit: int = MAX_UPLOAD_BODY_BYTES):
+        self.app = app
+        self.path = path
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.limit:
+            error = _too_large()
+            await JSONResponse({"detail": error.detail}, status_code=error.status_code)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # Raised inside form parsing; FastAPI turns it into the 413 response
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def store_upload(file: UploadFile) -> Tuple[str, int]:
+    """
+    Copies an uploaded audio file into audio storage.
+
+    By the time this runs the request body has been received in full
+    (UploadSizeLimit keeps it within MAX_UPLOAD_BODY_BYTES). The file is copied
+    in chunks to a temporary file (off the event loop), hashed on the way and
+    rejected with 413 if the file itself exceeds MAX_UPLOAD_BYTES.
+    Its real format is sniffed from the first bytes; files are stored under
+    their content hash, so uploading the same audio twice keeps one copy.
+
+    Returns (storage key, size).
+    """
+    tmp_path = os.path.join(storage.spool_dir, f".upload-{uuid.uuid4().hex}.partial")
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
+
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise _too_large()
+            if len(header) < SNIFF_BYTES:
+                header += chunk[:SNIFF_BYTES - len(header)]
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(_remove_quietly, tmp_path)
+        raise
+    await asyncio.to_thread(f.close)
+
+    extension = sniff_audio_format(header)
+    if extension is None:
+        await asyncio.to_thread(_remove_quietly, tmp_path)
+        raise HTTPException(status_code=400, detail="Invalid file format. Only MP3, WAV and OGG audio allowed.")
+
+    key = f"upload_{digest.hexdigest()[:32]}{extension}"
+    try:
+        if await storage.exists(key):
+            log.info("Upload matches stored audio, reusing it", key=key)
+            await asyncio.to_thread(_remove_quietly, tmp_path)
+        else:
+            await storage.put_file(tmp_path, key)
+    except BaseException:
+        await asyncio.to_thread(_remove_quietly, tmp_path)
+        raise
+    return key, size
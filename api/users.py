@@ -1,14 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from database import get_database
 from models import UserCreate, UserResponse, UserInDB, Token
-from auth import get_password_hash, verify_password, create_access_token
+from auth import (
+    get_password_hash_async, verify_password_async, create_access_token, invalidate_user,
+    check_login_throttle, reset_login_throttle
+)
 from datetime import timedelta, datetime
 import os
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 import requests
 from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+from metrics import auth_logins
+from logs import get_logger
+
+log = get_logger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
@@ -18,31 +26,34 @@ class GoogleAuthRequest(BaseModel):
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "640078566704-rgvkkfilteg23ihnecfu1f95i24i4cck.apps.googleusercontent.com")
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate):
+async def register(user: UserCreate, request: Request):
+    # Hashing is expensive: registration counts against the caller's IP like logins do
+    check_login_throttle(request)
     try:
         db = await get_database()
         
-        # Check if user exists
-        existing_user = await db.users.find_one({"email": user.email})
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-        
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
         user_in_db = UserInDB(
             **user.dict(exclude={"password"}),
             hashed_password=hashed_password
         )
         
-        result = await db.users.insert_one(user_in_db.dict(by_alias=True))
+        # The unique index on email rejects a second account, even when two registrations race
+        try:
+            result = await db.users.insert_one(user_in_db.dict(by_alias=True))
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
+            )
+        # Drop lookups cached for an earlier account with this email
+        invalidate_user(user.email)
         return UserResponse(id=str(result.inserted_id), **user.dict())
     except Exception as e:
-        print(f"Registration Error: {str(e)}")
         # If it's already an HTTPException, re-raise it
         if isinstance(e, HTTPException):
             raise e
+        log.exception("Registration failed")
         # Otherwise, raise a 500 with the actual error message for debugging
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -50,17 +61,21 @@ async def register(user: UserCreate):
         )
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    check_login_throttle(request, form_data.username)
     db = await get_database()
     user = await db.users.find_one({"email": form_data.username})
     
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    if not user or not await verify_password_async(form_data.password, user["hashed_password"]):
+        auth_logins.inc(outcome="invalid_credentials")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    reset_login_throttle(form_data.username)
+    auth_logins.inc(outcome="success")
     access_token = create_access_token(data={"sub": user["email"]})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -111,14 +126,19 @@ async def google_auth(request: GoogleAuthRequest):
                 hashed_password="", # No password for Google users
                 created_at=datetime.utcnow()
             )
-            result = await db.users.insert_one(user_in_db.dict(by_alias=True))
-            user = await db.users.find_one({"_id": result.inserted_id})
+            try:
+                await db.users.insert_one(user_in_db.dict(by_alias=True))
+            except DuplicateKeyError:
+                # A concurrent sign-in created the account first
+                pass
+            invalidate_user(email)
+            user = await db.users.find_one({"email": email})
 
         access_token = create_access_token(data={"sub": email})
         return {"access_token": access_token, "token_type": "bearer"}
         
     except Exception as e:
-        print(f"Google Auth Error: {str(e)}")
+        log.warning("Google authentication failed", error=str(e))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Google authentication failed: {str(e)}"
@@ -0,0 +1,84 @@
+# Comprehensive Mapping of personas to edge-tts voices
+VOICE_MAPPING = {
+    # Original Narrators
+    "The Narrator": "en-US-GuyNeural",
+    "Dr. Kathe": "en-US-EmmaNeural",
+    "Deep Mystery": "en-GB-RyanNeural",
+    "Soft Whisper": "en-US-JennyNeural",
+    
+    # Hindi Voices
+    "Swara (Female)": "hi-IN-SwaraNeural",
+    "Neerja (Female)": "hi-IN-NeerjaNeural",
+    "Madhur (Male)": "hi-IN-MadhurNeural",
+    "Arjun (Male - Expressive)": "hi-IN-ArjunNeural",
+    "Aarti (Female - Expressive)": "hi-IN-AartiNeural",
+    
+    # English (India)
+    "Neerja (IN - Female)": "en-IN-NeerjaNeural",
+    "Prabhat (IN - Male)": "en-IN-PrabhatNeural",
+    "Aashi (IN - Female)": "en-IN-AashiNeural",
+    "Arjun (IN - Male Expressive)": "en-IN-ArjunNeural",
+    "Aarti (IN - Female Expressive)": "en-IN-AartiNeural",
+    
+    # Regional Indian Languages
+    "Bashkar (Bengali - Male)": "bn-IN-BashkarNeural",
+    "Tanishaa (Bengali - Female)": "bn-IN-TanishaaNeural",
+    "Sapna (Kannada - Female)": "kn-IN-SapnaNeural",
+    "Gagan (Kannada - Male)": "kn-IN-GaganNeural",
+    "Sobhana (Malayalam - Female)": "ml-IN-SobhanaNeural",
+    "Midhun (Malayalam - Male)": "ml-IN-MidhunNeural",
+    "Aarohi (Marathi - Female)": "mr-IN-AarohiNeural",
+    "Manohar (Marathi - Male)": "mr-IN-ManoharNeural",
+    "Yashica (Assamese - Female)": "as-IN-YashicaNeural",
+    "Pallavi (Tamil - Female)": "ta-IN-PallaviNeural",
+    "Valluvar (Tamil - Male)": "ta-IN-ValluvarNeural",
+    "Shruti (Telugu - Female)": "te-IN-ShrutiNeural",
+    "Mohan (Telugu - Male)": "te-IN-MohanNeural",
+    "Dhwani (Gujarati - Female)": "gu-IN-DhwaniNeural",
+    "Niranjan (Gujarati - Male)": "gu-IN-NiranjanNeural",
+    "Punjabi (Female)": "pa-IN-OjasNeural",
+    "Punjabi (Male)": "pa-IN-GaganNeural",
+    "Odia (Female)": "or-IN-SubhasiniNeural"
+}
+
+# edge-tts locale of each language, by name or code (as the premium voice catalog names them)
+LANGUAGE_LOCALES = {
+    "english": "en-IN", "en": "en-IN",
+    "hindi": "hi-IN", "hi": "hi-IN",
+    "bengali": "bn-IN", "bn": "bn-IN",
+    "kannada": "kn-IN", "kn": "kn-IN",
+    "malayalam": "ml-IN", "ml": "ml-IN",
+    "marathi": "mr-IN", "mr": "mr-IN",
+    "assamese": "as-IN", "as": "as-IN",
+    "tamil": "ta-IN", "ta": "ta-IN",
+    "telugu": "te-IN", "te": "te-IN",
+    "gujarati": "gu-IN", "gu": "gu-IN",
+    "punjabi": "pa-IN", "pa": "pa-IN",
+    "odia": "or-IN", "or": "or-IN",
+}
+
+
+def _gender(label: str) -> str:
+    lowered = label.lower()
+    if "female" in lowered:
+        return "female"
+    return "male" if "male" in lowered else ""
+
+
+def equivalent_edge_voice(language: str, persona: str = ""):
+    """
+    A standard (edge-tts) voice for the same language as a premium voice,
+    matching its gender when the persona names one (e.g. "Kannada Female 1").
+    Returns None when edge-tts has no voice for the language.
+    """
+    locale = LANGUAGE_LOCALES.get((language or "").strip().lower())
+    if not locale:
+        return None
+    candidates = [(label, voice) for label, voice in VOICE_MAPPING.items() if voice.startswith(locale)]
+    if not candidates:
+        return None
+    gender = _gender(persona)
+    for label, voice in candidates:
+        if gender and _gender(label) == gender:
+            return voice
+    return candidates[0][1]
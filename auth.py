@@ -1,11 +1,17 @@
 import os
+import time
+import math
+import asyncio
 import bcrypt
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from database import get_database
+from metrics import auth_token_checks, auth_password_hash_seconds, auth_throttled
 from models import TokenData, UserInDB
 from dotenv import load_dotenv
 
@@ -15,8 +21,27 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-dr-kathe-tts")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
+# Authenticated user lookups are cached per token for a short while, so polling
+# endpoints don't cost a Mongo round-trip per request
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+
+# bcrypt runs in its own small thread pool, never on the event loop. Calls beyond
+# the pending limit wait their turn on the loop instead of piling up in the pool.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+
+# Login/registration attempts allowed per sliding window
+LOGIN_THROTTLE_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_WINDOW_SECONDS", "300"))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "30"))
+LOGIN_MAX_ATTEMPTS_PER_ACCOUNT = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_ACCOUNT", "10"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots: Optional[asyncio.Semaphore] = None
+
 def verify_password(plain_password, hashed_password):
     try:
         # Bcrypt has a 72-byte limit. We truncate to avoid errors with very long passwords.
@@ -34,6 +59,105 @@ def get_password_hash(password):
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
+async def _run_hash(func, *args):
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+    async with _hash_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    """verify_password on the bcrypt pool, for use from request handlers."""
+    with auth_password_hash_seconds.time(operation="verify"):
+        return await _run_hash(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """get_password_hash on the bcrypt pool, for use from request handlers."""
+    with auth_password_hash_seconds.time(operation="hash"):
+        return await _run_hash(get_password_hash, password)
+
+class AttemptThrottle:
+    """
+    Sliding-window attempt counter per key (client IP, account email).
+
+    Each key keeps the timestamps of its attempts within the last `window`
+    seconds; `retry_after` says how long a key has to wait once it reached its
+    limit. Only the most recently used `max_keys` keys are tracked.
+    """
+
+    def __init__(self, window: float = LOGIN_THROTTLE_WINDOW_SECONDS, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts: "OrderedDict[str, deque]" = OrderedDict()
+        self.rejected = 0
+
+    def _recent(self, key: str, now: float) -> Optional[deque]:
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    def retry_after(self, key: str, limit: int) -> float:
+        """Seconds until `key` may try again, 0 if it is under `limit`."""
+        now = time.monotonic()
+        attempts = self._recent(key, now)
+        if attempts is None or len(attempts) < limit:
+            return 0.0
+        # Free once enough of the oldest attempts leave the window
+        return attempts[len(attempts) - limit] + self.window - now
+
+    def record(self, key: str):
+        now = time.monotonic()
+        attempts = self._recent(key, now)
+        if attempts is None:
+            attempts = self._attempts[key] = deque()
+        attempts.append(now)
+        self._attempts.move_to_end(key)
+        while len(self._attempts) > self.max_keys:
+            self._attempts.popitem(last=False)
+
+    def reset(self, key: str):
+        self._attempts.pop(key, None)
+
+login_throttle = AttemptThrottle()
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy this is the real caller only when uvicorn runs with
+    # --proxy-headers and trusts the proxy (--forwarded-allow-ips, see render.yaml)
+    return request.client.host if request.client else "unknown"
+
+def check_login_throttle(request: Request, account: Optional[str] = None):
+    """
+    Counts an attempt from the caller's IP (and on `account`), or raises 429 with
+    Retry-After when either is over its limit. Rejected attempts are not counted,
+    so a throttled caller is free again once the window passes.
+    """
+    keys = [(f"ip:{client_ip(request)}", LOGIN_MAX_ATTEMPTS_PER_IP)]
+    if account:
+        keys.append((f"account:{account.lower()}", LOGIN_MAX_ATTEMPTS_PER_ACCOUNT))
+
+    wait = max(login_throttle.retry_after(key, limit) for key, limit in keys)
+    if wait > 0:
+        login_throttle.rejected += 1
+        auth_throttled.inc()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+    for key, _ in keys:
+        login_throttle.record(key)
+
+def reset_login_throttle(account: str):
+    """A successful login clears the account's failed attempts (not the IP's)."""
+    login_throttle.reset(f"account:{account.lower()}")
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -44,12 +168,114 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class UserLookupCache:
+    """
+    Bounded TTL cache of bearer token -> UserInDB.
+
+    An entry lives for `ttl` seconds (never past the token's own expiry) and the
+    least recently used entries are dropped beyond `max_size`. Entries are also
+    indexed by email so a user's cached lookups can be dropped when their
+    account changes.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL_SECONDS, max_size: int = AUTH_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[UserInDB, float]]" = OrderedDict()
+        self._tokens_by_email: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        email = entry[0].email
+        tokens = self._tokens_by_email.get(email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[email]
+
+    def get(self, token: str) -> Optional[UserInDB]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(token)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: UserInDB, token_expires_at: Optional[float] = None):
+        """Caches a lookup. `token_expires_at` is the JWT's exp claim (epoch seconds)."""
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        lifetime = self.ttl
+        if token_expires_at is not None:
+            lifetime = min(lifetime, token_expires_at - time.time())
+            if lifetime <= 0:
+                return
+        self._remove(token)
+        self._entries[token] = (user, time.monotonic() + lifetime)
+        self._tokens_by_email.setdefault(user.email, set()).add(token)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, email: str):
+        """Drops every cached lookup of this user."""
+        for token in list(self._tokens_by_email.get(email, ())):
+            self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_email.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+user_cache = UserLookupCache()
+
+
+def invalidate_user(email: str):
+    """Call whenever a user document is created, changed or removed."""
+    user_cache.invalidate(email)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = user_cache.get(token)
+    if cached is not None:
+        auth_token_checks.inc(result="cached")
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -57,10 +283,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
+        auth_token_checks.inc(result="invalid")
         raise credentials_exception
     
     db = await get_database()
     user_dict = await db.users.find_one({"email": token_data.email})
     if user_dict is None:
+        auth_token_checks.inc(result="unknown_user")
         raise credentials_exception
-    return UserInDB(**user_dict)
+    auth_token_checks.inc(result="loaded")
+    user = UserInDB(**user_dict)
+    user_cache.put(token, user, payload.get("exp"))
+    return user
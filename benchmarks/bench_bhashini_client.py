@@ -0,0 +1,107 @@
+"""
+Benchmark: do slow premium (Bhashini) calls stall standard requests?
+
+Starts a local fake Bhashini server whose synthesis takes --premium-latency
+seconds, fires --premium premium calls and, at the same time, a stream of
+standard requests against the fake edge-tts. Standard-request latency is
+reported for the old blocking `requests.post` call and the pooled async client.
+A second run shows 429/503 responses being retried transparently.
+
+    python benchmarks/bench_bhashini_client.py --premium 4 --premium-latency 2
+"""
+import os
+import sys
+import io
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BHASHINI_API_KEY", "bench")
+
+import requests
+from api import bhashini, synthesis
+from api.audio_cache import SegmentAudioCache
+from benchmarks.fakes import FAKE_VOICES, FakeBhashiniServer, FakeEdgeTTS
+
+
+async def blocking_premium_call(text):
+    # What generate_bhashini_audio used to do: a synchronous POST on the event loop
+    response = requests.post(
+        f"{bhashini.BHASHINI_ENDPOINT}/synthesize",
+        json={"text": text, "language": "Hindi", "voiceName": "hi-f1", "voiceStyle": "Neutral", "speechRate": 1.0},
+        timeout=30
+    )
+    return response.content
+
+
+async def async_premium_call(text):
+    return await bhashini.generate_bhashini_audio(text, "Hindi", "Hindi Female 1")
+
+
+async def standard_request(fake, n):
+    segments = [{"text": f"standard request {n}", "voice": "en-US-GuyNeural", "speed": "+0%", "pitch": "+0Hz"}]
+    job = synthesis.OrderedSynthesis(segments, synthesize=fake)
+    started = time.perf_counter()
+    await job.write_to(io.BytesIO())
+    return time.perf_counter() - started
+
+
+async def scenario(premium_call, premium_count, standard_count, fake):
+    async def standard_traffic():
+        latencies = []
+        for n in range(standard_count):
+            latencies.append(await standard_request(fake, n))
+        return latencies
+
+    started = time.perf_counter()
+    premium = [asyncio.create_task(premium_call(f"premium story {time.time()} {i}")) for i in range(premium_count)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = await standard_traffic()
+        await asyncio.gather(*premium)
+    return latencies, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--premium", type=int, default=4)
+    parser.add_argument("--premium-latency", type=float, default=2.0)
+    parser.add_argument("--standard", type=int, default=10)
+    parser.add_argument("--standard-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bhashini.segment_cache = SegmentAudioCache(cache_dir)
+        # Keep the benchmark offline: no voices.json download
+        bhashini._voice_config_cache = bhashini.parse_voice_configuration(FAKE_VOICES)
+        bhashini._voice_config_loaded_at = time.monotonic()
+
+        # Own thread: the blocking client would otherwise freeze the server too
+        server = FakeBhashiniServer(latency=args.premium_latency).start_in_thread()
+        try:
+            bhashini.BHASHINI_ENDPOINT = server.url
+            fake = FakeEdgeTTS(latency=args.standard_latency)
+
+            print(f"{args.premium} premium calls ({args.premium_latency}s each) + {args.standard} sequential standard requests ({args.standard_latency}s each)")
+            print(f"{'client':>10} {'std p50':>9} {'std max':>9} {'wall':>8}")
+            for name, call in (("blocking", blocking_premium_call), ("async", async_premium_call)):
+                latencies, wall = await scenario(call, args.premium, args.standard, fake)
+                print(f"{name:>10} {statistics.median(latencies):>8.2f}s {max(latencies):>8.2f}s {wall:>7.2f}s")
+
+            server.fail_next = [429, 503]
+            server.latency = 0.05
+            with contextlib.redirect_stdout(io.StringIO()):
+                audio = await async_premium_call("retry me")
+            print(f"\nretry check: got {len(audio)} bytes after 429 + 503 responses "
+                  f"({server.requests} requests over {server.connections} connections total)")
+        finally:
+            await bhashini.close_http_client()
+            server.stop_thread()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+Benchmark: history/public listing, full documents vs paginated summaries.
+
+Seeds an in-memory Mongo stand-in (mongomock-motor) with stories of
+realistic length and compares, per listing request:
+
+  - legacy:  find().sort().to_list(100) of full documents, validated and
+             serialized through List[TTSHistory] (what GET /tts/history did)
+  - summary: one keyset page through api.pagination without `text`,
+             serialized through List[TTSHistorySummary]
+
+and then walks the whole library page by page, which the legacy endpoint
+could not do past the first 100 stories. Latency here is the in-process
+query + serialization cost; on a real server the size gap also shows up as
+network time.
+
+    pip install mongomock-motor
+    python benchmarks/bench_history.py --stories 2000 --text-chars 6000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+from mongomock_motor import AsyncMongoMockClient
+
+from models import TTSHistory, TTSHistorySummary
+from api.pagination import fetch_page, FEED_SORT
+
+USER_ID = "bench-user"
+
+full_adapter = TypeAdapter(List[TTSHistory])
+summary_adapter = TypeAdapter(List[TTSHistorySummary])
+
+
+async def seed(collection, stories, text_chars):
+    rng = random.Random(3)
+    start = datetime(2025, 1, 1)
+    words = ["ಒಂದು", "ಊರಿನಲ್ಲಿ", "once", "upon", "a", "time", "ರಾಜ", "king", "forest", "ಕಾಡು"]
+    docs = []
+    for i in range(stories):
+        text = " ".join(rng.choice(words) for _ in range(text_chars // 6))[:text_chars]
+        docs.append({
+            "_id": ObjectId(),
+            "user_id": USER_ID,
+            "title": f"Story {i}",
+            "text": text,
+            "settings": {"language": "Kannada", "persona": "Sapna (Kannada - Female)", "speed": 1.0, "pitch": 0},
+            "audio_path": f"outputs/story_{i}.mp3",
+            "is_public": False,
+            # Some stories share a timestamp, so the _id tie-break is exercised
+            "created_at": start + timedelta(seconds=i // 2)
+        })
+    await collection.insert_many(docs)
+
+
+async def legacy_listing(collection):
+    # .limit() because mongomock-motor ignores to_list's length (motor honours it)
+    docs = await collection.find({"user_id": USER_ID}).sort("created_at", -1).limit(100).to_list(length=100)
+    return full_adapter.dump_json(full_adapter.validate_python(docs), by_alias=True)
+
+
+async def summary_listing(collection, cursor=None, limit=50):
+    docs, next_cursor = await fetch_page(collection, {"user_id": USER_ID}, cursor, limit, {"text": 0})
+    return summary_adapter.dump_json(summary_adapter.validate_python(docs), by_alias=True), next_cursor
+
+
+async def timed(coro_factory, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await coro_factory()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=2000)
+    parser.add_argument("--text-chars", type=int, default=6000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    collection = AsyncMongoMockClient()["bench"]["tts_history"]
+    await seed(collection, args.stories, args.text_chars)
+
+    legacy_time, legacy_body = await timed(lambda: legacy_listing(collection), args.repeat)
+    summary_time, (summary_body, _) = await timed(lambda: summary_listing(collection, limit=args.limit), args.repeat)
+
+    print(f"{args.stories} stories of ~{args.text_chars} characters")
+    print(f"{'listing':<34} {'ms':>8} {'bytes':>10}")
+    print(f"{'legacy (100 full documents)':<34} {legacy_time * 1000:>8.1f} {len(legacy_body):>10,}")
+    print(f"{f'summary page (limit {args.limit})':<34} {summary_time * 1000:>8.1f} {len(summary_body):>10,}")
+
+    # Walk the whole library and check the pages cover every story exactly once
+    started = time.perf_counter()
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        docs, cursor = await fetch_page(collection, {"user_id": USER_ID}, cursor, args.limit, {"text": 0})
+        seen.extend(doc["_id"] for doc in docs)
+        pages += 1
+        if not cursor:
+            break
+    walk_time = time.perf_counter() - started
+    expected = [doc["_id"] for doc in await collection.find({}, {"_id": 1}).sort(FEED_SORT).to_list(length=None)]
+    status = "complete, in order" if seen == expected else "MISMATCH"
+    print(f"full walk: {pages} pages, {len(seen)} stories in {walk_time * 1000:.0f} ms ({status})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Benchmark: event-loop latency under concurrent login load.
+
+Fires a burst of password checks the way /auth/login does them, first with
+bcrypt called directly on the event loop (the old path), then through the
+bounded bcrypt pool (verify_password_async). A ticker task sleeping 10 ms
+measures how late the loop wakes it up, which is the stall every streaming
+response on the worker sees at the same time.
+
+    python benchmarks/bench_login.py --logins 40
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth
+
+TICK = 0.01
+
+
+async def measure_lag(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append(time.perf_counter() - started - TICK)
+
+
+async def login_on_loop(password, hashed):
+    # What the handler used to do: bcrypt on the event loop thread
+    return auth.verify_password(password, hashed)
+
+
+async def login_in_pool(password, hashed):
+    return await auth.verify_password_async(password, hashed)
+
+
+async def run(check, logins, password, hashed):
+    stop = asyncio.Event()
+    samples = []
+    ticker = asyncio.create_task(measure_lag(stop, samples))
+    await asyncio.sleep(TICK * 3)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(check(password, hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    assert all(results)
+    return elapsed, samples
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40)
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = auth.get_password_hash(password)
+
+    print(f"{args.logins} concurrent logins, bcrypt pool of {auth.PASSWORD_HASH_WORKERS} threads")
+    print(f"{'path':<18} {'total s':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for name, check in [("bcrypt on loop", login_on_loop), ("bcrypt pool", login_in_pool)]:
+        elapsed, samples = await run(check, args.logins, password, hashed)
+        print(
+            f"{name:<18} {elapsed:>8.2f} {statistics.median(samples) * 1000:>11.1f} "
+            f"{percentile(samples, 0.99) * 1000:>11.1f} {max(samples) * 1000:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
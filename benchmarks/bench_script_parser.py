@@ -0,0 +1,99 @@
+"""
+Benchmark: script detection for narration scripts.
+
+Compares the per-line regex detection the heuristic parser used to do (one
+re.search per script until one matches) with classify_script in
+api.script_parser, which reads a single-script line once, on a generated
+multi-thousand-line script mixing English, Kannada, Hindi, Tamil and code-switched lines.
+
+    python benchmarks/bench_script_parser.py --lines 5000 --repeat 5
+"""
+import os
+import re
+import sys
+import io
+import time
+import random
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.script_parser import classify_script, parse_narration
+
+SAMPLES = [
+    "The old man walked slowly to the river and sat down on the warm stones.",
+    "ಒಂದು ಊರಿನಲ್ಲಿ ಒಬ್ಬ ಬಡ ರೈತ ತನ್ನ ಹೆಂಡತಿ ಮತ್ತು ಮಕ್ಕಳೊಂದಿಗೆ ವಾಸಿಸುತ್ತಿದ್ದ.",
+    "एक गाँव में एक गरीब किसान अपने परिवार के साथ रहता था।",
+    "ஒரு ஊரில் ஒரு ஏழை விவசாயி தன் குடும்பத்துடன் வாழ்ந்து வந்தான்.",
+    "Good morning my dear students, ನಮಸ್ಕಾರ ಮಕ್ಕಳೇ ಇವತ್ತು ಹೊಸ ಕಥೆ ಕೇಳೋಣ.",
+    "ಅವನು WhatsApp ನಲ್ಲಿ ಮೆಸೇಜ್ ಕಳುಹಿಸಿದ.",
+]
+SPEAKERS = ["Narrator", "Anna", "Ben", "Owner"]
+
+
+def legacy_best_voice(text, primary_voice):
+    # The detection the heuristic parser did inline before the classifier
+    if re.search(r'[ಀ-೿]', text):
+        return "kn-IN-SapnaNeural"
+    if re.search(r'[ऀ-ॿ]', text):
+        return "hi-IN-SwaraNeural"
+    if re.search(r'[ঀ-৿]', text):
+        return "bn-IN-TanishaaNeural"
+    if re.search(r'[ഀ-ൿ]', text):
+        return "ml-IN-SobhanaNeural"
+    return primary_voice
+
+
+def build_script(count, seed=7):
+    rng = random.Random(seed)
+    lines = ["Title: Benchmark story"]
+    for i in range(count):
+        text = rng.choice(SAMPLES)
+        lines.append(f"{rng.choice(SPEAKERS)}: {text}" if i % 3 else text)
+    return lines
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = build_script(args.lines)
+    text = "\n".join(lines)
+
+    legacy = timed(lambda: [legacy_best_voice(line, "en-US-GuyNeural") for line in lines], args.repeat)
+    classified = timed(lambda: [classify_script(line) for line in lines], args.repeat)
+
+    def parse():
+        # Keep the metadata debug line out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            return parse_narration(text, "en-US-GuyNeural", "+0%", "+0Hz")
+
+    full_parse = timed(parse, args.repeat)
+    segments = parse()
+
+    print(f"{len(lines)} lines, {len(text)} characters, best of {args.repeat}")
+    print(f"{'stage':<32} {'ms':>8} {'lines/s':>12}")
+    for name, elapsed in [
+        ("regex detection (legacy)", legacy),
+        ("classify_script", classified),
+        ("parse_narration (incl. splits)", full_parse),
+    ]:
+        print(f"{name:<32} {elapsed * 1000:>8.1f} {len(lines) / elapsed:>12,.0f}")
+    print(f"segments produced: {len(segments)} (code-switched lines are split per script)")
+
+
+if __name__ == "__main__":
+    main()
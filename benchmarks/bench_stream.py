@@ -0,0 +1,54 @@
+"""
+Benchmark: time-to-first-audio of /tts/stream vs /tts/generate.
+
+/tts/generate answers only after the whole story is on disk, so a listener's
+first audio arrives after the full synthesis. /tts/stream forwards the head
+segment's chunks as they arrive. This measures both against a local fake
+edge-tts for stories of increasing length.
+
+    python benchmarks/bench_stream.py --latency 0.3
+"""
+import os
+import sys
+import io
+import time
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import synthesis
+from benchmarks.fakes import FakeEdgeTTS
+from benchmarks.bench_synthesis import build_script
+
+
+async def measure(segments, fake, concurrency):
+    job = synthesis.OrderedSynthesis(segments, synthesize=fake, concurrency=concurrency)
+    started = time.perf_counter()
+    first_audio = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        async for _ in job.chunks():
+            if first_audio is None:
+                first_audio = time.perf_counter() - started
+    return first_audio, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=synthesis.SEGMENT_CONCURRENCY)
+    parser.add_argument("--lengths", default="1,10,60,200")
+    args = parser.parse_args()
+
+    print(f"{'segments':>8} {'generate first audio':>21} {'stream first audio':>19} {'total':>7}")
+    for length in [int(x) for x in args.lengths.split(",")]:
+        fake = FakeEdgeTTS(latency=args.latency, jitter=args.jitter)
+        first_audio, total = await measure(build_script(length), fake, args.concurrency)
+        # /generate can't return before the last byte is written
+        print(f"{length:>8} {total * 1000:>18.0f} ms {first_audio * 1000:>16.0f} ms {total:>6.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
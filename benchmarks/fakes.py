@@ -0,0 +1,182 @@
+"""
+Local stand-ins for the external services the API talks to, used by the
+benchmark scripts in this folder so they never hit Microsoft or Bhashini.
+"""
+import json
+import asyncio
+import random
+import threading
+
+# MPEG-2 Layer III, 48 kbps, 24 kHz, mono - the format edge-tts returns.
+# Each frame is 144 bytes and holds 576 samples (24 ms of audio).
+MP3_FRAME_HEADER = bytes([0xFF, 0xF3, 0x64, 0xC0])
+MP3_FRAME_SIZE = 144
+MP3_FRAME_SECONDS = 576 / 24000
+
+# Served at GET /voices.json, in the shape of Bhashini's catalog
+FAKE_VOICES = {
+    "voices": [
+        {"id": "kn-f1", "name": "Kannada Female 1", "nativeLanguage": "Kannada", "supportedStyles": ["Neutral", "Book"]},
+        {"id": "kn-m1", "name": "Kannada Male 1", "nativeLanguage": "Kannada", "supportedStyles": ["Neutral"]},
+        {"id": "hi-f1", "name": "Hindi Female 1", "nativeLanguage": "Hindi", "supportedStyles": ["Neutral", "Conversational"]},
+    ]
+}
+
+
+def fake_mp3_frames(seconds: float, seed: int = 0) -> bytes:
+    """Returns roughly `seconds` of syntactically valid (silent-ish) MP3 frames."""
+    frame_count = max(1, int(seconds / MP3_FRAME_SECONDS))
+    payload = bytes([seed % 256]) * (MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return (MP3_FRAME_HEADER + payload) * frame_count
+
+
+class FakeEdgeTTS:
+    """
+    Pluggable replacement for `providers.edge_tts_stream`.
+
+    Every segment waits `latency` seconds (+/- `jitter`) before its first chunk,
+    then yields its audio in `chunks` pieces. A `failure_rate` share of
+    segments raises, like a dropped edge-tts websocket. Latency and failures
+    are derived from the segment text, so runs are reproducible whatever
+    order the segments are requested in.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.0, failure_rate=0.0, chunks=4, seconds_per_char=0.06, seed=42):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.chunks = chunks
+        self.seconds_per_char = seconds_per_char
+        self.seed = seed
+        self.calls = 0
+
+    async def __call__(self, segment):
+        self.calls += 1
+        rng = random.Random(f"{self.seed}:{segment['text']}")
+        delay = self.latency + rng.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(0.0, delay))
+        if rng.random() < self.failure_rate:
+            raise ConnectionError("fake edge-tts connection dropped")
+
+        audio = fake_mp3_frames(len(segment["text"]) * self.seconds_per_char, seed=len(segment["text"]))
+        step = max(MP3_FRAME_SIZE, len(audio) // self.chunks)
+        for start in range(0, len(audio), step):
+            yield audio[start:start + step]
+            await asyncio.sleep(0)
+
+
+class FakeBhashiniServer:
+    """
+    Minimal HTTP/1.1 stand-in for the Bhashini /synthesize endpoint, built on
+    asyncio streams so it needs no extra dependencies. Supports keep-alive.
+
+    `latency` (+/- `jitter`) is how long each synthesis takes; statuses queued
+    in `fail_next` (e.g. [429, 503]) are returned for the next requests before
+    normal responses resume, and a `failure_rate` share of the others get a
+    503. GET /voices.json serves FAKE_VOICES.
+    """
+
+    def __init__(self, latency=1.0, audio_seconds=2.0, host="127.0.0.1", port=0, jitter=0.0, failure_rate=0.0, seed=42):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self.audio_seconds = audio_seconds
+        self.host = host
+        self.port = port
+        self.fail_next = []
+        self.requests = 0
+        self.connections = 0
+        self._server = None
+        self._handlers = set()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for handler in list(self._handlers):
+                handler.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def start_in_thread(self):
+        """
+        Runs the server on its own event loop in a daemon thread. Needed when the
+        code under test blocks the caller's loop (it would otherwise deadlock).
+        """
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = {}
+                for line in head.decode("latin-1").split("\r\n")[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                if head.startswith(b"GET ") and b"/voices.json" in head.split(b"\r\n", 1)[0]:
+                    status, payload, content_type = 200, json.dumps(FAKE_VOICES).encode("utf-8"), "application/json"
+                else:
+                    self.requests += 1
+                    status, payload = await self._respond(body)
+                    content_type = "audio/mpeg" if status == 200 else "application/json"
+                reason = {200: "OK", 429: "Too Many Requests"}.get(status, "Error")
+                writer.write(
+                    f"HTTP/1.1 {status} {reason}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "Connection: keep-alive\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        except asyncio.CancelledError:
+            # stop() cancels idle keep-alive connections. Finish normally: asyncio's
+            # stream callback calls exception() on the task and logs one that ended cancelled
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _respond(self, body):
+        if self.fail_next:
+            status = self.fail_next.pop(0)
+            return status, b'{"detail": "fake failure"}'
+        await asyncio.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+        if self.failure_rate and self._rng.random() < self.failure_rate:
+            return 503, b'{"detail": "fake overload"}'
+        text = json.loads(body or b"{}").get("text", "")
+        return 200, fake_mp3_frames(self.audio_seconds, seed=len(text))
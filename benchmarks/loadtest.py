@@ -0,0 +1,361 @@
+"""
+Load test: the whole API under a realistic traffic mix, offline.
+
+Boots main:app with uvicorn on a local port, backed by local stand-ins for
+everything external:
+
+  - MongoDB:   an in-memory mongomock-motor client
+  - edge-tts:  benchmarks.fakes.FakeEdgeTTS (deterministic MP3 frames with
+               --edge-latency, --edge-jitter and --edge-failure-rate)
+  - Bhashini:  benchmarks.fakes.FakeBhashiniServer over real HTTP (same knobs
+               with --bhashini-*; its failures are 503s the client retries)
+
+--users clients then loop for --duration seconds, each picking a request from
+--mix (weights per scenario):
+
+  narration  POST /tts/generate, single narration parsed by the script parser
+  multi      POST /tts/generate with explicit multi-speaker segments
+  premium    POST /tts/generate with a Bhashini voice
+  stream     POST /tts/stream, body read to the end
+  history    GET /tts/history (one page)
+  public     GET /tts/public (one page)
+
+and the report lists requests, errors, throughput and p50/p95/p99/max
+latency per route, plus the server's event-loop lag. Save a run with --json
+and pass it as --baseline to a later run to see the p95 change per route.
+
+    pip install mongomock-motor
+    python benchmarks/loadtest.py --users 20 --duration 30
+    python benchmarks/loadtest.py --mix narration=1,history=3 --json before.json
+    python benchmarks/loadtest.py --mix narration=1,history=3 --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set before the app is imported: offline, quiet, and no login throttling or per-user
+# rate limits for the few accounts that do all the work (load shedding stays on)
+os.environ.setdefault("BHASHINI_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("LOG_ERROR_FILE", "")
+os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_IP", "100000")
+os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_ACCOUNT", "100000")
+os.environ.setdefault("SCHEDULER_USER_SEGMENTS_PER_MINUTE", "0")
+
+import httpx
+from benchmarks.fakes import FakeBhashiniServer, FakeEdgeTTS
+
+DEFAULT_MIX = "narration=30,multi=15,premium=10,stream=5,history=25,public=15"
+
+WORDS = (
+    "the old king walked slowly through the silent forest while a small bird "
+    "sang about rivers mountains and a lost golden key hidden under the bridge"
+).split()
+KANNADA_WORDS = "ಒಂದು ಊರಿನಲ್ಲಿ ಒಬ್ಬ ರಾಜ ಇದ್ದನು ಅವನಿಗೆ ಮೂರು ಮಕ್ಕಳು ಕಾಡಿನಲ್ಲಿ ಹಕ್ಕಿ ಹಾಡುತ್ತಿತ್ತು ನದಿ ಬೆಟ್ಟ".split()
+PERSONAS = ["The Narrator", "Dr. Kathe", "Deep Mystery", "Soft Whisper"]
+PREMIUM_VOICES = ["Kannada Female 1", "Kannada Male 1"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def parse_mix(value):
+    weights = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class TextSource:
+    """
+    Story lines. A --repeat share comes from a small fixed pool (so some
+    segments hit the segment cache, as recurring lines do in real traffic);
+    the rest are unique.
+    """
+
+    def __init__(self, repeat, seed):
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.pool = [self._line(WORDS, 8, 16) for _ in range(20)]
+        self.counter = 0
+
+    def _line(self, words, low, high):
+        return " ".join(self.rng.choice(words) for _ in range(self.rng.randint(low, high)))
+
+    def line(self, words=WORDS):
+        if words is WORDS and self.rng.random() < self.repeat:
+            return self.rng.choice(self.pool)
+        self.counter += 1
+        return f"{self._line(words, 8, 16)} {self.counter}."
+
+
+def settings(persona="The Narrator", language="English", premium=False):
+    return {"language": language, "persona": persona, "speed": 1.0, "pitch": 0, "is_premium": premium}
+
+
+# Each scenario returns (route label, method, path, json body or None, is a streamed body)
+def narration(texts, rng):
+    text = "\n".join(texts.line() for _ in range(rng.randint(3, 8)))
+    return "POST /tts/generate narration", "POST", "/tts/generate", {
+        "title": "Narration", "text": text, "settings": settings(rng.choice(PERSONAS))
+    }, False
+
+
+def multi(texts, rng):
+    segments = [
+        {**settings(rng.choice(PERSONAS)), "text": texts.line()}
+        for _ in range(rng.randint(8, 30))
+    ]
+    return "POST /tts/generate multi", "POST", "/tts/generate", {"title": "Multi", "segments": segments}, False
+
+
+def premium(texts, rng):
+    text = " ".join(texts.line(KANNADA_WORDS) for _ in range(rng.randint(1, 4)))
+    return "POST /tts/generate premium", "POST", "/tts/generate", {
+        "title": "Premium", "text": text, "is_premium": True,
+        "settings": settings(rng.choice(PREMIUM_VOICES), "Kannada", True)
+    }, False
+
+
+def stream(texts, rng):
+    text = "\n".join(texts.line() for _ in range(rng.randint(3, 8)))
+    return "POST /tts/stream", "POST", "/tts/stream", {
+        "title": "Stream", "text": text, "settings": settings(rng.choice(PERSONAS))
+    }, True
+
+
+def history(texts, rng):
+    return "GET /tts/history", "GET", "/tts/history?limit=20", None, False
+
+
+def public(texts, rng):
+    return "GET /tts/public", "GET", "/tts/public?limit=20", None, False
+
+
+SCENARIOS = {
+    "narration": narration,
+    "multi": multi,
+    "premium": premium,
+    "stream": stream,
+    "history": history,
+    "public": public,
+}
+
+
+def boot(args):
+    """
+    Starts the fakes and the app (uvicorn, own thread and event loop).
+    Returns (base url, uvicorn server, server thread, fake Bhashini, fake edge-tts).
+    """
+    # outputs/ and the segment cache are created relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix="loadtest-"))
+
+    import uvicorn
+    from mongomock_motor import AsyncMongoMockClient
+    import database
+    from api import providers, bhashini
+
+    mongo = AsyncMongoMockClient()
+    database.client = mongo
+    database.db = mongo[database.DATABASE_NAME]
+
+    fake_edge = FakeEdgeTTS(
+        latency=args.edge_latency, jitter=args.edge_jitter, failure_rate=args.edge_failure_rate, seed=args.seed
+    )
+    providers.edge_tts_stream = fake_edge
+
+    fake_bhashini = FakeBhashiniServer(
+        latency=args.bhashini_latency, jitter=args.bhashini_jitter,
+        failure_rate=args.bhashini_failure_rate, seed=args.seed
+    ).start_in_thread()
+    bhashini.BHASHINI_ENDPOINT = fake_bhashini.url
+    bhashini.BHASHINI_VOICES_URL = f"{fake_bhashini.url}/voices.json"
+
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("server failed to start")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return f"http://127.0.0.1:{port}", server, thread, fake_bhashini, fake_edge
+
+
+async def create_account(client, number):
+    email = f"load{number}@example.com"
+    await client.post("/auth/register", json={"email": email, "full_name": f"Load {number}", "password": "bench-pass"})
+    response = await client.post("/auth/login", data={"username": email, "password": "bench-pass"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def seed_account(client, headers, texts, rng, stories):
+    """Gives the account some history and publishes one story, so listings have something to return."""
+    for number in range(stories):
+        _, method, path, body, _ = narration(texts, rng)
+        response = await client.request(method, path, json=body, headers=headers)
+        if number == 0 and response.status_code == 200:
+            history = (await client.get("/tts/history?limit=1", headers=headers)).json()
+            if history:
+                await client.post(f"/tts/public/{history[0]['_id']}", headers=headers)
+
+
+async def virtual_user(client, headers, weights, texts, rng, deadline, results):
+    names = list(weights)
+    cumulative = list(weights.values())
+    while time.perf_counter() < deadline:
+        label, method, path, body, streamed = SCENARIOS[rng.choices(names, cumulative)[0]](texts, rng)
+        started = time.perf_counter()
+        try:
+            if streamed:
+                async with client.stream(method, path, json=body, headers=headers) as response:
+                    async for _ in response.aiter_bytes():
+                        pass
+            else:
+                response = await client.request(method, path, json=body, headers=headers)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        results[label].append((time.perf_counter() - started, ok))
+
+
+async def watch_loop_lag(stop, samples):
+    import metrics
+    while not stop.is_set():
+        samples.append(metrics.loop_lag())
+        await asyncio.sleep(0.25)
+
+
+def summarize(results, elapsed):
+    rows = {}
+    for label in sorted(results):
+        samples = results[label]
+        latencies = [latency for latency, _ in samples]
+        rows[label] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, ok in samples if not ok),
+            "rps": len(samples) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": max(latencies) * 1000,
+        }
+    return rows
+
+
+def print_report(rows, elapsed, lag_samples, baseline):
+    header = f"{'route':<30} {'reqs':>6} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    for label, row in rows.items():
+        line = (
+            f"{label:<30} {row['requests']:>6} {row['errors']:>6} {row['rps']:>7.1f} "
+            f"{row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f} {row['max_ms']:>8.0f}"
+        )
+        before = baseline.get(label) if baseline else None
+        if before and before["p95_ms"]:
+            line += f" {(row['p95_ms'] / before['p95_ms'] - 1) * 100:>+11.0f}%"
+        print(line)
+    total = sum(row["requests"] for row in rows.values())
+    errors = sum(row["errors"] for row in rows.values())
+    print(f"{'total':<30} {total:>6} {errors:>6} {total / elapsed:>7.1f}")
+    if lag_samples:
+        print(f"server event-loop lag: p99 {percentile(lag_samples, 0.99) * 1000:.1f} ms, max {max(lag_samples) * 1000:.1f} ms")
+
+
+async def drive(base_url, args, weights):
+    texts = TextSource(args.repeat, args.seed)
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.users + 4, max_keepalive_connections=args.users + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        accounts = [await create_account(client, number) for number in range(args.accounts)]
+        await asyncio.gather(*(
+            seed_account(client, headers, texts, random.Random(args.seed + n), args.seed_stories)
+            for n, headers in enumerate(accounts)
+        ))
+
+        results = defaultdict(list)
+        lag_samples = []
+        stop = asyncio.Event()
+        lag_watch = asyncio.create_task(watch_loop_lag(stop, lag_samples))
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            virtual_user(client, accounts[n % len(accounts)], weights, texts, random.Random(args.seed * 1000 + n), deadline, results)
+            for n in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await lag_watch
+    return results, elapsed, lag_samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--accounts", type=int, default=5, help="user accounts the clients share")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights")
+    parser.add_argument("--repeat", type=float, default=0.2, help="share of story lines drawn from a recurring pool")
+    parser.add_argument("--seed-stories", type=int, default=3, help="stories rendered per account before measuring")
+    parser.add_argument("--edge-latency", type=float, default=0.3)
+    parser.add_argument("--edge-jitter", type=float, default=0.1)
+    parser.add_argument("--edge-failure-rate", type=float, default=0.01)
+    parser.add_argument("--bhashini-latency", type=float, default=1.0)
+    parser.add_argument("--bhashini-jitter", type=float, default=0.3)
+    parser.add_argument("--bhashini-failure-rate", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--port", type=int, default=0, help="0 = any free port")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write the per-route results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run (--json) to compare p95 against")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    # boot() changes the working directory
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["routes"]
+
+    base_url, server, thread, fake_bhashini, fake_edge = boot(args)
+    try:
+        results, elapsed, lag_samples = asyncio.run(drive(base_url, args, weights))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        fake_bhashini.stop_thread()
+
+    rows = summarize(results, elapsed)
+    print(f"{args.users} clients, {args.accounts} accounts, {elapsed:.1f}s, mix {args.mix}")
+    print(f"edge-tts {args.edge_latency}s +/- {args.edge_jitter}s ({args.edge_failure_rate:.0%} failing), "
+          f"Bhashini {args.bhashini_latency}s +/- {args.bhashini_jitter}s ({args.bhashini_failure_rate:.0%} 503s)")
+    print_report(rows, elapsed, lag_samples, baseline)
+    print(f"fake edge-tts calls: {fake_edge.calls}, fake Bhashini synthesis requests: {fake_bhashini.requests}")
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "elapsed": elapsed, "routes": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
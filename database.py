@@ -1,6 +1,10 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+from typing import Dict
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
+from metrics import MongoCommandMetrics
 
 load_dotenv()
 
@@ -9,8 +13,68 @@ MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 # We still allow an override via DATABASE_NAME env var.
 DATABASE_NAME = os.getenv("DATABASE_NAME", "dr-kathe")
 
-client = AsyncIOMotorClient(MONGODB_URL)
+client = AsyncIOMotorClient(MONGODB_URL, event_listeners=[MongoCommandMetrics()])
 db = client[DATABASE_NAME]
 
 async def get_database():
     return db
+
+# Indexes every collection needs, by collection. ensure_indexes() creates the
+# missing ones at startup; existing indexes with the same name are left alone.
+INDEXES = {
+    "users": [
+        # register relies on this to reject a second account with the same email
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "tts_history": [
+        # A user's library, newest first (ties broken by _id)
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created"),
+        # Deleting a story checks whether other stories share its (deduplicated) audio file
+        IndexModel([("audio_path", ASCENDING)], name="audio_path"),
+        # The outputs sweeper evicts the least recently played audio first
+        IndexModel([("last_accessed_at", ASCENDING), ("created_at", ASCENDING)], name="last_accessed"),
+    ],
+    "public_stories": [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="feed_created"),
+        IndexModel([("original_history_id", ASCENDING)], name="original_history"),
+    ],
+    "tts_jobs": [
+        # Workers lease the oldest queued (or expired) job
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created"),
+    ],
+    "idempotency_keys": [
+        # Remembered responses are dropped once their window has passed
+        IndexModel([("expires_at", ASCENDING)], name="expires", expireAfterSeconds=0),
+    ],
+}
+
+# Outcome of the last ensure_indexes() run, "collection.index" -> status
+index_status: Dict[str, str] = {}
+
+async def ensure_indexes() -> Dict[str, str]:
+    """
+    Creates the indexes in INDEXES that don't exist yet.
+    A failing index (e.g. duplicate emails already stored) is reported, not raised,
+    so the API still starts.
+    """
+    database = await get_database()
+    for collection_name, models in INDEXES.items():
+        collection = database[collection_name]
+        try:
+            existing = await collection.index_information()
+        except PyMongoError as e:
+            for model in models:
+                index_status[f"{collection_name}.{model.document['name']}"] = f"failed: {e}"
+            continue
+        for model in models:
+            name = model.document["name"]
+            key = f"{collection_name}.{name}"
+            if name in existing:
+                index_status[key] = "ok"
+                continue
+            try:
+                await collection.create_indexes([model])
+                index_status[key] = "created"
+            except PyMongoError as e:
+                index_status[key] = f"failed: {e}"
+    return index_status
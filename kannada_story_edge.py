@@ -1,14 +1,34 @@
 import os
+import re
+import csv
+import sys
+import json
+import time
+import random
 import asyncio
+import argparse
 import edge_tts
 
+from api.audio_cache import segment_cache_key
+from api.mp3 import Mp3Assembler, iter_frames, duration_seconds
+
 # -------------------------------------------------
-# CREATE OUTPUT DIRECTORY
+# BATCH SCENE RENDERER
+#
+#   python kannada_story_edge.py                      # the built-in Kannada story
+#   python kannada_story_edge.py story.json --concat story.mp3
+#   python kannada_story_edge.py scenes.csv -j 8 --voice kn-IN-GaganNeural
+#
+# Scenes are rendered concurrently to <out-dir>/<name>.mp3. A scene whose
+# text/voice/rate/pitch haven't changed since its last render is skipped, so
+# re-running after a failure only renders what is missing.
 # -------------------------------------------------
-os.makedirs("outputs", exist_ok=True)
+
+DEFAULT_OUT_DIR = "scenes"  # Not outputs/: that folder belongs to the API and is swept
+STATE_FILE = ".renders.json"
 
 # -------------------------------------------------
-# STORY SCENES (KANNADA)
+# STORY SCENES (KANNADA) - used when no manifest is given
 # -------------------------------------------------
 scenes = {
     "scene_01": "ಒಂದು ದಿನ ಶಾಲೆಯಲ್ಲಿ ಕಾಲಿ ಪಿರಿಯಡ್ ಬಂದಿತ್ತು. ಮಕ್ಕಳು ಎಲ್ಲರೂ ಕೂಗ್ತಾ ಕೇಳಿದರು — ಮ್ಯಾಮ್… ಒಂದು ಕಥೆ ಹೇಳಿ!",
@@ -29,46 +49,296 @@ scenes = {
 }
 
 # -------------------------------------------------
-# VOICE SETTINGS (STRICT FORMAT)
+# VOICE SETTINGS (STRICT FORMAT) - defaults for scenes that don't set their own
 # -------------------------------------------------
 VOICE = "kn-IN-SapnaNeural"
 RATE = "+0%"      # MUST be like +5%, -5%, +0%
 PITCH = "+0Hz"    # MUST be like +2Hz, -2Hz, +0Hz
 
+_RATE_FORMAT = re.compile(r"^[+-]?\d+%$")
+_PITCH_FORMAT = re.compile(r"^[+-]?\d+Hz$")
+_NAME_FORMAT = re.compile(r"^[\w.-]+$")
+
+RETRY_BASE_DELAY = 1.0
+
+
 # -------------------------------------------------
-# GENERATE SINGLE SCENE
+# MANIFEST
 # -------------------------------------------------
-async def generate_scene(scene_name, text):
-    output_path = f"outputs/{scene_name}.wav"
-    print(f"🎙️ Processing {scene_name}...")
+def _signed(value: str) -> str:
+    """edge-tts wants an explicit sign: "0%" -> "+0%"."""
+    return value if value[0] in "+-" else f"+{value}"
+
+
+def build_scene(entry: dict, defaults: dict, position: int) -> dict:
+    name = str(entry.get("name") or f"scene_{position:02d}").strip()
+    text = str(entry.get("text") or "").strip()
+    voice = entry.get("voice") or defaults["voice"]
+    rate = entry.get("rate") or defaults["rate"]
+    pitch = entry.get("pitch") or defaults["pitch"]
+    if not _NAME_FORMAT.match(name):
+        raise ValueError(f"Scene {position}: name '{name}' may only use letters, digits, '_', '-' and '.'")
+    if not text:
+        raise ValueError(f"Scene '{name}' has no text")
+    if not _RATE_FORMAT.match(rate):
+        raise ValueError(f"Scene '{name}': rate must look like +5%, -5% or +0% (got '{rate}')")
+    if not _PITCH_FORMAT.match(pitch):
+        raise ValueError(f"Scene '{name}': pitch must look like +2Hz, -2Hz or +0Hz (got '{pitch}')")
+    return {"name": name, "text": text, "voice": voice, "rate": _signed(rate), "pitch": _signed(pitch)}
+
+
+def load_manifest(path: str, defaults: dict) -> list:
+    """
+    Reads scenes from a manifest.
+
+    JSON: a list of scene objects, {"defaults": {...}, "scenes": [...]}, or a
+    {"name": "text"} object. CSV: a header row with name,text and optionally
+    voice,rate,pitch columns. Scene objects take the same keys; missing
+    voice/rate/pitch fall back to the manifest's defaults, then the command line.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            entries = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and "scenes" in data:
+            defaults = {**defaults, **{k: v for k, v in data.get("defaults", {}).items() if k in defaults}}
+            data = data["scenes"]
+        if isinstance(data, dict):
+            entries = [{"name": name, "text": text} for name, text in data.items()]
+        else:
+            entries = data
+
+    built = [build_scene(entry, defaults, position) for position, entry in enumerate(entries, 1)]
+    names = [scene["name"] for scene in built]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate scene names: {', '.join(duplicates)}")
+    return built
+
 
+def scene_hash(scene: dict) -> str:
+    # Same content address the API's segment cache uses
+    return segment_cache_key("edge-tts", scene["voice"], scene["rate"], scene["pitch"], None, scene["text"])
+
+
+# -------------------------------------------------
+# RENDER STATE (which hash each output was rendered from)
+# -------------------------------------------------
+def load_state(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(out_dir: str, state: dict):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".partial", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".partial", path)
+
+
+# -------------------------------------------------
+# GENERATE SINGLE SCENE
+# -------------------------------------------------
+async def generate_scene(scene: dict, output_path: str) -> int:
+    """Streams one scene to a temp file and renames it into place. Returns the MP3 size."""
+    tmp_path = output_path + ".partial"
     communicate = edge_tts.Communicate(
-        text=text,
-        voice=VOICE,
-        rate=RATE,
-        pitch=PITCH
+        text=scene["text"],
+        voice=scene["voice"],
+        rate=scene["rate"],
+        pitch=scene["pitch"]
     )
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    f.write(chunk["data"])
+                    size += len(chunk["data"])
+        if size == 0:
+            raise edge_tts.exceptions.NoAudioReceived("No audio received")
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size
+
+
+def audio_seconds(path: str) -> float:
+    with open(path, "rb") as f:
+        return duration_seconds([header for _, header in iter_frames(f.read())])
+
+
+class BatchRenderer:
+    """Renders scenes with at most `concurrency` edge-tts sessions, retrying transient failures."""
+
+    def __init__(self, scene_list: list, out_dir: str, concurrency: int, retries: int, force: bool):
+        self.scenes = scene_list
+        self.out_dir = out_dir
+        self.retries = retries
+        self.force = force
+        self.state = load_state(out_dir)
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self.rendered = 0
+        self.skipped = 0
+        self.failed = []
+        self.audio_seconds = 0.0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    def output_path(self, scene: dict) -> str:
+        return os.path.join(self.out_dir, f"{scene['name']}.mp3")
+
+    def _progress(self, icon: str, scene: dict, detail: str):
+        done = self.rendered + self.skipped + len(self.failed)
+        elapsed = time.perf_counter() - self.started
+        rate = self.audio_seconds / elapsed if elapsed > 0 else 0.0
+        print(f"[{done}/{len(self.scenes)}] {icon} {scene['name']}: {detail} | {rate:.1f}x realtime")
+
+    async def _render(self, scene: dict):
+        path = self.output_path(scene)
+        digest = scene_hash(scene)
+        if not self.force and self.state.get(scene["name"]) == digest and os.path.exists(path):
+            self.skipped += 1
+            self._progress("⏭️", scene, "unchanged, skipped")
+            return
+
+        async with self._slots:
+            for attempt in range(self.retries + 1):
+                started = time.perf_counter()
+                try:
+                    size = await generate_scene(scene, path)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        self.failed.append(scene["name"])
+                        self._progress("❌", scene, f"failed after {attempt + 1} attempts: {e}")
+                        return
+                    delay = RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    print(f"⚠️ {scene['name']}: {type(e).__name__}: {e} - retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+        seconds = audio_seconds(path)
+        self.rendered += 1
+        self.audio_seconds += seconds
+        self.bytes += size
+        self.state[scene["name"]] = digest
+        save_state(self.out_dir, self.state)
+        self._progress("✅", scene, f"{seconds:.1f}s of audio in {time.perf_counter() - started:.1f}s")
+
+    async def run(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.started = time.perf_counter()
+        await asyncio.gather(*(self._render(scene) for scene in self.scenes))
+
+
+# -------------------------------------------------
+# CONCATENATION
+# -------------------------------------------------
+class _FileWriter:
+    """Minimal writer for Mp3Assembler: a local file with patch() support."""
+
+    def __init__(self, f):
+        self.f = f
+
+    async def write(self, data: bytes):
+        self.f.write(data)
+
+    async def patch(self, offset: int, data: bytes):
+        end = self.f.tell()
+        self.f.seek(offset)
+        self.f.write(data)
+        self.f.seek(end)
+
+
+async def concatenate(renderer: BatchRenderer, target: str) -> float:
+    """
+    Joins the scenes in manifest order into one MP3 with a single accurate
+    Xing header, and writes <target>.chapters.json with each scene's start
+    time and byte range. Returns the total duration.
+    """
+    tmp_path = target + ".partial"
+    chapters = []
+    with open(tmp_path, "wb") as f:
+        assembler = Mp3Assembler(_FileWriter(f))
+        for position, scene in enumerate(renderer.scenes):
+            path = renderer.output_path(scene)
+            if not os.path.exists(path):
+                print(f"⚠️ {scene['name']} has no audio, left out of {target}")
+                continue
+            with open(path, "rb") as scene_file:
+                await assembler.feed(scene_file.read())
+            await assembler.end_segment(position)
+            if assembler.segments and assembler.segments[-1]["index"] == position:
+                chapters.append({"name": scene["name"], **assembler.segments[-1]})
+        await assembler.finish()
+    os.replace(tmp_path, target)
+    with open(os.path.splitext(target)[0] + ".chapters.json", "w", encoding="utf-8") as f:
+        json.dump({"duration": round(assembler.duration, 3), "chapters": chapters}, f, indent=2, ensure_ascii=False)
+    return assembler.duration
 
-    await communicate.save(output_path)
-    print(f"✅ Saved: {output_path}")
 
 # -------------------------------------------------
 # MAIN FUNCTION
 # -------------------------------------------------
-async def main():
-    print(f"\n🔊 Generating audio for {len(scenes)} scenes")
-    print(f"Voice : {VOICE}")
-    print(f"Rate  : {RATE}")
-    print(f"Pitch : {PITCH}\n")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render story scenes to MP3 with edge-tts.")
+    parser.add_argument("manifest", nargs="?", help="JSON or CSV scene manifest (default: the built-in Kannada story)")
+    parser.add_argument("-o", "--out-dir", default=DEFAULT_OUT_DIR, help=f"where scene MP3s go (default: {DEFAULT_OUT_DIR}/)")
+    parser.add_argument("-j", "--concurrency", type=int, default=4, help="scenes rendered at the same time (default: 4)")
+    parser.add_argument("--retries", type=int, default=3, help="retries per scene on failure (default: 3)")
+    parser.add_argument("--voice", default=VOICE, help=f"default voice (default: {VOICE})")
+    parser.add_argument("--rate", default=RATE, help=f"default rate, e.g. -20%% (default: {RATE})")
+    parser.add_argument("--pitch", default=PITCH, help=f"default pitch, e.g. +2Hz (default: {PITCH})")
+    parser.add_argument("--concat", metavar="FILE", help="also join all scenes into this MP3")
+    parser.add_argument("--force", action="store_true", help="re-render scenes even if they are unchanged")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None) -> int:
+    args = parse_args(argv)
+    defaults = {"voice": args.voice, "rate": args.rate, "pitch": args.pitch}
+    try:
+        if args.manifest:
+            scene_list = load_manifest(args.manifest, defaults)
+        else:
+            scene_list = [build_scene({"name": name, "text": text}, defaults, i) for i, (name, text) in enumerate(scenes.items(), 1)]
+    except (OSError, ValueError) as e:
+        print(f"❌ Invalid manifest: {e}")
+        return 2
+
+    print(f"\n🔊 Rendering {len(scene_list)} scenes ({args.concurrency} at a time)")
+    print(f"Default voice : {args.voice}")
+    print(f"Default rate  : {args.rate}")
+    print(f"Default pitch : {args.pitch}\n")
+
+    renderer = BatchRenderer(scene_list, args.out_dir, args.concurrency, args.retries, args.force)
+    await renderer.run()
+
+    elapsed = time.perf_counter() - renderer.started
+    print(f"\n🎉 {renderer.rendered} rendered, {renderer.skipped} skipped, {len(renderer.failed)} failed in {elapsed:.1f}s")
+    if renderer.rendered:
+        print(f"   {renderer.audio_seconds:.1f}s of audio ({renderer.bytes / 1024:.0f} KB), "
+              f"{renderer.audio_seconds / elapsed:.1f}x realtime, {renderer.rendered / elapsed * 60:.1f} scenes/min")
+    print(f"📁 Output folder: {args.out_dir}/")
+
+    if args.concat:
+        total = await concatenate(renderer, args.concat)
+        print(f"📼 Joined story: {args.concat} ({total:.1f}s)")
 
-    for scene_name, text in scenes.items():
-        await generate_scene(scene_name, text)
+    if renderer.failed:
+        print(f"❌ Failed scenes: {', '.join(renderer.failed)} (run again to retry only those)")
+        return 1
+    return 0
 
-    print("\n🎉 All scenes generated successfully!")
-    print("📁 Output folder: outputs/")
 
 # -------------------------------------------------
 # RUN
 # -------------------------------------------------
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(asyncio.run(main()))
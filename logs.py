@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Structured, non-blocking logging.
+#
+# Code logs through get_logger(__name__), passing details as keyword fields:
+#
+#     log = get_logger(__name__)
+#     log.debug("Segment done", index=3, voice="kn-IN-SapnaNeural")
+#
+# Records are put on an in-memory queue and written (as JSON lines, or plain
+# text with LOG_FORMAT=text) by a background thread, so request handlers never
+# wait on stdout or disk. Each record carries the id of the request (or job)
+# it belongs to. Story text and secrets are redacted, long values truncated.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger levels, e.g. "api.synthesis=DEBUG,api.bhashini=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Share of DEBUG/INFO records kept per logger, e.g. "api.synthesis.segments=0.1".
+# Sampling is by request id, so a sampled request keeps all its events.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "api.synthesis.segments=0.1")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Errors are also appended here (by the logging thread); empty disables it
+LOG_ERROR_FILE = os.getenv("LOG_ERROR_FILE", "error.log")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+# Characters of story text shown in logs (0 = only its length and a hash)
+LOG_TEXT_PREVIEW_CHARS = int(os.getenv("LOG_TEXT_PREVIEW_CHARS", "0"))
+
+ROOT_LOGGER = "app"
+
+# Fields whose values are story text or secrets
+TEXT_FIELDS = {"text", "story", "line"}
+SECRET_FIELDS = {"password", "token", "access_token", "authorization", "x-api-key", "api_key", "secret"}
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_listener: Optional[QueueListener] = None
+_dropped = 0
+
+
+def _parse_mapping(value: str) -> Dict[str, str]:
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, setting = item.split("=", 1)
+            mapping[name.strip()] = setting.strip()
+    return mapping
+
+
+def redact_text(text: str) -> str:
+    """Story text as it appears in logs: its length and a short hash, plus an optional preview."""
+    digest = f"{zlib.crc32(text.encode('utf-8')):08x}"
+    if LOG_TEXT_PREVIEW_CHARS > 0:
+        preview = text[:LOG_TEXT_PREVIEW_CHARS] + ("…" if len(text) > LOG_TEXT_PREVIEW_CHARS else "")
+        return f"{preview} <{len(text)} chars #{digest}>"
+    return f"<{len(text)} chars #{digest}>"
+
+
+def _truncate(value: str) -> str:
+    if len(value) <= LOG_MAX_FIELD_CHARS:
+        return value
+    return value[:LOG_MAX_FIELD_CHARS] + f"… <{len(value) - LOG_MAX_FIELD_CHARS} more chars>"
+
+
+def clean_value(name: str, value):
+    """Redacts and truncates one field (dicts and lists recursively)."""
+    lowered = name.lower()
+    if lowered in SECRET_FIELDS:
+        return "<redacted>"
+    if isinstance(value, dict):
+        return {key: clean_value(str(key), item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [clean_value(name, item) for item in value]
+    if isinstance(value, str):
+        if lowered in TEXT_FIELDS:
+            return redact_text(value)
+        return _truncate(value)
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return _truncate(str(value))
+
+
+class StructuredLogger:
+    """Thin wrapper over a stdlib logger taking structured keyword fields."""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def _log(self, level: int, msg: str, exc_info, fields: Dict):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields}, stacklevel=3)
+
+    def debug(self, msg: str, **fields):
+        self._log(logging.DEBUG, msg, None, fields)
+
+    def info(self, msg: str, **fields):
+        self._log(logging.INFO, msg, None, fields)
+
+    def warning(self, msg: str, **fields):
+        self._log(logging.WARNING, msg, None, fields)
+
+    def error(self, msg: str, **fields):
+        self._log(logging.ERROR, msg, None, fields)
+
+    def exception(self, msg: str, **fields):
+        """ERROR with the current exception's traceback."""
+        self._log(logging.ERROR, msg, True, fields)
+
+    def is_enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class _SamplingFilter(logging.Filter):
+    """Keeps a configured share of DEBUG/INFO records per logger (longest name prefix wins)."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = {f"{ROOT_LOGGER}.{name}": rate for name, rate in rates.items()}
+        self._resolved: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            best = -1
+            for prefix, prefix_rate in self.rates.items():
+                if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+                    rate, best = prefix_rate, len(prefix)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0:
+            return True
+        request_id = request_id_var.get()
+        if request_id:
+            return zlib.crc32(request_id.encode("utf-8")) / 0xFFFFFFFF < rate
+        return random.random() < rate
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Enqueues records without formatting them; drops (and counts) records when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Runs on the caller's thread: capture context, leave formatting to the listener
+        record.request_id = request_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name[len(ROOT_LOGGER) + 1:],
+            "msg": _truncate(record.msg),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for name, value in getattr(record, "fields", {}).items():
+            entry[name] = clean_value(name, value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        ts = time.strftime("%H:%M:%S", time.localtime(record.created))
+        parts = [f"{ts} {record.levelname:<7} {record.name[len(ROOT_LOGGER) + 1:]}"]
+        if getattr(record, "request_id", None):
+            parts.append(f"[{record.request_id}]")
+        parts.append(_truncate(record.msg))
+        for name, value in getattr(record, "fields", {}).items():
+            parts.append(f"{name}={clean_value(name, value)}")
+        line = " ".join(parts)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def setup_logging():
+    """Installs the queue handler and starts the writer thread (once per process)."""
+    global _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else TextFormatter()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+    handlers = [stream]
+    if LOG_ERROR_FILE:
+        errors = logging.FileHandler(LOG_ERROR_FILE, encoding="utf-8", delay=True)
+        errors.setLevel(logging.ERROR)
+        errors.setFormatter(formatter)
+        handlers.append(errors)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(_SamplingFilter({name: float(rate) for name, rate in _parse_mapping(LOG_SAMPLE_RATES).items()}))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    for name, level in _parse_mapping(LOG_LEVELS).items():
+        logging.getLogger(f"{ROOT_LOGGER}.{name}").setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats() -> Dict:
+    return {"dropped_records": _dropped}
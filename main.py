@@ -1,12 +1,30 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse, PlainTextResponse
 import os
-from api import users, tts
-from database import get_database
+import re
+import time
+import logs
+import metrics
+from api import users, tts, jobs, bhashini, hls, providers, uploads
+from api.scheduler import scheduler
+from database import get_database, ensure_indexes, index_status
+from auth import user_cache
+from api.audio_cache import segment_cache
+from api import public_feed
+from api import outputs_gc
+from api.storage import storage
+
+logs.setup_logging()
+log = logs.get_logger("main")
 
 app = FastAPI(title="Dr Kathe TTS API")
 
+# Oversized uploads are refused before FastAPI spools the multipart body.
+# Added before CORS (so inside it): the 413 carries CORS headers and browsers can read it.
+app.add_middleware(uploads.UploadSizeLimit, path="/tts/upload")
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -14,6 +32,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read the pagination cursor and streamed audio location
+    expose_headers=["ETag", "X-Next-Cursor", "X-Audio-Url", "X-Audio-Filename",
+                    "X-Segment-Start", "X-Segment-Duration", "X-Request-ID", "Idempotent-Replayed"],
 )
 
 # Create outputs directory if not exists
@@ -21,11 +42,66 @@ if not os.path.exists("outputs"):
     os.makedirs("outputs")
 
 # Mount static files for audio access
-app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
+if storage.name == "local":
+    app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
+else:
+    # Audio lives in the bucket: send players straight there
+    @app.get("/outputs/{key:path}")
+    async def serve_output(key: str):
+        return RedirectResponse(await storage.read_url(key), status_code=307)
+
+@app.middleware("http")
+async def track_audio_plays(request: Request, call_next):
+    response = await call_next(request)
+    # Play times decide which audio the outputs sweeper evicts first.
+    # With S3 storage plays are answered with a 307 to the bucket.
+    if request.method == "GET" and response.status_code in (200, 206, 304, 307):
+        outputs_gc.note_request(request.url.path)
+    return response
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Route template, not the raw path, keeps the label set small
+    route = request.scope.get("route")
+    metrics.http_request_seconds.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code
+    )
+    return response
+
+# Client-supplied request ids are kept if they look like one
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    # Every log line written while handling the request (and by jobs it queues) carries this id
+    request_id = request.headers.get("x-request-id", "")
+    if not _REQUEST_ID.match(request_id):
+        request_id = logs.new_request_id()
+    logs.request_id_var.set(request_id)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+metrics.register_cache("auth_users", user_cache.stats)
+metrics.register_cache("segments", segment_cache.stats)
+metrics.register_cache("public_feed", public_feed.stats, misses_key="builds")
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: str = Header(None)):
+    """Prometheus scrape endpoint (set METRICS_TOKEN to require a bearer token)."""
+    if metrics.METRICS_TOKEN and authorization != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # Include Routers
 app.include_router(users.router)
 app.include_router(tts.router)
+app.include_router(hls.router)
 
 @app.on_event("startup")
 async def startup_db_client():
@@ -35,9 +111,35 @@ async def startup_db_client():
         from motor.motor_asyncio import AsyncIOMotorClient
         # We access the client through the db object's client property
         await db.client.admin.command('ping')
-        print("✅ DATABASE CONFIG: Database connected successfully!")
+        log.info("Database connected")
+
+        statuses = await ensure_indexes()
+        for name, state in statuses.items():
+            if state.startswith("failed"):
+                log.error("Database index failed", index=name, state=state)
+            else:
+                log.info("Database index ready", index=name, state=state)
     except Exception as e:
-        print(f"❌ DATABASE CONFIG: Database connection failed: {e}")
+        log.error("Database connection failed", error=str(e))
+
+    # Warm the Bhashini voice catalog off the request path
+    bhashini.start_voice_catalog_prefetch()
+
+    # Background render workers share the Mongo-backed job queue
+    jobs.start_workers(tts.render_story)
+
+    # Orphan cleanup and storage quotas
+    outputs_gc.start_sweeper()
+
+    metrics.start_loop_lag_monitor()
+
+@app.on_event("shutdown")
+async def shutdown_background_services():
+    await jobs.stop_workers()
+    await outputs_gc.stop_sweeper()
+    await metrics.stop_loop_lag_monitor()
+    await bhashini.close_http_client()
+    logs.shutdown_logging()
 
 @app.get("/")
 async def root():
@@ -49,7 +151,17 @@ async def root():
     return {
         "message": "Welcome to Dr Kathe TTS API",
         "status": "running",
-        "database": db_status
+        "database": db_status,
+        "indexes": index_status,
+        "caches": {
+            "auth_users": user_cache.stats(),
+            "segments": segment_cache.stats(),
+            "public_feed": public_feed.stats()
+        },
+        "storage": outputs_gc.stats(),
+        "providers": providers.health_report(),
+        "scheduler": scheduler.stats(),
+        "logging": logs.stats()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+import os
+import time
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from pymongo import monitoring
+import logs
+
+# Prometheus metrics, served in the text exposition format at GET /metrics.
+#
+# A small in-process registry (counters, gauges and histograms with labels)
+# rather than prometheus_client, to keep the dependency list short. Every
+# metric is defined in this module so the full list is in one place; the code
+# paths that feed them import what they need.
+
+# Optional bearer token required by GET /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SYNTHESIS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        # Updated from request handlers and from pymongo's monitoring threads
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        """The metric's exposition lines, without HELP/TYPE."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or read at scrape time from `collect` ((labels, value) pairs)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[Dict, float]]]] = None, kind: str = "gauge"):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+        # Values read from elsewhere may be counters (e.g. a cache's hit count)
+        self.kind = kind
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.collect is not None:
+            items = [(self._key(labels), value) for labels, value in self.collect()]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [count per bucket (non-cumulative, last is +Inf), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            else:
+                state[0][-1] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound if bound == float("inf") else float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def failure_reason(error: BaseException) -> str:
+    """Short, low-cardinality label for why a call failed."""
+    if isinstance(error, HTTPException):
+        return f"http_{error.status_code}"
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(error).__name__:
+        return "timeout"
+    if isinstance(error, ConnectionError) or "Connect" in type(error).__name__:
+        return "connection"
+    return type(error).__name__
+
+
+# -------------------------------------------------
+# API
+# -------------------------------------------------
+http_request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response headers were sent, per route template (streamed bodies continue after).",
+    ["method", "route", "status"]
+)
+
+# -------------------------------------------------
+# Synthesis
+# -------------------------------------------------
+segment_synthesis_seconds = Histogram(
+    "tts_segment_synthesis_seconds", "Time to synthesize one script segment.",
+    ["provider", "voice"], SYNTHESIS_BUCKETS
+)
+segment_failures = Counter("tts_segment_failures_total", "Segments that failed or produced no audio.", ["provider", "reason"])
+segments_per_request = Histogram("tts_segments_per_request", "Script segments per story.", ["mode"], COUNT_BUCKETS)
+audio_bytes = Counter("tts_audio_bytes_total", "MP3 bytes produced by finished stories.", ["mode"])
+generation_failures = Counter("tts_generation_failures_total", "Stories that failed as a whole.", ["mode", "reason"])
+coalesced_requests = Counter("tts_coalesced_requests_total", "Generate requests that joined an identical render in flight.")
+idempotent_replays = Counter("tts_idempotent_replays_total", "Generate requests answered from a remembered Idempotency-Key.")
+
+# -------------------------------------------------
+# Providers
+# -------------------------------------------------
+provider_breaker_state = Gauge("tts_provider_circuit_state", "Circuit breaker: 0 closed, 1 half-open, 2 open.", ["provider"])
+provider_first_audio_p95 = Gauge(
+    "tts_provider_first_audio_p95_seconds", "Recent p95 time to first audio (the hedging threshold).", ["provider"]
+)
+provider_failovers = Counter("tts_provider_failovers_total", "Segments moved to edge-tts.", ["provider", "reason"])
+provider_hedges = Counter("tts_provider_hedges_total", "Hedged calls, by which call answered first.", ["provider", "winner"])
+
+# -------------------------------------------------
+# Scheduler
+# -------------------------------------------------
+scheduler_active = Gauge("tts_scheduler_active_segments", "Segments holding a synthesis slot.")
+scheduler_queued = Gauge("tts_scheduler_queued_segments", "Segments waiting for a synthesis slot.")
+scheduler_queued_users = Gauge("tts_scheduler_queued_users", "Users with segments waiting for a synthesis slot.")
+scheduler_wait_seconds = Histogram("tts_scheduler_wait_seconds", "Time a segment waited for a synthesis slot.")
+scheduler_rejections = Counter("tts_scheduler_rejections_total", "Requests turned away with 429.", ["reason"])
+
+# -------------------------------------------------
+# Bhashini
+# -------------------------------------------------
+bhashini_request_seconds = Histogram(
+    "bhashini_request_seconds", "Time until Bhashini answered a synthesis call (response headers).", ["status"]
+)
+bhashini_retries = Counter("bhashini_retries_total", "Bhashini calls retried.", ["reason"])
+bhashini_failures = Counter("bhashini_failures_total", "Bhashini calls that failed after retries.", ["reason"])
+
+# -------------------------------------------------
+# Auth
+# -------------------------------------------------
+auth_token_checks = Counter("auth_token_checks_total", "Bearer token validations.", ["result"])
+auth_password_hash_seconds = Histogram(
+    "auth_password_hash_seconds", "bcrypt hash/verify time, including waiting for the pool.", ["operation"]
+)
+auth_logins = Counter("auth_logins_total", "Login attempts.", ["outcome"])
+auth_throttled = Counter("auth_throttled_total", "Login/register attempts rejected with 429.")
+
+# -------------------------------------------------
+# MongoDB
+# -------------------------------------------------
+mongo_command_seconds = Histogram("mongo_command_seconds", "MongoDB command latency.", ["command"])
+mongo_command_failures = Counter("mongo_command_failures_total", "MongoDB commands that failed.", ["command"])
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding the mongo_command_* metrics."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, command=event.command_name)
+        mongo_command_failures.inc(command=event.command_name)
+
+
+# -------------------------------------------------
+# Caches
+# -------------------------------------------------
+_caches: Dict[str, Tuple[Callable[[], Dict], str, str]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], Dict], hits_key: str = "hits", misses_key: str = "misses"):
+    """Exposes a cache's stats() hit/miss counts and hit ratio."""
+    _caches[name] = (stats, hits_key, misses_key)
+
+
+def _cache_values(key_index: int):
+    for name, (stats, *keys) in _caches.items():
+        values = stats()
+        if key_index < 0:
+            yield {"cache": name}, values.get("hit_ratio", 0.0)
+        else:
+            yield {"cache": name}, values.get(keys[key_index], 0)
+
+
+cache_hits = Gauge("cache_hits_total", "Cache hits.", ["cache"], lambda: _cache_values(0), kind="counter")
+cache_misses = Gauge("cache_misses_total", "Cache misses.", ["cache"], lambda: _cache_values(1), kind="counter")
+cache_hit_ratio = Gauge("cache_hit_ratio", "Cache hits / lookups since start.", ["cache"], lambda: _cache_values(-1))
+
+# -------------------------------------------------
+# Logging
+# -------------------------------------------------
+log_records_dropped = Gauge(
+    "log_records_dropped_total", "Log records dropped because the logging queue was full.",
+    collect=lambda: [({}, logs.stats()["dropped_records"])], kind="counter"
+)
+
+# -------------------------------------------------
+# Event loop
+# -------------------------------------------------
+event_loop_lag_seconds = Histogram(
+    "event_loop_lag_seconds", "How late a periodic timer fired on the event loop.", buckets=LAG_BUCKETS
+)
+_last_loop_lag = 0.0
+event_loop_lag_last = Gauge(
+    "event_loop_lag_last_seconds", "Lag of the most recent event loop probe.", collect=lambda: [({}, _last_loop_lag)]
+)
+_loop_monitor: Optional[asyncio.Task] = None
+
+
+def loop_lag() -> float:
+    """Lag of the most recent probe, in seconds."""
+    return _last_loop_lag
+
+
+async def _watch_loop_lag(interval: float):
+    global _last_loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        _last_loop_lag = max(0.0, loop.time() - started - interval)
+        event_loop_lag_seconds.observe(_last_loop_lag)
+
+
+def start_loop_lag_monitor(interval: float = EVENT_LOOP_LAG_INTERVAL):
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = asyncio.create_task(_watch_loop_lag(interval))
+
+
+async def stop_loop_lag_monitor():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        await asyncio.gather(_loop_monitor, return_exceptions=True)
+        _loop_monitor = None
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
@@ -82,6 +82,7 @@ class TTSSegment(BaseModel):
     pitch: int
     style_instruction: Optional[str] = None
     voice_style: Optional[str] = "Neutral"  # For Bhashini: Neutral, Book, Conversational, etc.
+    is_premium: Optional[bool] = None  # Per-segment provider override; None follows TTSRequest.is_premium
 
 class TTSRequest(BaseModel):
     text: Optional[str] = None
@@ -89,6 +90,18 @@ class TTSRequest(BaseModel):
     segments: Optional[List[TTSSegment]] = None
     title: Optional[str] = None
     is_premium: bool = False
+    background: bool = False  # Queue as a job and poll /tts/jobs/{id} instead of waiting
+    hls: Optional[bool] = None  # HLS rendition: None = only for long stories, True/False = always/never
+    failover: Optional[bool] = None  # Premium lines may fall back to a standard voice when Bhashini is down; None = TTS_FAILOVER
+
+class AudioSegment(BaseModel):
+    """Where one script segment lives in the story's MP3 (see GET /tts/history/{id}/segments/{index})."""
+    index: int  # Script segment index
+    start: float  # Seconds from the start of the story
+    duration: float
+    offset: int  # Byte range in the MP3 file
+    length: int
+    frames: int
 
 class TTSHistory(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
@@ -97,8 +110,34 @@ class TTSHistory(BaseModel):
     text: str
     settings: TTSSettings
     audio_path: str
+    hls_playlist_path: Optional[str] = None  # hls/<story>/index.m3u8, served at /hls/<story>/index.m3u8
+    duration_seconds: Optional[float] = None
+    segment_index: Optional[List[AudioSegment]] = None  # Not stored for uploads
+    audio_bytes: Optional[int] = None  # MP3 plus HLS rendition, counted against the user's quota
     is_public: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_accessed_at: datetime = Field(default_factory=datetime.utcnow)
+    evicted_at: Optional[datetime] = None  # Audio removed to free space; the record is kept
+
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
+
+class TTSHistorySummary(BaseModel):
+    """Library listing entry; `text` is only filled when the client asks for it."""
+    id: PyObjectId = Field(alias="_id")
+    user_id: str
+    title: Optional[str] = None
+    text: Optional[str] = None
+    settings: TTSSettings
+    audio_path: str
+    hls_playlist_path: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    audio_bytes: Optional[int] = None
+    is_public: bool = False
+    created_at: datetime
+    evicted_at: Optional[datetime] = None
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -113,9 +152,30 @@ class PublicStory(BaseModel):
     text: str
     settings: TTSSettings
     audio_path: str
+    hls_playlist_path: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    segment_index: Optional[List[AudioSegment]] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     model_config = ConfigDict(
         populate_by_name=True,
         arbitrary_types_allowed=True,
     )
+
+class PublicStorySummary(BaseModel):
+    """Public feed entry; `text` is only filled when the client asks for it."""
+    id: PyObjectId = Field(alias="_id")
+    original_history_id: str
+    user_id: str
+    title: Optional[str] = None
+    text: Optional[str] = None
+    settings: TTSSettings
+    audio_path: str
+    hls_playlist_path: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    created_at: datetime
+
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
@@ -0,0 +1,122 @@
+"""
+Offline checks of the provider circuit breaker and hedging (api/providers.py).
+
+    python -m pytest -q test_providers.py    (or: python test_providers.py)
+"""
+import os
+import sys
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("SEGMENT_CACHE_DIR", tempfile.mkdtemp(prefix="segment_cache_"))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from edge_tts.exceptions import NoAudioReceived
+from api import providers
+
+AUDIO = b"\xff\xfb\x90\x00" + b"\x00" * 100
+
+
+def _segment(text: str, voice: str = "en-US-GuyNeural") -> dict:
+    return {"provider": "edge-tts", "text": text, "voice": voice, "speed": "+0%", "pitch": "+0Hz"}
+
+
+async def _collect(segment: dict) -> bytes:
+    return b"".join([chunk async for chunk in providers.synthesize_segment(segment)])
+
+
+def _fresh_edge_health():
+    edge = providers.PROVIDERS["edge-tts"]
+    edge.health = providers.ProviderHealth(edge.name)
+    return edge.health
+
+
+async def _fake_edge_tts(segment: dict):
+    text = segment["text"]
+    if not any(ch.isalnum() for ch in text):
+        raise NoAudioReceived("No audio was received. Please verify that your parameters are correct.")
+    if segment["voice"] == "bad-voice":
+        raise ValueError(f"Invalid voice '{segment['voice']}'.")
+    if text.startswith("down"):
+        raise ConnectionError("service unreachable")
+    yield AUDIO
+
+
+def test_bad_segments_do_not_trip_the_breaker_for_other_users():
+    async def run():
+        providers.edge_tts_stream = _fake_edge_tts
+        health = _fresh_edge_health()
+        # One user's script: punctuation-only lines and a malformed voice
+        bad = [_segment("..."), _segment("* * *"), _segment("—"), _segment("Hello", voice="bad-voice")]
+        for segment in bad * 3:
+            try:
+                await _collect(segment)
+            except (NoAudioReceived, ValueError):
+                pass
+        assert health.state == providers.CLOSED
+        assert health.failures == 0
+        # Another user's ordinary line still goes out
+        assert await _collect(_segment("Once upon a time.")) == AUDIO
+
+    asyncio.run(run())
+
+
+def test_provider_failures_still_open_the_breaker():
+    async def run():
+        providers.edge_tts_stream = _fake_edge_tts
+        health = _fresh_edge_health()
+        for i in range(providers.BREAKER_FAILURES):
+            try:
+                await _collect(_segment(f"down {i}"))
+            except ConnectionError:
+                pass
+        assert health.state == providers.OPEN
+        try:
+            await _collect(_segment("Once upon a time."))
+        except providers.ProviderUnavailable:
+            pass
+        else:
+            raise AssertionError("an open circuit should fail fast")
+
+    asyncio.run(run())
+
+
+def test_hedge_wins_when_both_calls_finish_together_and_primary_failed():
+    async def run():
+        released = asyncio.Event()
+        calls = []
+
+        async def racing(segment: dict):
+            call = len(calls)
+            calls.append(call)
+            await released.wait()
+            if call == 0:
+                raise ConnectionError("primary failed")
+            yield AUDIO
+
+        providers.edge_tts_stream = racing
+        health = _fresh_edge_health()
+        for _ in range(providers.MIN_LATENCY_SAMPLES):
+            health.record_latency(0.01)
+
+        async def release_later():
+            # Both calls are waiting on the same event, so they finish in the same loop iteration
+            while len(calls) < 2:
+                await asyncio.sleep(0.005)
+            released.set()
+
+        releaser = asyncio.create_task(release_later())
+        audio = await _collect(_segment("Hi.", voice="en-US-AriaNeural"))
+        await releaser
+        assert audio == AUDIO
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"ok  {name}")